@@ -1,17 +1,21 @@
 import requests, time
 import os
-from flask import Flask, request, make_response, jsonify, send_file
+from flask import Flask, request, make_response, jsonify, send_file, Response, stream_with_context
 from requests.exceptions import ConnectionError, HTTPError
 from werkzeug.exceptions import NotFound
 from io import BytesIO
+from urllib.parse import urlencode
+from image_proxy import serve_image
 
 
 
-ALLOWED_GACHA_SYS_OP ={'add_gacha', 'delete_gacha', 'update_gacha', 'get_gacha_collection'}
+ALLOWED_GACHA_SYS_OP ={'add_gacha', 'delete_gacha', 'update_gacha', 'get_gacha_collection', 'list_gachas', 'import_gachas'}
 ADD_URL = 'https://gachasystem:5004/add_gacha'
 DELETE_GACHA_URL = 'https://gachasystem:5004/delete_gacha'
 UPDATE_GACHA_URL = 'https://gachasystem:5004/update_gacha'
 GET_GACHA_COLL_URL = 'https://gachasystem:5004/get_gacha_collection'
+LIST_GACHAS_URL = 'https://gachasystem:5004/list_gachas'
+IMPORT_GACHAS_URL = 'https://gachasystem:5004/import_gachas'
 GACHA_IMAGE_URL = 'https://gachasystem:5004/uploads/'
 
 ALLOWED_AUTH_OP ={'signup', 'login', 'logout', 'delete', 'newToken'}
@@ -20,6 +24,7 @@ LOGIN_URL = 'https://auth_service:5002/login'
 LOGOUT_URL = 'https://auth_service:5002/logout'
 DELETE_URL = 'https://auth_service:5002/delete'
 NEWTOKEN_URL = 'https://auth_service:5002/newToken'
+BULK_SIGNUP_URL = 'https://auth_service:5002/bulk_signup'
 
 
 ALLOWED_AUCTION_OP = {'see', 'create', 'modify', 'bid','gacha_receive', 'auction_lost', 'auction_terminated'} 
@@ -29,6 +34,9 @@ MODIFY_AUCTION_URL = f'{AUCTION_BASE_URL}/modify'
 
 PROFILE_IMAGE_URL = 'https://profile_setting:5003/uploads/'
 
+EXPORT_TRANS_URL = 'https://payment_service:5006/exportTrans'
+USER_ROLLUPS_URL = 'https://payment_service:5006/userRollups'
+
 
 
 
@@ -102,24 +110,53 @@ profile_circuit_breaker = CircuitBreaker()
 payment_circuit_breaker = CircuitBreaker()
 
 
-# Per gestione immagini
-def get_mime_type(extension):
-    mime_types = {
-        'jpg': 'image/jpeg',
-        'jpeg': 'image/jpeg',
-        'png': 'image/png',
-        'gif': 'image/gif',
-        'bmp': 'image/bmp',
-        'webp': 'image/webp',
-    }
-    return mime_types.get(extension.lower(), 'application/octet-stream')  # Tipo predefinito se non trovato
-
-
 app = Flask(__name__, instance_relative_config=True)
 
 def create_app():
     return app
 
+# Le risposte in streaming (NDJSON/CSV) non passano dal circuit breaker, che si aspetta un unico
+# body JSON: il contenuto viene inoltrato al client man mano che arriva dal servizio.
+def proxy_stream(method, url, op_name, **kwargs):
+    jwt_token = request.headers.get('Authorization')
+    headers = {
+        'Authorization' : jwt_token
+    }
+    try:
+        upstream = requests.request(method, url, headers=headers, stream=True, verify=False, **kwargs)
+    except requests.exceptions.ConnectionError as e:
+        return jsonify({'Error': f'Error calling the service: {str(e)}'}), 503
+    if upstream.status_code != 200:
+        return jsonify({'Error' : f'Error during {op_name} {upstream.text}'}), upstream.status_code
+    response_headers = {}
+    if 'Content-Disposition' in upstream.headers:
+        response_headers['Content-Disposition'] = upstream.headers['Content-Disposition']
+    return Response(stream_with_context(upstream.iter_content(chunk_size=None)),
+                    mimetype=upstream.headers.get('Content-Type'), headers=response_headers)
+
+# SOLO ADMIN
+@app.route('/auth_service/bulk_signup', methods=['POST'])
+def bulk_signup():
+    return proxy_stream('post', BULK_SIGNUP_URL, 'bulk signup', json=request.get_json())
+
+# SOLO ADMIN
+@app.route('/payment_service/exportTrans', methods=['GET'])
+def export_trans():
+    return proxy_stream('get', EXPORT_TRANS_URL, 'transactions export', params=request.args)
+
+# SOLO ADMIN
+@app.route('/payment_service/userRollups', methods=['GET'])
+def user_rollups():
+    jwt_token = request.headers.get('Authorization')
+    headers = {
+        'Authorization' : jwt_token
+    }
+    url = f'{USER_ROLLUPS_URL}?{urlencode(request.args)}'
+    response, status_code = payment_circuit_breaker.call('get', url, {}, headers, {}, False)
+    if status_code != 200:
+        return jsonify({'Error' : f'Error during user rollups op {response}'}), status_code
+    return make_response(jsonify(response), status_code)
+
 @app.route('/auth_service/<op>', methods=['POST', 'DELETE', 'GET'])
 def auth(op):
     if op not in ALLOWED_AUTH_OP:
@@ -243,19 +280,7 @@ def auction_service(op):
 @app.route('/images_gacha/uploads/<name>', methods=['GET'])
 # ENTRAMBI
 def gacha_image(name):
-    url = GACHA_IMAGE_URL + name
-    file_extension = os.path.splitext(name)[1][1:]
-    mime_type = get_mime_type(file_extension)
-    jwt_token = request.headers.get('Authorization')
-    headers = {
-        'Authorization' : jwt_token
-    }
-    content, status = gacha_sys_circuit_breaker.call('get', url, {}, headers, {}, False)
-    if status == 200:
-        file = BytesIO(content)
-        return send_file(file, mimetype=mime_type)
-    else:
-        return jsonify({'Error' : f'Error during gacha image op '}), status
+    return serve_image(gacha_sys_circuit_breaker, GACHA_IMAGE_URL, name, 'gacha image')
 
 @app.route('/gachasystem_service/<op>', methods=['POST', 'DELETE', 'PATCH', 'GET'])
 def gachasystem(op):
@@ -282,6 +307,20 @@ def gachasystem(op):
             'Authorization' : jwt_token
         }
     # SOLO ADMIN
+    elif op == 'import_gachas':
+        # archivio zip con manifest.json e immagini, inoltrato in streaming
+        if 'archive' not in request.files:
+            files = {}
+        else:
+            file = request.files['archive']
+            files = {'archive': (file.filename, file.stream, file.mimetype)}
+        url = IMPORT_GACHAS_URL
+        params = {}
+        jwt_token = request.headers.get('Authorization')
+        headers = {
+            'Authorization' : jwt_token
+        }
+    # SOLO ADMIN
     elif op == 'delete_gacha':
         gacha_name = request.form.get('gacha_name')
         url = DELETE_GACHA_URL
@@ -323,8 +362,16 @@ def gachasystem(op):
         headers = {
             'Authorization' : jwt_token
         }
+    # ENTRAMBI
+    elif op == 'list_gachas':
+        # filtri, ordinamento e cursore passano in query string
+        url = f'{LIST_GACHAS_URL}?{urlencode(request.args)}'
+        jwt_token = request.headers.get('Authorization')
+        headers = {
+            'Authorization' : jwt_token
+        }
 
-    if op == 'add_gacha':
+    if op in ('add_gacha', 'import_gachas'):
         response, status = gacha_sys_circuit_breaker.call('post', url, params, headers, files, False)
     elif op == 'delete_gacha':
         response, status = gacha_sys_circuit_breaker.call('delete', url, params, headers, {}, True)
@@ -335,6 +382,11 @@ def gachasystem(op):
         if status != 200:
             return jsonify({'Error' : f'Error during get gacha collection op {response}'}), status
         return jsonify(response), status
+    elif op == 'list_gachas':
+        response, status = gacha_sys_circuit_breaker.call('get', url, {}, headers, {}, False)
+        if status != 200:
+            return jsonify({'Error' : f'Error during list gachas op {response}'}), status
+        return jsonify(response), status
     if status != 200:
         return jsonify({'Error' : f'Error in gacha system op {response}'}), status
     return jsonify(response), status
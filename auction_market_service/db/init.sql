@@ -4,8 +4,8 @@ CREATE TABLE IF NOT EXISTS auctions (
     gacha_name VARCHAR(50) NOT NULL,
     seller_username VARCHAR(50) NOT NULL,
     winner_username VARCHAR(50) DEFAULT NULL,
-    current_bid FLOAT DEFAULT 0.0,
-    base_price FLOAT NOT NULL,
+    current_bid BIGINT DEFAULT 0,  -- centesimi
+    base_price BIGINT NOT NULL,  -- centesimi
     end_date TIMESTAMP NOT NULL,
     status VARCHAR(10) DEFAULT 'active'
 );
@@ -15,7 +15,7 @@ CREATE TABLE IF NOT EXISTS bids (
     id SERIAL PRIMARY KEY,
     auction_id INTEGER NOT NULL,
     username  VARCHAR(50) NOT NULL,
-    bid_amount FLOAT NOT NULL,
+    bid_amount BIGINT NOT NULL,  -- centesimi
     bid_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (auction_id) REFERENCES auctions(id) ON DELETE CASCADE
 );
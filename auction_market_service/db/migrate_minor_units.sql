@@ -0,0 +1,12 @@
+-- Migrazione dei database esistenti agli importi in centesimi interi (BIGINT).
+-- Da eseguire una volta sola, a servizio fermo, insieme a payment_service/db/migrate_minor_units.sql:
+--   docker compose exec -T auction_db psql -U user -d auction_db < auction_market_service/db/migrate_minor_units.sql
+BEGIN;
+
+ALTER TABLE auctions ALTER COLUMN current_bid DROP DEFAULT;
+ALTER TABLE auctions ALTER COLUMN current_bid TYPE BIGINT USING round(current_bid::numeric * 100);
+ALTER TABLE auctions ALTER COLUMN current_bid SET DEFAULT 0;
+ALTER TABLE auctions ALTER COLUMN base_price TYPE BIGINT USING round(base_price::numeric * 100);
+ALTER TABLE bids ALTER COLUMN bid_amount TYPE BIGINT USING round(bid_amount::numeric * 100);
+
+COMMIT;
@@ -1,5 +1,6 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert
 import jwt
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
 # from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
@@ -8,7 +9,9 @@ import requests , time
 import os
 import datetime
 import uuid
+import json
 import re  # Per sanitizzare input
+from concurrent.futures import ThreadPoolExecutor
 
 
 app = Flask(__name__)
@@ -19,6 +22,17 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 private_key_path = os.getenv("PRIVATE_KEY_PATH")
 public_key_path = os.getenv("PUBLIC_KEY_PATH")
 
+# Provisioning massivo degli utenti (seeding per i test di carico)
+BULK_SIGNUP_BATCH_SIZE = int(os.getenv("BULK_SIGNUP_BATCH_SIZE", "500"))
+BULK_SIGNUP_MAX_USERS = int(os.getenv("BULK_SIGNUP_MAX_USERS", "100000"))
+# /newBalances e' idempotente (ON CONFLICT DO NOTHING): dopo un errore 5xx la chiamata viene ripetuta
+BULK_SIGNUP_BALANCE_RETRIES = int(os.getenv("BULK_SIGNUP_BALANCE_RETRIES", "3"))
+BULK_SIGNUP_RETRY_DELAY = float(os.getenv("BULK_SIGNUP_RETRY_DELAY_SECONDS", "1"))
+BCRYPT_DEFAULT_ROUNDS = 12
+BCRYPT_MIN_ROUNDS = 4
+# bcrypt rilascia il GIL durante l'hashing, quindi un pool di thread basta per usare tutti i core
+hash_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+
 db = SQLAlchemy(app)
 # bcrypt = Bcrypt(app)
 #jwt = JWTManager(app)
@@ -144,8 +158,7 @@ def signup():
     user = User.query.filter_by(username=username).first()
     if user:
         return jsonify({'Error': f'User {username} already present'}), 422   
-    salt = bcrypt.gensalt().decode('utf-8')  # Genera il salt
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt.encode('utf-8')).decode('utf-8')
+    salt, hashed_password = hash_password(password)  # Genera il salt e l'hash
     
     # Creazione del nuovo utente
     new_user = User(username=username, password=hashed_password, role=role, salt=salt)
@@ -180,6 +193,150 @@ def signup():
     return jsonify({"msg": "Account created successfully", "profile_message": res.get('message')}), 200
 
 
+def hash_password(password, rounds=BCRYPT_DEFAULT_ROUNDS):
+    """Restituisce la coppia (salt, hash) nello stesso formato usato da /signup."""
+    salt = bcrypt.gensalt(rounds=rounds).decode('utf-8')
+    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt.encode('utf-8')).decode('utf-8')
+    return salt, hashed_password
+
+# Endpoint (solo admin) per creare molti utenti con una sola richiesta.
+# La risposta e' uno stream NDJSON: una riga di progresso per ogni batch e una riga finale di riepilogo.
+@app.route('/bulk_signup', methods=['POST'])
+def bulk_signup():
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        decoded_token = jwt.decode(access_token, public_key, algorithms=["RS256"], audience="auth_service")
+        if decoded_token.get("scope") != "admin":
+            return jsonify({"error": "Unauthorized action for the user"}), 403
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    data = request.get_json()
+    if not data or not isinstance(data.get('users'), list) or not data['users']:
+        return jsonify({"Error": "Missing or empty 'users' list"}), 400
+    if len(data['users']) > BULK_SIGNUP_MAX_USERS:
+        return jsonify({"Error": f"Too many users, max {BULK_SIGNUP_MAX_USERS} per request"}), 400
+
+    # Gli account di seeding possono usare meno round di bcrypt: il costo e' salvato nel salt,
+    # quindi il login continua a funzionare senza modifiche
+    rounds = data.get('bcrypt_rounds', BCRYPT_DEFAULT_ROUNDS)
+    if not isinstance(rounds, int) or not BCRYPT_MIN_ROUNDS <= rounds <= BCRYPT_DEFAULT_ROUNDS:
+        return jsonify({"Error": f"bcrypt_rounds must be an integer between {BCRYPT_MIN_ROUNDS} and {BCRYPT_DEFAULT_ROUNDS}"}), 400
+
+    # Validazione di tutti gli utenti prima di iniziare lo stream
+    valid_users = []
+    rejected = []
+    seen = set()
+    for item in data['users']:
+        if not isinstance(item, dict):
+            rejected.append({"user": item, "error": "Invalid user entry"})
+            continue
+        username = sanitize_input(item.get('username'))
+        password = item.get('password')
+        email = item.get('email')
+        if not username or not password or not email:
+            rejected.append({"username": username, "error": "Missing parameters"})
+        elif not validate_email(email):
+            rejected.append({"username": username, "error": "Invalid email format"})
+        elif username in seen:
+            rejected.append({"username": username, "error": "Duplicate username in request"})
+        else:
+            seen.add(username)
+            valid_users.append({'username': username, 'password': password, 'email': email})
+
+    def remove_users(users):
+        """Elimina gli utenti appena inseriti (compensazione quando il provisioning a valle fallisce)."""
+        User.query.filter(User.username.in_([u['username'] for u in users])).delete(synchronize_session=False)
+        db.session.commit()
+
+    def generate():
+        created_total = 0
+        failed = list(rejected)
+        without_balance = []
+        batches = [valid_users[i:i + BULK_SIGNUP_BATCH_SIZE] for i in range(0, len(valid_users), BULK_SIGNUP_BATCH_SIZE)]
+        # L'hashing del batch successivo parte mentre il batch corrente viene scritto sul db e propagato
+        next_hashes = hash_executor.map(hash_password, [u['password'] for u in batches[0]], [rounds] * len(batches[0])) if batches else None
+        for index, batch in enumerate(batches):
+            hashes = list(next_hashes)
+            if index + 1 < len(batches):
+                following = batches[index + 1]
+                next_hashes = hash_executor.map(hash_password, [u['password'] for u in following], [rounds] * len(following))
+
+            rows = [
+                {'username': user['username'], 'password': hashed, 'salt': salt, 'role': 'user'}
+                for user, (salt, hashed) in zip(batch, hashes)
+            ]
+            stmt = insert(User.__table__).values(rows).on_conflict_do_nothing(index_elements=['username']).returning(User.username)
+            try:
+                inserted = {row[0] for row in db.session.execute(stmt)}
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                failed += [{"username": u['username'], "error": f"Database error: {str(e)}"} for u in batch]
+                yield json.dumps({"batch": index + 1, "batches": len(batches), "created": created_total, "error": "Database error"}) + "\n"
+                continue
+
+            failed += [{"username": u['username'], "error": "User already present"} for u in batch if u['username'] not in inserted]
+            new_users = [u for u in batch if u['username'] in inserted]
+            batch_error = None
+            skipped = []
+            if new_users:
+                params = {'profiles': [{'username': u['username'], 'email': u['email']} for u in new_users]}
+                res, status = profile_circuit_breaker.call('post', 'https://profile_setting:5003/create_profiles', params, {}, {}, True)
+                if status != 200:
+                    # Profili non creati: gli utenti del batch vengono rimossi, cosi' non restano account senza
+                    # profilo e possono essere inviati di nuovo con un'altra richiesta
+                    remove_users(new_users)
+                    batch_error = f'Failed to create profiles, accounts not created: {res}'
+                else:
+                    # Profili saltati da profile_setting (email o username gia' usati): niente bilancio e l'utente
+                    # appena inserito viene rimosso, cosi' non resta un account senza profilo
+                    skipped_names = set(res.get('skipped', []))
+                    skipped = [u for u in new_users if u['username'] in skipped_names]
+                    if skipped:
+                        remove_users(skipped)
+                        failed += [{"username": u['username'], "error": "Profile already present (email or username in use)"} for u in skipped]
+                        new_users = [u for u in new_users if u['username'] not in skipped_names]
+                    if new_users:
+                        params = {'usernames': [u['username'] for u in new_users]}
+                        for attempt in range(BULK_SIGNUP_BALANCE_RETRIES + 1):
+                            res, status = payment_circuit_breaker.call('post', 'https://payment_service:5006/newBalances', params, {}, {}, True)
+                            if status < 500 or attempt == BULK_SIGNUP_BALANCE_RETRIES:
+                                break
+                            time.sleep(BULK_SIGNUP_RETRY_DELAY)
+                        if status != 200:
+                            # Account e profili esistono gia': restano, e vengono riportati in "without_balance"
+                            # per ricreare i bilanci con /newBalances (idempotente) quando payment_service risponde
+                            batch_error = f'Failed to create user balances: {res}'
+                            without_balance += [u['username'] for u in new_users]
+            if batch_error:
+                failed += [{"username": u['username'], "error": batch_error} for u in new_users]
+            else:
+                created_total += len(new_users)
+            progress = {"batch": index + 1, "batches": len(batches), "created": created_total}
+            if skipped:
+                progress["skipped"] = [u['username'] for u in skipped]
+            if batch_error:
+                progress["error"] = batch_error
+            yield json.dumps(progress) + "\n"
+
+        summary = {"msg": "Bulk signup completed", "requested": len(data['users']), "created": created_total, "failed": failed}
+        if without_balance:
+            summary["without_balance"] = without_balance
+        yield json.dumps(summary) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 # Endpoint per il login
 @app.route('/login', methods=['POST'])
 def login():
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 # from flask_sqlalchemy import SQLAlchemy
 import jwt
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
@@ -8,6 +8,7 @@ import requests , time
 import os
 import datetime
 import uuid
+import json
 import re  # Per sanitizzare input
 
 
@@ -19,6 +20,11 @@ app = Flask(__name__)
 private_key_path = os.getenv("PRIVATE_KEY_PATH")
 public_key_path = os.getenv("PUBLIC_KEY_PATH")
 
+BULK_SIGNUP_BATCH_SIZE = 500
+BULK_SIGNUP_MAX_USERS = 100000
+BCRYPT_DEFAULT_ROUNDS = 12
+BCRYPT_MIN_ROUNDS = 4
+
 # db = SQLAlchemy(app)
 # bcrypt = Bcrypt(app)
 #jwt = JWTManager(app)
@@ -189,7 +195,110 @@ def signup():
     if status != 200:
         return jsonify({'Error': f'Failed to create user balance: {x}'}), 500
     return jsonify({"msg": "Account created successfully", "profile_message": res.get('message')}), 200
-   
+
+# Funzioni mock per /bulk_signup: "existing_user" e' gia' presente, un batch con username che iniziano per
+# "noprofile" fa fallire profile_setting e uno con username che iniziano per "nobalance" fa fallire payment_service
+def mock_insert_users(usernames):
+    return {u for u in usernames if u != "existing_user"}
+
+def mock_remove_users(usernames):
+    return len(usernames)
+
+def mock_create_profiles(usernames):
+    if any(u.startswith("noprofile") for u in usernames):
+        return {'error': 'Error calling the service'}, 503
+    return {'message': f'{len(usernames)} profiles created successfully', 'created': usernames, 'skipped': []}, 200
+
+def mock_create_balances(usernames):
+    if any(u.startswith("nobalance") for u in usernames):
+        return {'Error': 'Error calling the service'}, 503
+    return {'msg': f'Corretcly created {len(usernames)} balances', 'created': usernames, 'skipped': []}, 200
+
+@app.route('/bulk_signup', methods=['POST'])
+def bulk_signup():
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        decoded_token = jwt.decode(access_token, public_key, algorithms=["RS256"], audience="auth_service")
+        if decoded_token.get("scope") != "admin":
+            return jsonify({"error": "Unauthorized action for the user"}), 403
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    data = request.get_json()
+    if not data or not isinstance(data.get('users'), list) or not data['users']:
+        return jsonify({"Error": "Missing or empty 'users' list"}), 400
+    if len(data['users']) > BULK_SIGNUP_MAX_USERS:
+        return jsonify({"Error": f"Too many users, max {BULK_SIGNUP_MAX_USERS} per request"}), 400
+    rounds = data.get('bcrypt_rounds', BCRYPT_DEFAULT_ROUNDS)
+    if not isinstance(rounds, int) or not BCRYPT_MIN_ROUNDS <= rounds <= BCRYPT_DEFAULT_ROUNDS:
+        return jsonify({"Error": f"bcrypt_rounds must be an integer between {BCRYPT_MIN_ROUNDS} and {BCRYPT_DEFAULT_ROUNDS}"}), 400
+
+    valid_users = []
+    rejected = []
+    seen = set()
+    for item in data['users']:
+        if not isinstance(item, dict):
+            rejected.append({"user": item, "error": "Invalid user entry"})
+            continue
+        username = sanitize_input(item.get('username'))
+        password = item.get('password')
+        email = item.get('email')
+        if not username or not password or not email:
+            rejected.append({"username": username, "error": "Missing parameters"})
+        elif not validate_email(email):
+            rejected.append({"username": username, "error": "Invalid email format"})
+        elif username in seen:
+            rejected.append({"username": username, "error": "Duplicate username in request"})
+        else:
+            seen.add(username)
+            valid_users.append(username)
+
+    def generate():
+        created_total = 0
+        failed = list(rejected)
+        without_balance = []
+        batches = [valid_users[i:i + BULK_SIGNUP_BATCH_SIZE] for i in range(0, len(valid_users), BULK_SIGNUP_BATCH_SIZE)]
+        for index, batch in enumerate(batches):
+            inserted = mock_insert_users(batch)
+            failed += [{"username": u, "error": "User already present"} for u in batch if u not in inserted]
+            new_users = [u for u in batch if u in inserted]
+            batch_error = None
+            if new_users:
+                res, status = mock_create_profiles(new_users)
+                if status != 200:
+                    # come in app.py: senza profili gli utenti del batch vengono rimossi
+                    mock_remove_users(new_users)
+                    batch_error = f'Failed to create profiles, accounts not created: {res}'
+                else:
+                    res, status = mock_create_balances(new_users)
+                    if status != 200:
+                        batch_error = f'Failed to create user balances: {res}'
+                        without_balance += new_users
+            if batch_error:
+                failed += [{"username": u, "error": batch_error} for u in new_users]
+            else:
+                created_total += len(new_users)
+            progress = {"batch": index + 1, "batches": len(batches), "created": created_total}
+            if batch_error:
+                progress["error"] = batch_error
+            yield json.dumps(progress) + "\n"
+
+        summary = {"msg": "Bulk signup completed", "requested": len(data['users']), "created": created_total, "failed": failed}
+        if without_balance:
+            summary["without_balance"] = without_balance
+        yield json.dumps(summary) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # Funzione mock per simulare la ricerca dell'utente nel database
 def mock_get_user(username):
     # Simula un utente trovato nel database
@@ -204,8 +313,8 @@ def mock_get_user(username):
     if username == "admin1":
         return {
             'username': 'admin1',
-            'password': bcrypt.hashpw("1234".encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
-            'salt': bcrypt.gensalt().decode('utf-8'),
+            'password': bcrypt.hashpw("1234".encode('utf-8'), salt.encode('utf-8')).decode('utf-8'),
+            'salt': salt,
             'role': 'admin'
         }
     return None  # Simula utente non trovato
@@ -8,10 +8,18 @@ class GachaUser(HttpUser):
     Simulation of a user that registers, logs in and then uses the system.
     """
     wait_time = between(5, 15)
+    # Se gli account sono stati creati in anticipo con /auth_service/bulk_signup (admin gateway),
+    # impostare SEEDED_USERS al numero di account creati per saltare la signup durante il ramp-up
+    seeded_users = int(os.getenv("SEEDED_USERS", "0"))
+    seeded_prefix = os.getenv("SEEDED_PREFIX", "seed")
+    seeded_password = os.getenv("SEEDED_PASSWORD", "Password1!")
 
     def on_start(self):     # metodo chiamato automaticamente all'avvio di ogni utente simulato
-        self.generate_random_credentials()
-        self.signup()
+        if self.seeded_users:
+            self.use_seeded_credentials()
+        else:
+            self.generate_random_credentials()
+            self.signup()
         self.login()
         self.buy_currency() # acquisto di monete subito dopo il login
     
@@ -23,6 +31,12 @@ class GachaUser(HttpUser):
         characters = string.ascii_letters + string.digits + string.punctuation
         self.password = ''.join(random.choice(characters) for i in range(password_length))
 
+    def use_seeded_credentials(self):
+        # usa uno degli account creati dal provisioning massivo (seed0 ... seedN-1)
+        self.username = f"{self.seeded_prefix}{random.randint(0, self.seeded_users - 1)}"
+        self.email = f"{self.username}@gmail.com"
+        self.password = self.seeded_password
+
     def signup(self):           
         payload = {
             "username": self.username,
@@ -1,47 +1,40 @@
 import requests,time
 from flask import Flask, request, jsonify
-from datetime import datetime
-import jwt
-from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
 import os
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from roll_core import (SERVICES, Background, CircuitBreakerState, Sleep, metrics_body, public_key_path, roll_flow,
+                       roll_stage_stats, start_background_sync, validate_roll_request)
 
 
 app = Flask(__name__)
 
-# URL dei servizi
-GACHA_SYSTEM_URL = "https://gachasystem:5004/get_gacha_roll"  # Nome del container nel docker-compose
-PAYMENT_SERVICE_URL = "https://payment_service:5006/pay"  # Nome del container nel docker-compose
-PROFILE_SETTING_URL = "https://profile_setting:5003/insertGacha"  # Nome del container nel docker-compose
-
-public_key_path = os.getenv("PUBLIC_KEY_PATH")
-
-class CircuitBreaker:
-    def __init__(self, failure_threshold=3, recovery_timeout=5, reset_timeout=10):
-        self.failure_threshold = failure_threshold  # Soglia di fallimento
-        self.recovery_timeout = recovery_timeout      # Tempo di recupero tra i tentativi
-        self.reset_timeout = reset_timeout          # Tempo massimo di attesa prima di ripristinare il circuito
-        self.failure_count = 0                      # Numero di fallimenti consecutivi
-        self.last_failure_time = 0                  # Ultimo tempo in cui si è verificato un fallimento
-        self.state = 'CLOSED'                       # Stato iniziale del circuito (CLOSED)
-
-    def call(self, method, url, params=None, headers=None, files=None, json=True):
-        if self.state == 'OPEN':
-            # Se il circuito è aperto, controlla se è il momento di provare di nuovo
-            if time.time() - self.last_failure_time > self.reset_timeout:
-                print("Closing the circuit")
-                self.state = 'CLOSED'
-                self._reset()
-            else:
-                return jsonify({'Error': 'Open circuit, try again later'}), 503  # ritorna un errore 503
+# Configurazione, validazione e orchestrazione del roll sono in roll_core.py, in comune con app_async.py:
+# qui ci sono solo l'esecuzione delle chiamate (requests, un thread per richiesta) e le route
+
+# Quando serve get_gacha_roll, l'estrazione gira su questo pool mentre il thread della richiesta paga:
+# la latenza di un roll e' max(pay, draw) + insert invece della somma dei tre hop
+ROLL_WORKERS = int(os.getenv("ROLL_WORKERS", "32"))
+
+class CircuitBreaker(CircuitBreakerState):
+    def call(self, method, url, params=None, headers=None, files=None, json=True, timeout=None, retries=0):
+        if self.is_open():
+            return self.open_response()  # ritorna un errore 503
 
         try:
-            # Usa requests.request per specificare il metodo dinamicamente
-            if json:
-                response = requests.request(method, url, json=params, headers=headers, verify=False)
-            else:
-                response = requests.request(method, url, data=params, headers=headers, files=files, verify=False)
-            
+            # Usa requests.request per specificare il metodo dinamicamente.
+            # I retry vanno usati solo per chiamate idempotenti (es. /pay con Idempotency-Key)
+            for attempt in range(retries + 1):
+                try:
+                    if json:
+                        response = requests.request(method, url, json=params, headers=headers, verify=False, timeout=timeout)
+                    else:
+                        response = requests.request(method, url, data=params, headers=headers, files=files, verify=False, timeout=timeout)
+                    break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    if attempt == retries:
+                        raise
+
             response.raise_for_status()  # Solleva un'eccezione per errori HTTP (4xx, 5xx)
 
             # Verifica se la risposta è un'immagine
@@ -61,120 +54,65 @@ class CircuitBreaker:
             self._fail()
             return {'Error': f'Error calling the service: {str(e)}'}, 503
 
-    def _fail(self):
-        self.failure_count += 1
-        self.last_failure_time = time.time()
-        if self.failure_count >= self.failure_threshold:
-            print("Circuito aperto a causa di troppi errori consecutivi.")
-            self.state = 'OPEN'
+        except requests.exceptions.Timeout as e:
+            self._fail()
+            return {'Error': f'Timeout calling the service: {str(e)}'}, 504
 
-    def _reset(self):
-        self.failure_count = 0
-        self.state = 'CLOSED'
+# Inizializzazione dei circuit breakers, uno per servizio a valle
+circuit_breakers = {service: CircuitBreaker() for service in SERVICES}
 
-# Inizializzazione dei circuit breakers
-gacha_sys_circuit_breaker = CircuitBreaker()
-profile_circuit_breaker = CircuitBreaker()
-payment_circuit_breaker = CircuitBreaker()
+roll_executor = ThreadPoolExecutor(max_workers=ROLL_WORKERS)
 
-def sanitize_input(input_string):
-    """Permette solo caratteri alfanumerici, trattini bassi e spazi."""
-    if not input_string:
-        return input_string
-    return re.sub(r"[^\w\s-]", "", input_string)
+start_background_sync()
 
-@app.route('/gacharoll', methods=['POST'])
-def gacharoll():
-    # Estrai i dati dal body della richiesta
-    data = request.get_json()
+def timed_call(call):
+    """Esegue una roll_core.Call tramite il circuit breaker del servizio, con il tempo registrato nella sua fase."""
+    started = time.perf_counter()
+    response, status = circuit_breakers[call.service].call(call.method, call.url, call.params, call.headers, {},
+                                                           call.json, call.timeout, call.retries)
+    roll_stage_stats[call.stage].observe(time.perf_counter() - started, ok=status == 200)
+    return response, status
 
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "Missing Authorization header"}), 401
-    access_token = auth_header.removeprefix("Bearer ").strip()
+def run_flow(flow):
+    """Esegue un flusso di roll_core fino al suo valore di ritorno. Le chiamate di una tupla vanno in parallelo:
+    la prima nel thread corrente, le altre su roll_executor; i flussi in background girano in un thread."""
+    result = None
+    try:
+        while True:
+            step = flow.send(result)
+            if isinstance(step, tuple):
+                futures = [roll_executor.submit(timed_call, call) for call in step[1:]]
+                result = [timed_call(step[0])] + [future.result() for future in futures]
+            elif isinstance(step, Sleep):
+                time.sleep(step.seconds)
+                result = None
+            elif isinstance(step, Background):
+                threading.Thread(target=run_flow, args=(step.flow,), daemon=True).start()
+                result = None
+            else:
+                result = timed_call(step)
+    except StopIteration as stop:
+        return stop.value
 
+@app.route('/gacharoll', methods=['POST'])
+def gacharoll():
     with open(public_key_path, 'r') as key_file:
         public_key = key_file.read()
 
-    try:
-        # Verifica il token con la chiave pubblica
-        decoded_token = jwt.decode(access_token, public_key, algorithms=["RS256"], audience="gacha_roll")  
-        #print(f"Token verificato! Dati decodificati: {decoded_token}")
-        if 'username' in data and decoded_token.get("sub") != data['username']:
-            return jsonify({"error": "Username in token does not match the request username"}), 403
-    except ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-
-    # Controlla che i parametri siano presenti
-    if 'username' not in data or 'level' not in data:                               
-        return jsonify({"error": "Missing 'username' or 'level' parameter"}), 400
-    
-    username = sanitize_input(data['username'])
-    level = sanitize_input(data['level'])
-
-    # Determina l'importo in base al livello
-    if level == "standard":
-        amount = 10
-    elif level == "medium":
-        amount = 20
-    elif level == "premium":
-        amount = 40
-    else:
-        return jsonify({"error": "Invalid level parameter"}), 400
-
-    # Step 1: Fai una chiamata al servizio di pagamento
-    payment_data = {
-        "payer_us": username,
-        "receiver_us": "system",
-        "amount": amount
-    }
-
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
-
-    payment_response,status = payment_circuit_breaker.call('post', PAYMENT_SERVICE_URL, payment_data,{},{}, False)
-    # try: 
-    #     payment_response = requests.post(PAYMENT_SERVICE_URL, data=payment_data, timeout=10)
-    if status != 200:
-        return jsonify({"error": f"Payment failed , details : {payment_response}"}), status
-    # params={'level': level}
-    url = GACHA_SYSTEM_URL + f'?level={level}'
-    response,status = gacha_sys_circuit_breaker.call('get', url, {}, headers, {}, False)
-    # try:
-    #     # Step 2: Fai una chiamata al servizio Gacha System per ottenere il Gacha (roll)
-    #     response = requests.get(GACHA_SYSTEM_URL, params={'level': level}, timeout=10)
-    if status != 200:
-        return jsonify({"error": f"Failed to fetch gacha from gachasystem, details : {response}"}), status
-
-    # Estrai il gacha dal servizio Gacha System
-    gacha = response
-
-    # Step 3: Ottieni la data attuale (collected_date) come oggetto datetime
-    collected_date = datetime.now()  # Oggetto datetime, non stringa
-
-    # Step 4: Inserisci il gacha nel profilo dell'utente (chiamata a profile_setting)
-    gacha_data = {
-        "username": username,
-        "gacha_name": gacha['gacha_name'],  
-        "collected_date": collected_date.isoformat()  # Passiamo l'oggetto datetime
-    }
-    profile_response = profile_circuit_breaker.call('post', PROFILE_SETTING_URL, gacha_data,{},{}, True)
-    # try:
-    #     profile_response = requests.post(PROFILE_SETTING_URL, json=gacha_data, timeout=10)
-    if status != 200:
-        return jsonify({"error": f"Failed to insert gacha into user profile , details {profile_response}"}), status
-
-    # Ritorna il risultato del gacha
-    return jsonify({
-        "gacha_name": gacha['gacha_name'],
-        "description": gacha['description'],
-        "rarity": gacha['rarity'],
-        "img": gacha['img'],
-        "collected_date": collected_date.isoformat()  # Includi la data come stringa nel formato ISO
-    }), 200
+    # Controlli del body, del token e dei parametri
+    roll_request, error = validate_roll_request(request.get_json(silent=True), request.headers.get('Authorization'), public_key)
+    if error:
+        body, status = error
+        return jsonify(body), status
+
+    started = time.perf_counter()
+    body, status = run_flow(roll_flow(*roll_request))
+    roll_stage_stats['total'].observe(time.perf_counter() - started, ok=status == 200)
+    return jsonify(body), status
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify(metrics_body()), 200
 
 #if __name__ == "__main__":
     #app.run(host='0.0.0.0', port=5007)  # La porta 5007 è quella su cui il servizio è esposto
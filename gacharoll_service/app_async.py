@@ -0,0 +1,142 @@
+"""Versione asyncio di gacharoll_service (Quart + httpx).
+
+Stesso endpoint /gacharoll di app.py: validazione, controlli sul JWT e orchestrazione (pagamento ed estrazione in
+parallelo, rimborso se il gacha non viene consegnato) sono quelli di roll_core.py, ma ogni roll e' una coroutine
+invece di un thread: le richieste in attesa dei servizi a valle non occupano thread e le connessioni verso ogni
+servizio sono riusate da un client httpx con pool.
+
+Avvio (vedi Dockerfile_async):
+    hypercorn app_async:app --bind 0.0.0.0:5007 --certfile gacharoll_cert.pem --keyfile gacharoll_key.pem
+"""
+import asyncio
+import os
+import time
+
+import httpx
+from quart import Quart, jsonify, request
+
+from roll_core import (SERVICES, Background, CircuitBreakerState, Sleep, metrics_body, public_key_path, roll_flow,
+                       roll_stage_stats, start_background_sync, validate_roll_request)
+
+app = Quart(__name__)
+
+# Connessioni massime tenute aperte verso ogni servizio a valle
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+
+# Un client per servizio, creati all'avvio del server (devono vivere nel loop di hypercorn)
+clients = {}
+# Flussi in background (rimborsi dei pagamenti incerti): il loop tiene solo riferimenti deboli ai task
+background_tasks = set()
+
+
+class CircuitBreaker(CircuitBreakerState):
+    async def call(self, client, method, url, params=None, headers=None, json=True, timeout=None, retries=0):
+        if self.is_open():
+            return self.open_response()
+
+        timeout = timeout or HTTP_TIMEOUT
+        try:
+            # I retry vanno usati solo per chiamate idempotenti (es. /pay con Idempotency-Key)
+            for attempt in range(retries + 1):
+                try:
+                    if json:
+                        response = await client.request(method, url, json=params, headers=headers, timeout=timeout)
+                    else:
+                        response = await client.request(method, url, data=params, headers=headers, timeout=timeout)
+                    break
+                except (httpx.ConnectError, httpx.TimeoutException):
+                    if attempt == retries:
+                        raise
+
+            if response.is_error:
+                # In caso di errore HTTP, restituisci il contenuto della risposta
+                return {'Error': response.text}, response.status_code
+            return response.json(), response.status_code
+
+        except httpx.TimeoutException as e:
+            self._fail()
+            return {'Error': f'Timeout calling the service: {str(e)}'}, 504
+
+        except httpx.TransportError as e:
+            # Per errori di connessione o altri problemi
+            self._fail()
+            return {'Error': f'Error calling the service: {str(e)}'}, 503
+
+
+# Inizializzazione dei circuit breakers, uno per servizio a valle
+circuit_breakers = {service: CircuitBreaker() for service in SERVICES}
+
+# La chiave pubblica si legge una volta sola: a differenza di app.py qui una lettura di file bloccherebbe il loop
+public_key = None
+
+
+@app.before_serving
+async def startup():
+    global public_key
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+    limits = httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+    for service in SERVICES:
+        clients[service] = httpx.AsyncClient(verify=False, limits=limits, timeout=HTTP_TIMEOUT)
+    # la sincronizzazione del catalogo gira in thread con requests, le estrazioni locali non bloccano il loop
+    start_background_sync()
+
+
+@app.after_serving
+async def shutdown():
+    for client in clients.values():
+        await client.aclose()
+    clients.clear()
+
+
+async def timed_call(call):
+    """Esegue una roll_core.Call tramite il circuit breaker del servizio, con il tempo registrato nella sua fase."""
+    started = time.perf_counter()
+    response, status = await circuit_breakers[call.service].call(clients[call.service], call.method, call.url, call.params,
+                                                                 call.headers, call.json, call.timeout, call.retries)
+    roll_stage_stats[call.stage].observe(time.perf_counter() - started, ok=status == 200)
+    return response, status
+
+
+async def run_flow(flow):
+    """Esegue un flusso di roll_core fino al suo valore di ritorno. Le chiamate di una tupla vanno in parallelo
+    con asyncio.gather; i flussi in background diventano task."""
+    result = None
+    try:
+        while True:
+            step = flow.send(result)
+            if isinstance(step, tuple):
+                result = await asyncio.gather(*(timed_call(call) for call in step))
+            elif isinstance(step, Sleep):
+                await asyncio.sleep(step.seconds)
+                result = None
+            elif isinstance(step, Background):
+                task = asyncio.create_task(run_flow(step.flow))
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+                result = None
+            else:
+                result = await timed_call(step)
+    except StopIteration as stop:
+        return stop.value
+
+
+@app.route('/gacharoll', methods=['POST'])
+async def gacharoll():
+    # Controlli del body, del token e dei parametri
+    data = await request.get_json(silent=True)
+    roll_request, error = validate_roll_request(data, request.headers.get('Authorization'), public_key)
+    if error:
+        body, status = error
+        return jsonify(body), status
+
+    started = time.perf_counter()
+    body, status = await run_flow(roll_flow(*roll_request))
+    roll_stage_stats['total'].observe(time.perf_counter() - started, ok=status == 200)
+    return jsonify(body), status
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return jsonify(metrics_body()), 200
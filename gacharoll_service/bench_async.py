@@ -0,0 +1,238 @@
+"""Benchmark della capacita' di roll concorrenti per processo: app.py (Flask, thread) contro app_async.py (Quart, asyncio).
+
+Per misurare solo gacharoll, i servizi a valle (payment, gachasystem, profile_setting) sono sostituiti da un
+server finto asyncio che risponde dopo --latency-ms millisecondi. Ogni versione gira in un solo processo,
+in HTTP semplice, con la stessa chiave pubblica di test; il carico e' generato con httpx a diversi livelli
+di concorrenza e per ognuno si riportano roll al secondo, latenze ed errori.
+
+Va eseguito in un ambiente con entrambe le versioni installate (immagine di Dockerfile_async):
+    python bench_async.py [--concurrency 10,50,200] [--duration 15] [--latency-ms 50] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_USERS = 1000
+GACHA = {"gacha_id": 1, "gacha_name": "Bench gacha", "description": "", "rarity": "common", "img": ""}
+
+
+# --- servizi a valle finti -------------------------------------------------------------------------
+
+def mock_body(method, target):
+    url = urlsplit(target)
+    if url.path == '/pay':
+        return {"msg": "Payment successfully executed"}
+    if url.path == '/get_gacha_roll':
+        count = parse_qs(url.query).get('count')
+        return [GACHA] * int(count[0]) if count else GACHA
+    if url.path in ('/insertGacha', '/insertGachas'):
+        return {"message": "Gacha added to collection"}
+    return None
+
+
+async def handle_mock(reader, writer, latency):
+    # HTTP/1.1 minimale con keep-alive: quanto basta per i client requests e httpx delle due versioni
+    try:
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, _ = lines[0].split(' ', 2)
+            length = 0
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            if length:
+                await reader.readexactly(length)
+            await asyncio.sleep(latency)
+            body = mock_body(method, target)
+            payload = json.dumps(body).encode() if body is not None else b'{"Error": "not found"}'
+            status = b'200 OK' if body is not None else b'404 Not Found'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: application/json\r\nContent-Length: '
+                         + str(len(payload)).encode() + b'\r\n\r\n' + payload)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run_mock_server(port, latency):
+    server = await asyncio.start_server(lambda r, w: handle_mock(r, w, latency), '127.0.0.1', port, backlog=4096)
+    async with server:
+        await server.serve_forever()
+
+
+# --- avvio delle due versioni ----------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_keys(folder):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_path = os.path.join(folder, 'public_key.pem')
+    with open(public_path, 'wb') as f:
+        f.write(key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+    return key, public_path
+
+
+def make_tokens(private_key):
+    pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    exp = int(time.time()) + 3600
+    return [jwt.encode({"sub": f"bench{i}", "aud": "gacha_roll", "scope": "user", "exp": exp}, pem, algorithm="RS256")
+            for i in range(BENCH_USERS)]
+
+
+def start_target(name, port, env):
+    if name == 'flask':
+        cmd = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--host', '127.0.0.1', '--port', str(port), '--with-threads']
+    else:
+        cmd = [sys.executable, '-m', 'hypercorn', 'app_async:app', '--bind', f'127.0.0.1:{port}', '--backlog', '4096']
+    return subprocess.Popen(cmd, cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            if httpx.get(url + '/metrics', timeout=1).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+# --- generatore di carico --------------------------------------------------------------------------
+
+async def load(url, tokens, concurrency, duration, level):
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        deadline = time.monotonic() + duration
+
+        async def worker(n):
+            nonlocal errors
+            i = n
+            while time.monotonic() < deadline:
+                user = i % len(tokens)
+                i += concurrency
+                started = time.perf_counter()
+                try:
+                    response = await client.post('/gacharoll', json={"username": f"bench{user}", "level": level},
+                                                 headers={"Authorization": f"Bearer {tokens[user]}"})
+                    ok = response.status_code == 200
+                except httpx.TransportError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
+
+    return {
+        "concurrency": concurrency,
+        "rolls": len(latencies),
+        "errors": errors,
+        "rolls_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare concurrent-roll capacity of the Flask and asyncio gacharoll')
+    parser.add_argument('--targets', default='flask,async', help='comma-separated: flask, async')
+    parser.add_argument('--concurrency', default='10,50,200', help='comma-separated concurrent clients')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per concurrency level')
+    parser.add_argument('--latency-ms', type=float, default=50, help='latency of each fake downstream call')
+    parser.add_argument('--level', default='standard')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--mock-server', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mock_server:
+        asyncio.run(run_mock_server(args.mock_server, args.latency_ms / 1000))
+        return 0
+
+    targets = [t for t in args.targets.split(',') if t]
+    if any(t not in ('flask', 'async') for t in targets):
+        parser.error("targets must be flask and/or async")
+    levels = [int(c) for c in args.concurrency.split(',') if c]
+    # pool di app.py abbastanza grande da non limitare i roll in corso: si misura thread contro asyncio, non ROLL_WORKERS
+    roll_workers = 2 * max(levels)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        private_key, public_path = make_keys(folder)
+        tokens = make_tokens(private_key)
+        # il server finto gira in un processo a parte, cosi' non compete con il generatore di carico
+        mock_port = free_port()
+        mock = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--mock-server', str(mock_port), '--latency-ms', str(args.latency_ms)])
+        try:
+            mock_url = f'http://127.0.0.1:{mock_port}'
+            env = dict(os.environ,
+                       PUBLIC_KEY_PATH=public_path,
+                       LOCAL_CATALOG='false',
+                       ROLL_BUFFER='false',
+                       ROLL_WORKERS=str(roll_workers),
+                       GACHA_SYSTEM_URL=f'{mock_url}/get_gacha_roll',
+                       PAYMENT_SERVICE_URL=f'{mock_url}/pay',
+                       PROFILE_SETTING_URL=f'{mock_url}/insertGacha',
+                       PROFILE_SETTING_BULK_URL=f'{mock_url}/insertGachas')
+            for target in targets:
+                port = free_port()
+                process = start_target(target, port, env)
+                try:
+                    url = f'http://127.0.0.1:{port}'
+                    wait_ready(url, process)
+                    results[target] = [asyncio.run(load(url, tokens, c, args.duration, args.level)) for c in levels]
+                finally:
+                    process.terminate()
+                    process.wait()
+        finally:
+            mock.terminate()
+            mock.wait()
+
+    if args.json:
+        print(json.dumps({"latency_ms": args.latency_ms, "duration": args.duration, "roll_workers": roll_workers,
+                          "results": results}, indent=2))
+        return 0
+    print(f"fake downstream latency {args.latency_ms}ms, {args.duration}s per level, one process per target, "
+          f"ROLL_WORKERS={roll_workers} for flask")
+    print(f"{'target':<8}{'clients':>8}{'rolls/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for target, rows in results.items():
+        for r in rows:
+            print(f"{target:<8}{r['concurrency']:>8}{r['rolls_per_second']:>10}{r['p50_ms'] or '-':>9}{r['p95_ms'] or '-':>9}{r['p99_ms'] or '-':>9}{r['errors']:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Copia locale del catalogo del gachasystem, per estrarre i roll senza chiamare get_gacha_roll.
+
+Un thread controlla /catalog_version ogni `poll_seconds`; quando la versione cambia scarica il catalogo
+completo da /catalog_snapshot (con If-None-Match) e ricostruisce i bucket per rarita' e le tabelle alias
+con le probabilita' pubblicate dal gachasystem, quindi le estrazioni seguono le stesse regole di get_gacha_roll:
+rarita' con il metodo alias, poi un gacha uniforme nel bucket.
+
+Usato sia da app.py sia da app_async.py: il thread di sincronizzazione non tocca il loop asyncio.
+"""
+import logging
+import random
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class AliasSampler:
+    """Estrazione pesata in O(1) con il metodo alias di Vose (stessa implementazione del gachasystem)."""
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1
+            (small if scaled[l] < 1 else large).append(l)
+
+    def sample(self, rng=random):
+        i = rng.randrange(len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+class CatalogState:
+    """Catalogo a una certa versione, immutabile: una nuova versione crea un nuovo oggetto."""
+    def __init__(self, version, etag, gachas, probabilities):
+        self.version = version
+        self.etag = etag
+        self.gachas = gachas
+        self.probabilities = probabilities
+        self.buckets = {}
+        for gacha in gachas:
+            self.buckets.setdefault(gacha["rarity"], []).append(gacha)
+        self.samplers = {}
+        for level, weights in probabilities.items():
+            rarities = tuple(weights)
+            self.samplers[level] = (rarities, AliasSampler([weights[r] for r in rarities]))
+
+    def roll(self, level, rng=random):
+        """Un gacha estratto per il livello, None se il bucket della rarita' estratta e' vuoto."""
+        rarities, sampler = self.samplers[level]
+        bucket = self.buckets.get(rarities[sampler.sample(rng)])
+        return rng.choice(bucket) if bucket else None
+
+
+class CatalogReplica:
+    """Copia locale sincronizzata per polling. Se non e' mai stata caricata o l'ultimo controllo riuscito
+    e' piu' vecchio di `max_staleness` secondi, roll() restituisce None e il chiamante usa get_gacha_roll."""
+    def __init__(self, version_url, snapshot_url, poll_seconds, max_staleness, timeout=5, auth=None):
+        self.version_url = version_url
+        self.snapshot_url = snapshot_url
+        self.poll_seconds = poll_seconds
+        self.max_staleness = max_staleness
+        self.timeout = timeout
+        self.state = None
+        self.synced_at = None  # time.monotonic() dell'ultimo controllo di versione riuscito
+        self.lock = threading.Lock()
+        self.thread = None
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.auth = auth  # token di servizio richiesto da /catalog_snapshot
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='catalog-replica', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+            except (requests.RequestException, OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Catalog replica refresh failed: {e}")
+            time.sleep(self.poll_seconds)
+
+    def refresh(self):
+        response = self.session.get(self.version_url, timeout=self.timeout)
+        response.raise_for_status()
+        info = response.json()
+        state = self.state
+        if state is None or info["version"] != state.version or info["probabilities"] != state.probabilities:
+            headers = {"If-None-Match": f'"{state.etag}"'} if state else {}
+            response = self.session.get(self.snapshot_url, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+            version = int(response.headers.get("X-Catalog-Version", info["version"]))
+            if response.status_code == 304:
+                # versione incrementata senza cambiare il contenuto
+                self.state = CatalogState(version, state.etag, state.gachas, info["probabilities"])
+            else:
+                etag = response.headers.get("ETag", "").strip('"')
+                self.state = CatalogState(version, etag, response.json(), info["probabilities"])
+                logger.info(f"Catalog replica loaded version {version} ({len(self.state.gachas)} gachas)")
+        self.synced_at = time.monotonic()
+
+    def ready(self):
+        return self.state is not None and self.synced_at is not None and time.monotonic() - self.synced_at < self.max_staleness
+
+    def roll(self, level, count=1, rng=random):
+        """Lista di `count` gacha estratti in locale (None negli elementi il cui bucket e' vuoto),
+        oppure None se la copia locale non e' utilizzabile."""
+        state = self.state
+        if not self.ready() or level not in state.samplers:
+            return None
+        return [state.roll(level, rng) for _ in range(count)]
+
+    def status(self):
+        state = self.state
+        return {
+            "ready": self.ready(),
+            "version": state.version if state else None,
+            "count": len(state.gachas) if state else 0,
+            "synced_seconds_ago": round(time.monotonic() - self.synced_at, 1) if self.synced_at is not None else None,
+        }
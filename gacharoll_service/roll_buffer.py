@@ -0,0 +1,166 @@
+"""Buffer di estrazioni gia' fatte dal gachasystem, uno per livello, per servire i roll senza attendere get_gacha_roll.
+
+Un thread riempie i buffer in background con /draw_batch quando scendono sotto `refill_threshold`, fino a `size`
+estrazioni. Le estrazioni restano quelle del gachasystem, con le sue probabilita'; perche' i roll serviti dal
+buffer seguano le stesse probabilita' di un'estrazione sincrona:
+  - si consumano in ordine FIFO e tutte insieme per un multi-roll, senza mai scartarne una in base al risultato;
+  - quando cambiano la versione del catalogo o le probabilita' (controllate su /catalog_version) tutti i buffer
+    vengono svuotati, cosi' non si servono gacha rimossi o estratti con pesi vecchi;
+  - le estrazioni piu' vecchie di `max_age` secondi vengono scartate dalla testa della coda, anche dal thread di
+    riempimento: un buffer mai usato (es. finche' la copia locale del catalogo e' disponibile) resta comunque fresco.
+La versione del catalogo si prende dalla copia locale (CatalogReplica) quando e' sincronizzata, altrimenti da
+/catalog_version, cosi' con entrambi attivi il gachasystem non viene interrogato due volte.
+status() riporta le rarita' servite accanto a quelle attese, per verificare la distribuzione in esercizio.
+"""
+import logging
+import threading
+import time
+from collections import Counter, deque
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class RollBuffer:
+    """Coda FIFO di (gacha, istante dell'estrazione) per un livello."""
+    def __init__(self, size, refill_threshold, max_age):
+        self.size = size
+        self.refill_threshold = refill_threshold
+        self.max_age = max_age
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.served = Counter()
+        self.expired = 0
+        self.flushed = 0
+
+    def expire(self):
+        """Scarta le estrazioni scadute dalla testa della coda (chiamata con il lock preso)."""
+        now = time.monotonic()
+        while self.items and now - self.items[0][1] > self.max_age:
+            self.items.popleft()
+            self.expired += 1
+
+    def pop(self, count):
+        """Le prossime `count` estrazioni, oppure None se il buffer non ne ha abbastanza (non ne consuma nessuna)."""
+        with self.lock:
+            self.expire()
+            if len(self.items) < count:
+                return None
+            gachas = [self.items.popleft()[0] for _ in range(count)]
+            self.served.update(gacha["rarity"] for gacha in gachas)
+            return gachas
+
+    def missing(self):
+        """Estrazioni da chiedere per tornare a `size`, 0 se il buffer e' ancora sopra la soglia."""
+        with self.lock:
+            self.expire()
+            return self.size - len(self.items) if len(self.items) < self.refill_threshold else 0
+
+    def extend(self, gachas):
+        drawn_at = time.monotonic()
+        with self.lock:
+            self.items.extend((gacha, drawn_at) for gacha in gachas)
+
+    def flush(self):
+        with self.lock:
+            self.flushed += len(self.items)
+            self.items.clear()
+
+
+class RollBuffers:
+    """Buffer per ogni livello e thread che li riempie. pop() restituisce None se il chiamante deve estrarre
+    in un altro modo (buffer vuoto, livello sconosciuto o versione del catalogo mai letta)."""
+    def __init__(self, levels, batch_url, version_url, size, refill_threshold, batch_size, max_age, check_seconds,
+                 replica=None, timeout=5, auth=None):
+        self.buffers = {level: RollBuffer(size, refill_threshold, max_age) for level in levels}
+        self.batch_url = batch_url
+        self.version_url = version_url
+        self.batch_size = batch_size
+        self.check_seconds = check_seconds
+        self.replica = replica
+        self.timeout = timeout
+        self.catalog = None  # (versione, probabilita') delle estrazioni nei buffer
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.auth = auth  # token di servizio richiesto da /draw_batch
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='roll-buffers', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                self.check_version()
+                self.refill()
+            except (requests.RequestException, OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Roll buffer refill failed: {e}")
+            self.wakeup.wait(self.check_seconds)
+
+    def check_version(self):
+        state = self.replica.state if self.replica is not None and self.replica.ready() else None
+        if state is not None:
+            catalog = (state.version, state.probabilities)
+        else:
+            response = self.session.get(self.version_url, timeout=self.timeout)
+            response.raise_for_status()
+            info = response.json()
+            catalog = (info["version"], info["probabilities"])
+        if self.catalog is not None and catalog != self.catalog:
+            self.flush()
+            logger.info(f"Roll buffers flushed for catalog version {catalog[0]}")
+        self.catalog = catalog
+
+    def refill(self):
+        for level, buffer in self.buffers.items():
+            missing = buffer.missing()
+            while missing > 0:
+                count = min(missing, self.batch_size)
+                response = self.session.get(self.batch_url, params={"level": level, "count": count}, timeout=self.timeout)
+                if response.status_code == 404:
+                    break  # una rarita' del livello non ha gacha: i roll di questo livello passano dal gachasystem
+                response.raise_for_status()
+                if int(response.headers["X-Catalog-Version"]) != self.catalog[0]:
+                    # il catalogo e' cambiato dopo l'ultimo controllo: si riempie al prossimo giro, dopo aver
+                    # riletto la versione, invece di mescolare estrazioni di versioni diverse
+                    return
+                buffer.extend(response.json())
+                missing -= count
+
+    def flush(self):
+        for buffer in self.buffers.values():
+            buffer.flush()
+
+    def pop(self, level, count=1):
+        buffer = self.buffers.get(level)
+        if buffer is None or self.catalog is None:
+            return None
+        gachas = buffer.pop(count)
+        if buffer.missing():
+            self.wakeup.set()
+        return gachas
+
+    def status(self):
+        catalog = self.catalog
+        levels = {}
+        for level, buffer in self.buffers.items():
+            weights = catalog[1].get(level, {}) if catalog else {}
+            total = sum(weights.values())
+            with buffer.lock:
+                served = dict(buffer.served)
+                levels[level] = {
+                    "buffered": len(buffer.items),
+                    "served": served,
+                    "served_share": {rarity: round(n / sum(served.values()), 4) for rarity, n in served.items()},
+                    "expected_share": {rarity: round(w / total, 4) for rarity, w in weights.items()} if total else {},
+                    "expired": buffer.expired,
+                    "flushed": buffer.flushed,
+                }
+        return {"version": catalog[0] if catalog else None, "levels": levels}
@@ -0,0 +1,449 @@
+"""Parte comune di app.py (Flask, thread) e app_async.py (Quart, asyncio): configurazione, validazione di
+/gacharoll, statistiche, copia locale e buffer delle estrazioni e orchestrazione di un roll.
+
+L'orchestrazione e' scritta una volta sola come generatore (roll_flow): invece di chiamare i servizi a valle
+restituisce con yield il passo da eseguire e riceve il risultato:
+  - Call: chiamata a un servizio tramite il suo circuit breaker, il risultato e' (body, status);
+  - tupla di Call: chiamate da eseguire in parallelo, il risultato e' la lista dei (body, status);
+  - Sleep: attesa, senza risultato;
+  - Background: flusso da eseguire in background senza attenderlo (thread o task).
+Il valore di ritorno del generatore e' la risposta (body, status). run_flow di app.py esegue i passi con
+requests e roll_executor, quello di app_async.py con httpx e asyncio.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+import jwt
+import requests
+from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
+
+from local_catalog import CatalogReplica
+from roll_buffer import RollBuffers
+
+logger = logging.getLogger(__name__)
+
+# URL dei servizi
+# (sovrascrivibili da variabili d'ambiente, es. per il benchmark con servizi finti)
+GACHA_SYSTEM_URL = os.getenv("GACHA_SYSTEM_URL", "https://gachasystem:5004/get_gacha_roll")  # Nome del container nel docker-compose
+PAYMENT_SERVICE_URL = os.getenv("PAYMENT_SERVICE_URL", "https://payment_service:5006/pay")  # Nome del container nel docker-compose
+PROFILE_SETTING_URL = os.getenv("PROFILE_SETTING_URL", "https://profile_setting:5003/insertGacha")  # Nome del container nel docker-compose
+PROFILE_SETTING_BULK_URL = os.getenv("PROFILE_SETTING_BULK_URL", "https://profile_setting:5003/insertGachas")
+MAX_ROLL_COUNT = 10  # roll massimi per chiamata (multi-roll)
+ROLL_PRICES = {"standard": 10, "medium": 20, "premium": 40}
+REFUND_CATEGORY = "gacharoll_refund"
+
+public_key_path = os.getenv("PUBLIC_KEY_PATH")
+# Chiave con cui gacharoll firma i token di servizio per gli endpoint interni del gachasystem
+private_key_path = os.getenv("PRIVATE_KEY_PATH")
+SERVICE_TOKEN_LIFETIME = int(os.getenv("SERVICE_TOKEN_LIFETIME_SECONDS", "300"))
+
+# /pay accetta una Idempotency-Key, quindi la chiamata puo' usare timeout stretti e retry senza doppi addebiti
+PAYMENT_TIMEOUT = float(os.getenv("PAYMENT_TIMEOUT_SECONDS", "2"))
+PAYMENT_RETRIES = int(os.getenv("PAYMENT_RETRIES", "2"))
+# Esito di /pay incerto (timeout, servizio non raggiungibile, errore 5xx): l'addebito potrebbe essere gia' registrato.
+# La stessa chiave viene ripetuta una volta con PAYMENT_SETTLE_TIMEOUT; se l'esito resta incerto il roll non viene
+# consegnato e in background la chiave viene ripetuta fino a PAYMENT_SETTLE_ATTEMPTS volte, rimborsando l'addebito se c'e' stato
+PAYMENT_SETTLE_TIMEOUT = float(os.getenv("PAYMENT_SETTLE_TIMEOUT_SECONDS", "5"))
+PAYMENT_SETTLE_ATTEMPTS = int(os.getenv("PAYMENT_SETTLE_ATTEMPTS", "5"))
+PAYMENT_SETTLE_DELAY = float(os.getenv("PAYMENT_SETTLE_DELAY_SECONDS", "5"))
+
+# Copia locale del catalogo: i roll vengono estratti qui con le probabilita' pubblicate dal gachasystem e
+# get_gacha_roll si usa solo se la copia non e' ancora caricata o non si sincronizza da CATALOG_MAX_STALENESS_SECONDS
+LOCAL_CATALOG = os.getenv("LOCAL_CATALOG", "true").lower() == "true"
+CATALOG_VERSION_URL = os.getenv("CATALOG_VERSION_URL", "https://gachasystem:5004/catalog_version")
+CATALOG_SNAPSHOT_URL = os.getenv("CATALOG_SNAPSHOT_URL", "https://gachasystem:5004/catalog_snapshot")
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", "2"))
+CATALOG_MAX_STALENESS_SECONDS = float(os.getenv("CATALOG_MAX_STALENESS_SECONDS", "30"))
+
+# Buffer di estrazioni gia' fatte dal gachasystem per ogni livello (roll_buffer.py), usati quando la copia
+# locale non e' disponibile: un roll prende le prossime estrazioni del buffer invece di chiamare get_gacha_roll.
+# Il buffer si riempie fino a ROLL_BUFFER_SIZE quando scende sotto ROLL_BUFFER_REFILL_THRESHOLD, viene
+# svuotato quando cambia il catalogo e le estrazioni piu' vecchie di ROLL_BUFFER_MAX_AGE_SECONDS sono scartate
+ROLL_BUFFER = os.getenv("ROLL_BUFFER", "true").lower() == "true"
+ROLL_BUFFER_URL = os.getenv("ROLL_BUFFER_URL", "https://gachasystem:5004/draw_batch")
+ROLL_BUFFER_SIZE = int(os.getenv("ROLL_BUFFER_SIZE", "200"))
+ROLL_BUFFER_REFILL_THRESHOLD = int(os.getenv("ROLL_BUFFER_REFILL_THRESHOLD", "50"))
+ROLL_BUFFER_BATCH_SIZE = int(os.getenv("ROLL_BUFFER_BATCH_SIZE", "100"))
+ROLL_BUFFER_MAX_AGE_SECONDS = float(os.getenv("ROLL_BUFFER_MAX_AGE_SECONDS", "60"))
+
+# Servizi a valle: un circuit breaker (e in app_async.py un client httpx) per ognuno
+SERVICES = ("payment", "gachasystem", "profile")
+
+
+class CircuitBreakerState:
+    """Stato del circuit breaker; call() e' in app.py (requests) e in app_async.py (httpx)."""
+    def __init__(self, failure_threshold=3, recovery_timeout=5, reset_timeout=10):
+        self.failure_threshold = failure_threshold  # Soglia di fallimento
+        self.recovery_timeout = recovery_timeout      # Tempo di recupero tra i tentativi
+        self.reset_timeout = reset_timeout          # Tempo massimo di attesa prima di ripristinare il circuito
+        self.failure_count = 0                      # Numero di fallimenti consecutivi
+        self.last_failure_time = 0                  # Ultimo tempo in cui si è verificato un fallimento
+        self.state = 'CLOSED'                       # Stato iniziale del circuito (CLOSED)
+
+    def is_open(self):
+        """True se il circuito è aperto; passato reset_timeout si richiude e la chiamata viene ritentata."""
+        if self.state == 'OPEN':
+            if time.time() - self.last_failure_time > self.reset_timeout:
+                print("Closing the circuit")
+                self._reset()
+            else:
+                return True
+        return False
+
+    def open_response(self):
+        return {'Error': 'Open circuit, try again later'}, 503
+
+    def _fail(self):
+        self.failure_count += 1
+        self.last_failure_time = time.time()
+        if self.failure_count >= self.failure_threshold:
+            print("Circuito aperto a causa di troppi errori consecutivi.")
+            self.state = 'OPEN'
+
+    def _reset(self):
+        self.failure_count = 0
+        self.state = 'CLOSED'
+
+
+class ServiceToken(requests.auth.AuthBase):
+    """Token di servizio (scope "service", audience gachasystem) per i thread di sincronizzazione, che non hanno
+    il token di un utente. Usato come `auth` delle sessioni requests: il token viene rifirmato quando manca
+    meno di un minuto alla scadenza."""
+    def __init__(self, key_path, lifetime=SERVICE_TOKEN_LIFETIME):
+        self.key_path = key_path
+        self.lifetime = lifetime
+        self.token = None
+        self.expires_at = 0
+        self.lock = threading.Lock()
+
+    def current(self):
+        with self.lock:
+            if self.token is None or time.time() > self.expires_at - 60:
+                with open(self.key_path, 'r') as key_file:
+                    private_key = key_file.read()
+                now = datetime.utcnow()
+                payload = {
+                    "iss": "https://gacharoll:5007",
+                    "sub": "gacharoll",
+                    "aud": ["gachasystem"],
+                    "iat": now,
+                    "exp": now + timedelta(seconds=self.lifetime),
+                    "scope": "service",
+                    "jti": str(uuid.uuid4())
+                }
+                self.token = jwt.encode(payload, private_key, algorithm="RS256", headers={"alg": "RS256", "typ": "JWT"})
+                self.expires_at = time.time() + self.lifetime
+            return self.token
+
+    def __call__(self, request):
+        request.headers["Authorization"] = f"Bearer {self.current()}"
+        return request
+
+
+class LatencyStats:
+    """Contatori cumulativi e latenze degli ultimi `window` campioni, esposti da /metrics."""
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+    def observe(self, seconds, ok=True):
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total_seconds += seconds
+            if not ok:
+                self.failed += 1
+
+    def summary(self):
+        with self.lock:
+            samples = sorted(self.samples)
+            count, failed, total_seconds = self.count, self.failed, self.total_seconds
+
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2) if samples else None
+
+        return {
+            "count": count,
+            "failed": failed,
+            "avg_ms": round(total_seconds / count * 1000, 2) if count else None,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(samples[-1] * 1000, 2) if samples else None,
+        }
+
+
+# Tempi delle fasi di un roll: pay e draw girano in parallelo, total e' la durata dell'intera richiesta
+ROLL_STAGES = ("pay", "draw", "draw_local", "draw_buffer", "insert", "refund", "total")
+roll_stage_stats = {stage: LatencyStats() for stage in ROLL_STAGES}
+# la sincronizzazione gira in thread con requests, le estrazioni locali sono solo CPU (non bloccano il loop di app_async.py)
+service_token = ServiceToken(private_key_path)
+catalog_replica = CatalogReplica(CATALOG_VERSION_URL, CATALOG_SNAPSHOT_URL, CATALOG_POLL_SECONDS, CATALOG_MAX_STALENESS_SECONDS,
+                                 auth=service_token)
+roll_buffers = RollBuffers(ROLL_PRICES, ROLL_BUFFER_URL, CATALOG_VERSION_URL, ROLL_BUFFER_SIZE, ROLL_BUFFER_REFILL_THRESHOLD,
+                           ROLL_BUFFER_BATCH_SIZE, ROLL_BUFFER_MAX_AGE_SECONDS, CATALOG_POLL_SECONDS,
+                           replica=catalog_replica if LOCAL_CATALOG else None, auth=service_token)
+
+
+def start_background_sync():
+    """Avvia (una sola volta) i thread della copia locale e dei buffer. Chiamata all'import di app.py, all'avvio
+    di app_async.py e di nuovo dalle estrazioni, senza hook di Flask: before_first_request non esiste in Flask 3 (Quart)."""
+    if LOCAL_CATALOG:
+        catalog_replica.start()
+    if ROLL_BUFFER:
+        roll_buffers.start()
+
+
+def metrics_body():
+    return {
+        "roll_stages": {stage: stats.summary() for stage, stats in roll_stage_stats.items()},
+        "catalog": catalog_replica.status(),
+        "roll_buffers": roll_buffers.status()
+    }
+
+
+def sanitize_input(input_string):
+    """Permette solo caratteri alfanumerici, trattini bassi e spazi."""
+    if not input_string:
+        return input_string
+    return re.sub(r"[^\w\s-]", "", input_string)
+
+
+def validate_roll_request(data, auth_header, public_key):
+    """Controlli di /gacharoll: body, JWT del giocatore e parametri. Restituisce
+    ((username, level, amount, count, access_token), None) oppure (None, (body, status))."""
+    if not isinstance(data, dict):
+        return None, ({"error": "Invalid JSON body"}, 400)
+
+    if not auth_header:
+        return None, ({"error": "Missing Authorization header"}, 401)
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    try:
+        # Verifica il token con la chiave pubblica
+        decoded_token = jwt.decode(access_token, public_key, algorithms=["RS256"], audience="gacha_roll")
+        if 'username' in data and decoded_token.get("sub") != data['username']:
+            return None, ({"error": "Username in token does not match the request username"}, 403)
+    except ExpiredSignatureError:
+        return None, ({"error": "Token expired"}, 401)
+    except InvalidTokenError:
+        return None, ({"error": "Invalid token"}, 401)
+
+    # Controlla che i parametri siano presenti
+    if 'username' not in data or 'level' not in data:
+        return None, ({"error": "Missing 'username' or 'level' parameter"}, 400)
+
+    username = sanitize_input(data['username'])
+    level = sanitize_input(data['level'])
+    # 'count' opzionale: multi-roll con un solo pagamento, una sola estrazione e un solo inserimento nel profilo
+    count = data.get('count')
+    if count is not None and (not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_ROLL_COUNT):
+        return None, ({"error": f"count must be an integer between 1 and {MAX_ROLL_COUNT}"}, 400)
+
+    # Determina l'importo in base al livello
+    amount = ROLL_PRICES.get(level)
+    if amount is None:
+        return None, ({"error": "Invalid level parameter"}, 400)
+    return (username, level, amount, count, access_token), None
+
+
+def draw_local(level, count):
+    """Estrazione dalla copia locale. (gachas, None) oppure (None, None) se la copia non e' utilizzabile,
+    (None, (body, status)) se un bucket e' vuoto (come il 404 di get_gacha_roll)."""
+    if not LOCAL_CATALOG:
+        return None, None
+    start_background_sync()
+    started = time.perf_counter()
+    gachas = catalog_replica.roll(level, count)
+    if gachas is None:
+        return None, None
+    roll_stage_stats['draw_local'].observe(time.perf_counter() - started, ok=all(gachas))
+    if not all(gachas):
+        return None, ({"error": f"No gacha found for a roll of level '{level}'."}, 404)
+    return gachas, None
+
+
+def draw_buffered(level, count):
+    """Prossime `count` estrazioni dal buffer del livello, None se il buffer non ne ha abbastanza."""
+    if not ROLL_BUFFER:
+        return None
+    start_background_sync()
+    started = time.perf_counter()
+    gachas = roll_buffers.pop(level, count)
+    if gachas is not None:
+        roll_stage_stats['draw_buffer'].observe(time.perf_counter() - started)
+    return gachas
+
+
+class Call:
+    """Chiamata a un servizio di SERVICES tramite il suo circuit breaker, con il tempo registrato nella fase `stage`.
+    I retry vanno usati solo per chiamate idempotenti (es. /pay con Idempotency-Key)."""
+    def __init__(self, stage, service, method, url, params=None, headers=None, json=True, timeout=None, retries=0):
+        self.stage = stage
+        self.service = service
+        self.method = method
+        self.url = url
+        self.params = params
+        self.headers = headers or {}
+        self.json = json
+        self.timeout = timeout
+        self.retries = retries
+
+
+class Sleep:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class Background:
+    """Flusso da eseguire in background, senza attenderne il risultato."""
+    def __init__(self, flow):
+        self.flow = flow
+
+
+def payment_outcome_unknown(status):
+    """True se /pay non ha dato un esito definitivo: timeout, errore di connessione o 5xx (il commit potrebbe essere
+    avvenuto) oppure 409 (una richiesta con la stessa chiave e' ancora in corso). Gli altri 4xx non addebitano nulla."""
+    return status >= 500 or status == 409
+
+
+def pay_call(payment_data, idempotency_key, timeout=PAYMENT_TIMEOUT, retries=PAYMENT_RETRIES):
+    """/pay con la chiave del roll. Ripetuta con la stessa chiave, se il pagamento era stato registrato il
+    payment_service restituisce l'esito salvato, altrimenti lo esegue ora: un 200 vuol dire un solo addebito."""
+    payment_headers = {
+        "Idempotency-Key": idempotency_key
+    }
+    return Call('pay', 'payment', 'post', PAYMENT_SERVICE_URL, payment_data, payment_headers, json=False, timeout=timeout, retries=retries)
+
+
+def refund_flow(username, payment_data, idempotency_key):
+    """Compensazione di un roll pagato ma non consegnato: il conto di sistema restituisce l'importo.
+    La chiave deriva da quella del pagamento, quindi un refund ripetuto non accredita due volte."""
+    refund_data = {
+        "payer_us": "system",
+        "receiver_us": username,
+        "amount": payment_data["amount"],
+        "category": REFUND_CATEGORY,
+        "quantity": payment_data["quantity"]
+    }
+    refund_headers = {
+        "Idempotency-Key": f"{idempotency_key}-refund"
+    }
+    response, status = yield Call('refund', 'payment', 'post', PAYMENT_SERVICE_URL, refund_data, refund_headers,
+                                  json=False, timeout=PAYMENT_TIMEOUT, retries=PAYMENT_RETRIES)
+    if status != 200:
+        # da sistemare a mano: la chiave identifica il pagamento nel ledger
+        logger.error(f"Refund of {payment_data['amount']} to {username} failed (payment key {idempotency_key}): {response}")
+    return status == 200
+
+
+def settle_flow(username, payment_data, idempotency_key):
+    """Chiarisce in background il pagamento incerto di un roll non consegnato: ripete la chiave finche' l'esito
+    e' noto e, se l'addebito c'e' stato, lo rimborsa."""
+    response = None
+    for attempt in range(PAYMENT_SETTLE_ATTEMPTS):
+        yield Sleep(PAYMENT_SETTLE_DELAY * (attempt + 1))
+        response, status = yield pay_call(payment_data, idempotency_key, PAYMENT_SETTLE_TIMEOUT, retries=0)
+        if status == 200:
+            yield from refund_flow(username, payment_data, idempotency_key)
+            return
+        if not payment_outcome_unknown(status):
+            return  # pagamento rifiutato: nessun addebito
+    # da sistemare a mano: la chiave identifica il pagamento nel ledger
+    logger.error(f"Payment of {username} still unknown after {PAYMENT_SETTLE_ATTEMPTS} replays (payment key {idempotency_key}): {response}")
+
+
+def roll_flow(username, level, amount, count, access_token):
+    # Step 1: estrazione dalla copia locale del catalogo, prima di pagare: se fallisce non serve un rimborso.
+    # Senza copia locale si usa il buffer di estrazioni del livello; se anche il buffer e' vuoto pagamento ed estrazione (get_gacha_roll) vanno in parallelo: get_gacha_roll non
+    # modifica nulla, quindi se il pagamento fallisce basta scartare l'estrazione; se fallisce l'estrazione
+    # il pagamento viene rimborsato
+    local_gachas, error = draw_local(level, count or 1)
+    if error:
+        return error
+    if local_gachas is None:
+        local_gachas = draw_buffered(level, count or 1)
+    payment_data = {
+        "payer_us": username,
+        "receiver_us": "system",
+        "amount": amount * (count or 1),
+        "category": "gacharoll",  # conta come roll nei rollup del payment_service
+        "quantity": count or 1
+    }
+
+    headers = {
+        "Authorization": f"Bearer {access_token}"
+    }
+
+    # Una chiave per ogni roll: i retry della stessa chiamata non addebitano due volte
+    idempotency_key = str(uuid.uuid4())
+    url = GACHA_SYSTEM_URL + f'?level={level}'
+    if count is not None:
+        url += f'&count={count}'
+    if local_gachas is None:
+        (payment_response, pay_status), (response, status) = yield (
+            pay_call(payment_data, idempotency_key), Call('draw', 'gachasystem', 'get', url, None, headers, json=False))
+    else:
+        payment_response, pay_status = yield pay_call(payment_data, idempotency_key)
+        response, status = (local_gachas if count is not None else local_gachas[0]), 200
+    if payment_outcome_unknown(pay_status):
+        payment_response, pay_status = yield pay_call(payment_data, idempotency_key, PAYMENT_SETTLE_TIMEOUT, retries=0)
+    if payment_outcome_unknown(pay_status):
+        # il roll non viene consegnato: se l'addebito e' avvenuto verra' rimborsato
+        yield Background(settle_flow(username, payment_data, idempotency_key))
+        return {"error": f"Payment outcome unknown, details : {payment_response}", "refund_pending": True}, pay_status
+    if pay_status != 200:
+        return {"error": f"Payment failed , details : {payment_response}"}, pay_status
+    if status != 200:
+        refunded = yield from refund_flow(username, payment_data, idempotency_key)
+        return {"error": f"Failed to fetch gacha from gachasystem, details : {response}", "refunded": refunded}, status
+
+    # Estrai il gacha (o la lista di gacha per il multi-roll) dal servizio Gacha System
+    gachas = response if count is not None else [response]
+
+    # Step 2: Ottieni la data attuale (collected_date) come oggetto datetime.
+    # (gacha_name, collected_date) e' la chiave della collezione: nel multi-roll ogni gacha
+    # ha la data spostata di un microsecondo, cosi' due copie dello stesso gacha non collidono
+    collected_date = datetime.now()  # Oggetto datetime, non stringa
+    collected_dates = [collected_date + timedelta(microseconds=i) for i in range(len(gachas))]
+
+    # Step 3: Inserisci il gacha nel profilo dell'utente (chiamata a profile_setting)
+    if count is None:
+        gacha_data = {
+            "username": username,
+            "gacha_name": gachas[0]['gacha_name'],
+            "collected_date": collected_date.isoformat()
+        }
+        profile_response, status = yield Call('insert', 'profile', 'post', PROFILE_SETTING_URL, gacha_data)
+    else:
+        gacha_data = {
+            "username": username,
+            "gachas": [{"gacha_name": gacha['gacha_name'], "collected_date": date.isoformat()}
+                       for gacha, date in zip(gachas, collected_dates)]
+        }
+        profile_response, status = yield Call('insert', 'profile', 'post', PROFILE_SETTING_BULK_URL, gacha_data)
+    if status != 200:
+        # il gacha non e' stato consegnato: anche in questo caso il pagamento viene rimborsato
+        refunded = yield from refund_flow(username, payment_data, idempotency_key)
+        return {"error": f"Failed to insert gacha into user profile , details {profile_response}", "refunded": refunded}, status
+
+    # Ritorna il risultato del gacha
+    results = [{
+        "gacha_name": gacha['gacha_name'],
+        "description": gacha['description'],
+        "rarity": gacha['rarity'],
+        "img": gacha['img'],
+        "collected_date": date.isoformat()  # Includi la data come stringa nel formato ISO
+    } for gacha, date in zip(gachas, collected_dates)]
+    if count is None:
+        return results[0], 200
+    return {"count": count, "amount": amount * count, "rolls": results}, 200
@@ -0,0 +1,122 @@
+"""Smoke test di app_async.py: /gacharoll con servizi a valle finti (httpx.MockTransport) e un JWT firmato al momento.
+
+Girano nell'immagine di Dockerfile_async, che ha Quart e httpx; senza Quart i test vengono saltati.
+    docker build -f Dockerfile_async -t gacharoll-async gacharoll_service
+    docker run --rm gacharoll-async python -m unittest test_app_async
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import tempfile
+import time
+import unittest
+from urllib.parse import parse_qs
+
+HAS_QUART = importlib.util.find_spec("quart") is not None
+
+if HAS_QUART:
+    import httpx
+    import jwt
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    key_folder = tempfile.mkdtemp()
+    with open(os.path.join(key_folder, 'public_key.pem'), 'wb') as key_file:
+        key_file.write(private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+    # niente copia locale ne' buffer: ogni roll passa da pay, get_gacha_roll e insertGacha
+    os.environ.update(PUBLIC_KEY_PATH=os.path.join(key_folder, 'public_key.pem'), LOCAL_CATALOG='false', ROLL_BUFFER='false',
+                      PAYMENT_SETTLE_DELAY_SECONDS='0')
+
+    import app_async
+
+GACHA = {"gacha_name": "Doge meme", "description": "The original Doge.", "rarity": "legendary", "img": "https://localhost/doge.jpg"}
+
+
+def token(username, audience="gacha_roll"):
+    return jwt.encode({"sub": username, "aud": audience, "exp": int(time.time()) + 300}, private_key, algorithm="RS256")
+
+
+@unittest.skipUnless(HAS_QUART, "quart not installed (see Dockerfile_async)")
+class GacharollAsyncTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.requests = []
+        self.pay_statuses = []  # status delle prossime risposte di /pay, poi 200
+        self.insert_status = 200
+        self.test_app = app_async.app.test_app()
+        await self.test_app.startup()
+        # i client creati all'avvio vengono sostituiti da client verso i servizi finti
+        for service, client in list(app_async.clients.items()):
+            await client.aclose()
+            app_async.clients[service] = httpx.AsyncClient(transport=httpx.MockTransport(self.downstream))
+        self.client = self.test_app.test_client()
+
+    async def asyncTearDown(self):
+        await self.test_app.shutdown()
+
+    def downstream(self, request):
+        self.requests.append(request)
+        if request.url.path == '/pay':
+            status = self.pay_statuses.pop(0) if self.pay_statuses else 200
+            return httpx.Response(status, json={"msg": "Payment successfully executed"})
+        if request.url.path == '/get_gacha_roll':
+            count = request.url.params.get('count')
+            return httpx.Response(200, json=[GACHA] * int(count) if count else GACHA)
+        return httpx.Response(self.insert_status, json={"message": "ok"})
+
+    def payments(self):
+        return [(request.headers['Idempotency-Key'], parse_qs(request.content.decode()))
+                for request in self.requests if request.url.path == '/pay']
+
+    async def roll(self, body, username="user1"):
+        response = await self.client.post('/gacharoll', json=body, headers={"Authorization": f"Bearer {token(username)}"})
+        return response.status_code, json.loads(await response.get_data())
+
+    async def test_roll(self):
+        status, body = await self.roll({"username": "user1", "level": "standard"})
+        self.assertEqual(status, 200, body)
+        self.assertEqual(body["gacha_name"], GACHA["gacha_name"])
+        [(key, payment)] = self.payments()
+        self.assertEqual((payment["payer_us"], payment["amount"], payment["category"]), (["user1"], ["10"], ["gacharoll"]))
+
+    async def test_rejects_missing_token_and_invalid_level(self):
+        response = await self.client.post('/gacharoll', json={"username": "user1", "level": "standard"})
+        self.assertEqual(response.status_code, 401)
+        status, _ = await self.roll({"username": "user1", "level": "golden"})
+        self.assertEqual(status, 400)
+        status, _ = await self.roll({"username": "user2", "level": "standard"}, username="user1")
+        self.assertEqual(status, 403)
+        self.assertEqual(self.payments(), [])
+
+    async def test_unknown_payment_is_replayed_with_the_same_key(self):
+        self.pay_statuses = [504]
+        status, body = await self.roll({"username": "user1", "level": "standard"})
+        self.assertEqual(status, 200, body)
+        keys = [key for key, _ in self.payments()]
+        self.assertEqual(len(keys), 2)
+        self.assertEqual(keys[0], keys[1])
+
+    async def test_still_unknown_payment_is_settled_in_background(self):
+        self.pay_statuses = [504, 504]
+        status, body = await self.roll({"username": "user1", "level": "standard"})
+        self.assertEqual(status, 504)
+        self.assertTrue(body["refund_pending"])
+        # il replay in background trova il pagamento registrato e lo rimborsa
+        await asyncio.gather(*app_async.background_tasks)
+        key = self.payments()[0][0]
+        self.assertEqual([payment_key for payment_key, _ in self.payments()], [key, key, key, f"{key}-refund"])
+
+    async def test_failed_insert_is_refunded(self):
+        self.insert_status = 500
+        status, body = await self.roll({"username": "user1", "level": "premium", "count": 2})
+        self.assertEqual(status, 500)
+        self.assertTrue(body["refunded"])
+        (key, payment), (refund_key, refund) = self.payments()
+        self.assertEqual(refund_key, f"{key}-refund")
+        self.assertEqual((refund["receiver_us"], refund["amount"], refund["quantity"]), (["user1"], ["80"], ["2"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
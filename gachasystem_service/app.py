@@ -1,15 +1,22 @@
 import os
-import random
 import requests, time
-from flask import Flask, request, jsonify , url_for, send_from_directory
+from flask import Flask, request, jsonify , url_for
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
 #from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from werkzeug.utils import secure_filename
 import jwt
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
 import re
+import threading
+import json
+import base64
+import tempfile
+import zipfile
+from image_store import (UPLOAD_FOLDER, ImageUnavailable, InvalidImage, image_executor, image_files_lock,
+                         image_validation_stats, image_validation_wait_stats, pending_images, release_image,
+                         remove_image, schedule_variants, send_image, store_image, store_image_data, validate_image)
+from sampling import LEVEL_PROBABILITIES, RARITIES, CatalogSnapshot
 
 app = Flask(__name__)   # crea un'applicazione Flask
 app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://user:password@db_gachasystem:5432/memes_db'    # URL di connessione al database
@@ -18,9 +25,27 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False    # disabilita il tracciam
 
 public_key_path = os.getenv("PUBLIC_KEY_PATH")
 
-UPLOAD_FOLDER = '/app/static/uploads'  # Percorso dove Docker monta il volume
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}  # Estensioni permesse
 PROFILE_SETTING_URL = "https://profile_setting:5003/deleteGacha"  # Nome del container nel docker-compose
+# Ogni quanti secondi il catalogo in memoria controlla la versione nel database (modifiche fatte da altri worker)
+CATALOG_CHECK_SECONDS = float(os.getenv("CATALOG_CHECK_SECONDS", "5"))
+MAX_ROLL_COUNT = 10  # estrazioni massime per chiamata a get_gacha_roll (multi-roll)
+DRAW_BATCH_MAX = int(os.getenv("DRAW_BATCH_MAX", "500"))  # estrazioni massime per chiamata a draw_batch
+# Import massivo del catalogo (import_gachas): archivio zip con manifest.json e immagini
+IMPORT_MANIFEST = 'manifest.json'
+IMPORT_MAX_ITEMS = int(os.getenv("IMPORT_MAX_ITEMS", "5000"))
+IMPORT_MAX_IMAGE_BYTES = int(os.getenv("IMPORT_MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))  # dimensione decompressa
+IMPORT_BATCH_SIZE = 500  # righe per INSERT
+# Paginazione di list_gachas
+LIST_DEFAULT_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 200
+# Ordinamenti ammessi per list_gachas: nome del parametro -> (colonna, discendente)
+LIST_SORTS = {
+    "name": ("meme_name", False),
+    "-name": ("meme_name", True),
+    "id": ("gacha_id", False),
+    "-id": ("gacha_id", True),
+}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
@@ -119,11 +144,91 @@ class Gacha(db.Model):
     rarity = db.Column(db.String(50), nullable=False)
     description = db.Column(db.String(100), nullable=True)
     #collected_date = db.Column(db.DateTime, default=func.now(), nullable=False)  # Data di raccolta
+    __table_args__ = (
+        # ricerca per prefisso del nome (LIKE 'abc%') anche con collation diversa da C
+        db.Index('idx_memes_name_pattern', 'meme_name', postgresql_ops={'meme_name': 'varchar_pattern_ops'}),
+        # filtro per rarita' con ordinamento per nome o per id, pagina letta direttamente dall'indice
+        db.Index('idx_memes_rarity_name', 'rarity', 'meme_name'),
+        db.Index('idx_memes_rarity_id', 'rarity', 'gacha_id'),
+    )
+
+# Numero di gachas per rarita' ('*' = totale), mantenuto dai trigger in init.sql: evita COUNT(*) sulla tabella memes
+class MemeCount(db.Model):
+    __tablename__ = 'memes_counts'
+    rarity = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+
+# Versione del catalogo, incrementata nella stessa transazione di ogni add/update/delete
+class CatalogVersion(db.Model):
+    __tablename__ = 'catalog_version'
+    id = db.Column(db.Integer, primary_key=True)  # una sola riga, id = 1
+    version = db.Column(db.BigInteger, nullable=False)
+
+def bump_catalog_version():
+    stmt = insert(CatalogVersion.__table__).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={'version': CatalogVersion.__table__.c.version + 1})
+    db.session.execute(stmt)
+
+def gacha_details(gacha):
+    return {
+        "gacha_id": gacha.gacha_id,
+        "gacha_name": gacha.meme_name,
+        "description": gacha.description or "",
+        "rarity": gacha.rarity,
+        #"collected_date": gacha.collected_date.isoformat(),  # Aggiungi la data di raccolta
+        "img": f"https://localhost:5001/images_gacha/uploads/{os.path.basename(gacha.image_path)}"  # URL completo immagine
+    }
+
+class GachaCatalog:
+    """Catalogo in memoria usato dai roll e da get_gacha_collection al posto delle query sulla tabella memes.
+
+    Viene ricaricato in modo lazy quando questo processo modifica il catalogo (invalidate) oppure quando
+    la versione nel database cambia; la versione si controlla al massimo ogni `check_seconds`.
+    Ogni ricarica crea un nuovo CatalogSnapshot, chi ne sta usando uno vecchio non vede modifiche a meta'.
+    """
+    def __init__(self, check_seconds):
+        self.check_seconds = check_seconds
+        self.lock = threading.Lock()
+        self.current = None
+        self.checked_at = 0.0
+
+    def invalidate(self):
+        with self.lock:
+            self.current = None
+
+    def snapshot(self):
+        current = self.current
+        if current is not None and time.monotonic() - self.checked_at < self.check_seconds:
+            return current
+        with self.lock:
+            if self.current is not None and time.monotonic() - self.checked_at < self.check_seconds:
+                return self.current
+            version = db.session.query(CatalogVersion.version).filter_by(id=1).scalar() or 0
+            if self.current is None or version != self.current.version:
+                gachas = [gacha_details(gacha) for gacha in Gacha.query.order_by(Gacha.gacha_id).all()]
+                self.current = CatalogSnapshot(version, gachas)
+            self.checked_at = time.monotonic()
+            return self.current
+
+    def roll(self, level):
+        return self.snapshot().roll(level)
+
+catalog = GachaCatalog(CATALOG_CHECK_SECONDS)
 
 # Funzione per controllare il tipo di file
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Salvataggio, validazione, varianti e servizio delle immagini sono in image_store.py (condiviso con profile_setting);
+# qui resta solo il controllo "nessun record la usa", che dipende dal modello
+def remove_unused_image(path):
+    """Elimina l'immagine solo se nessun gacha salvato la usa e nessuna richiesta in corso la sta riusando."""
+    with image_files_lock:
+        if pending_images[path] or Gacha.query.filter_by(image_path=path).first():
+            return False
+        remove_image(path)
+        return True
+
 # SOLO ADMIN
 @app.route('/add_gacha', methods=['POST'])
 #@jwt_required() # Richiede un token JWT valido per accedere a questa funzione
@@ -166,18 +271,19 @@ def add_gacha():
     if not allowed_file(file.filename):
         return jsonify({"error": "File type not allowed"}), 400
 
-    # Genera un nome sicuro per il file
-    filename = secure_filename(file.filename)
-
-    # Salva l'immagine nella cartella configurata
-    save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(save_path)
-
     # Controlla se esiste già un record con lo stesso nome
     existing_gacha = Gacha.query.filter_by(meme_name=name).first()
     if existing_gacha:
         return jsonify({"error": f"A Gacha with the name '{name}' already exists."}), 400
 
+    # Valida e normalizza l'immagine nel pool di processi, poi la salva con l'hash del contenuto come nome
+    try:
+        filename, save_path, created = store_image(file)
+    except InvalidImage as e:
+        return jsonify({"error": str(e)}), 400
+    except ImageUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+
     # Crea un nuovo oggetto Gacha
     new_gacha = Gacha(
         meme_name=name,
@@ -189,10 +295,18 @@ def add_gacha():
     # Aggiungi al database e salva
     try:
         db.session.add(new_gacha)
+        bump_catalog_version()
         db.session.commit()
     except Exception as e:
         db.session.rollback()
+        release_image(save_path)
+        if created:
+            remove_unused_image(save_path)
         return jsonify({"error": str(e)}), 500
+    release_image(save_path)
+    catalog.invalidate()
+    if created:
+        schedule_variants(save_path)
 
     return jsonify({"message": "Gacha added successfully", 
                     "gacha": {
@@ -203,6 +317,181 @@ def add_gacha():
                         #,"collected_date": new_gacha.collected_date  # Restituisci anche la data di raccolta
                     }}), 200
 
+def read_import_manifest(archive):
+    """Legge e valida manifest.json. Restituisce (lista di item, errore)."""
+    try:
+        if archive.getinfo(IMPORT_MANIFEST).file_size > IMPORT_MAX_IMAGE_BYTES:
+            return None, f"{IMPORT_MANIFEST} is too large"
+        manifest = json.loads(archive.read(IMPORT_MANIFEST))
+    except KeyError:
+        return None, f"Missing {IMPORT_MANIFEST} in the archive"
+    except (ValueError, UnicodeError):
+        return None, f"{IMPORT_MANIFEST} is not valid JSON"
+    if isinstance(manifest, dict):
+        manifest = manifest.get('gachas')
+    if not isinstance(manifest, list) or not manifest:
+        return None, f"{IMPORT_MANIFEST} must be a non-empty list of gachas"
+    if len(manifest) > IMPORT_MAX_ITEMS:
+        return None, f"Too many gachas in the manifest (max {IMPORT_MAX_ITEMS})"
+    return manifest, None
+
+def check_import_item(item, archive_entries, seen_names):
+    """Validazione di un item del manifest, senza leggere l'immagine. Restituisce (valori, errore)."""
+    if not isinstance(item, dict):
+        return None, "Invalid manifest entry"
+    name = sanitize_input_gacha(item.get('gacha_name'))
+    rarity = sanitize_input(item.get('rarity'))
+    description = sanitize_input(item.get('description'))
+    image = item.get('image')
+    if not name or not rarity or not isinstance(image, str) or not image:
+        return None, "Missing required fields (image, gacha_name, or rarity)"
+    if rarity not in RARITIES:
+        return None, f"Invalid rarity. Valid rarities are {', '.join(RARITIES)}."
+    if not allowed_file(image):
+        return None, "File type not allowed"
+    entry = archive_entries.get(image)
+    if entry is None:
+        return None, f"Image '{image}' not found in the archive"
+    if entry.file_size > IMPORT_MAX_IMAGE_BYTES:
+        return None, f"Image '{image}' is larger than {IMPORT_MAX_IMAGE_BYTES} bytes"
+    if name in seen_names:
+        return None, f"Duplicate gacha name '{name}' in the manifest"
+    seen_names.add(name)
+    return {'meme_name': name, 'rarity': rarity, 'description': description, 'image': image}, None
+
+def import_image(archive_path, image):
+    """Legge un'immagine dall'archivio, la valida e normalizza nel pool di processi e la salva per hash.
+    Ogni chiamata apre il proprio ZipFile, cosi' i worker decomprimono in parallelo."""
+    with zipfile.ZipFile(archive_path) as archive:
+        data = archive.read(image)
+    return store_image_data(*validate_image(data))
+
+# SOLO ADMIN
+# Import massivo: archivio zip con manifest.json ([{"gacha_name", "rarity", "description", "image"}, ...]) e le immagini.
+# Le immagini sono verificate e salvate in parallelo, le righe inserite a blocchi in un'unica transazione,
+# la versione del catalogo incrementata una sola volta. La risposta riporta l'esito di ogni item.
+@app.route('/import_gachas', methods=['POST'])
+def import_gachas():
+
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        # Verifica il token con la chiave pubblica
+        decoded_token = jwt.decode(access_token, public_key, algorithms=["RS256"], audience="gachasystem")  
+        if decoded_token.get("scope") == "user":
+            return jsonify({"error": "Unauthorized action for the user"}), 403
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    if 'archive' not in request.files:
+        return jsonify({"error": "Missing required field archive"}), 400
+
+    # L'archivio va su un file temporaneo: ogni worker lo riapre per leggere le proprie immagini
+    fd, archive_path = tempfile.mkstemp(suffix='.zip')
+    os.close(fd)
+    try:
+        request.files['archive'].save(archive_path)
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                manifest, error = read_import_manifest(archive)
+                archive_entries = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+        except zipfile.BadZipFile:
+            return jsonify({"error": "archive is not a valid zip file"}), 400
+        if error:
+            return jsonify({"error": error}), 400
+
+        report = [{"gacha_name": item.get('gacha_name') if isinstance(item, dict) else None} for item in manifest]
+        items = {}
+        seen_names = set()
+        for i, item in enumerate(manifest):
+            values, error = check_import_item(item, archive_entries, seen_names)
+            if error:
+                report[i].update(status="error", error=error)
+            else:
+                report[i]["gacha_name"] = values['meme_name']
+                items[i] = values
+
+        # Nomi gia' presenti nel catalogo: una query per blocco invece di una per item
+        names = [values['meme_name'] for values in items.values()]
+        existing = set()
+        for start in range(0, len(names), IMPORT_BATCH_SIZE):
+            chunk = names[start:start + IMPORT_BATCH_SIZE]
+            existing.update(name for (name,) in db.session.query(Gacha.meme_name).filter(Gacha.meme_name.in_(chunk)))
+        for i in [i for i, values in items.items() if values['meme_name'] in existing]:
+            report[i].update(status="error", error=f"A Gacha with the name '{items.pop(i)['meme_name']}' already exists.")
+
+        # Verifica e salvataggio delle immagini in parallelo
+        futures = {i: image_executor.submit(import_image, archive_path, values['image']) for i, values in items.items()}
+        created_paths = []
+        rows = []
+        for i, future in futures.items():
+            try:
+                filename, path, created = future.result()
+            except Exception as e:
+                report[i].update(status="error", error=f"{items[i]['image']}: {e}")
+                continue
+            if created:
+                created_paths.append(path)
+            items[i]['image_path'] = path
+            rows.append(i)
+    finally:
+        os.remove(archive_path)
+
+    # Inserimento a blocchi; ON CONFLICT copre i nomi aggiunti nel frattempo da un'altra richiesta
+    imported = set()
+    try:
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            chunk = rows[start:start + IMPORT_BATCH_SIZE]
+            stmt = insert(Gacha.__table__).values([{
+                'meme_name': items[i]['meme_name'],
+                'image_path': items[i]['image_path'],
+                'rarity': items[i]['rarity'],
+                'description': items[i]['description']
+            } for i in chunk]).on_conflict_do_nothing(index_elements=['meme_name']).returning(Gacha.__table__.c.meme_name)
+            imported.update(name for (name,) in db.session.execute(stmt))
+        if imported:
+            bump_catalog_version()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # nessuna riga inserita: le immagini appena create non sono usate da nessuno
+        for i in rows:
+            release_image(items[i]['image_path'])
+        for path in created_paths:
+            remove_unused_image(path)
+        return jsonify({"error": str(e)}), 500
+
+    for i in rows:
+        release_image(items[i]['image_path'])
+    if imported:
+        catalog.invalidate()
+    used_paths = {items[i]['image_path'] for i in rows if items[i]['meme_name'] in imported}
+    for path in created_paths:
+        if path in used_paths:
+            schedule_variants(path)
+        else:
+            remove_unused_image(path)
+
+    for i in rows:
+        if items[i]['meme_name'] in imported:
+            report[i].update(status="imported", image_path=items[i]['image_path'])
+        else:
+            report[i].update(status="error", error=f"A Gacha with the name '{items[i]['meme_name']}' already exists.")
+
+    return jsonify({
+        "imported": len(imported),
+        "failed": len(report) - len(imported),
+        "items": report
+    }), 200
+
 @app.route('/delete_gacha', methods=['DELETE'])
 # @jwt_required()  # Sblocca questa linea se vuoi proteggere l'endpoint con JWT
 def delete_gacha():
@@ -238,14 +527,17 @@ def delete_gacha():
     if not gacha:
         return jsonify({"error": f"Gacha with name '{gacha_name}' not found."}), 404
 
-    # try:
-        # Elimina l'immagine dal filesystem
-    if gacha.image_path and os.path.exists(gacha.image_path):
-        os.remove(gacha.image_path)
-    
     # Rimuove il record dal database
+    image_path = gacha.image_path
     db.session.delete(gacha)
+    bump_catalog_version()
     db.session.commit()
+    catalog.invalidate()
+
+    # try:
+        # Elimina l'immagine dal filesystem, solo se nessun altro gacha usa lo stesso file (upload deduplicati)
+    if image_path:
+        remove_unused_image(image_path)
 
     # Chiamata al servizio profile_setting per rimuovere il gacha
     payload = {
@@ -321,10 +613,12 @@ def update_gacha():
 
     # Commit delle modifiche al database
     try:
+        bump_catalog_version()
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
+    catalog.invalidate()
 
     # Restituisci una risposta di successo con i dati aggiornati
     return jsonify({
@@ -341,8 +635,7 @@ def update_gacha():
 def uploaded_file(filename):
     # Crea il percorso completo per la cartella "uploads"
     uploads_folder = os.path.join(app.root_path, 'static', 'uploads')
-    # Restituisce il file dalla cartella "uploads", 404 se il file non esiste
-    return send_from_directory(uploads_folder, filename)
+    return send_image(uploads_folder, filename)
 
 @app.route('/get_gacha_collection', methods=['GET'])
 def get_gacha_collection():
@@ -363,48 +656,222 @@ def get_gacha_collection():
     except InvalidTokenError:
         return jsonify({"error": "Invalid token"}), 401
 
-    data= request.get_json()
+    # il body e' facoltativo: una GET condizionale (If-None-Match) sull'intero catalogo puo' non averlo
+    data= request.get_json(silent=True) or {}
     # Estrai il parametro 'gacha_name' dalla query string (facoltativo), supporta una lista separata da virgola
     # gacha_names = sanitize_input_gacha(data.get('gacha_name'))
     gacha_names = data.get('gacha_name')
 
+    snapshot = catalog.snapshot()
+
     # Sanitizza e verifica l'input
     if gacha_names:
         gacha_names = sanitize_input_gacha(gacha_names)
 
-        if isinstance(gacha_names, list):
-            # Cerca i gachas con i nomi specificati
-            gachas = Gacha.query.filter(Gacha.meme_name.in_(gacha_names)).all()
-        elif isinstance(gacha_names, str):
+        if isinstance(gacha_names, str):
             # Singolo nome fornito come stringa
-            gachas = Gacha.query.filter_by(meme_name=gacha_names).all()
-        else:
+            gacha_names = [gacha_names]
+        elif not isinstance(gacha_names, list):
             return jsonify({"error": "Invalid input for gacha_name"}), 400
 
-        if not gachas:
+        # Cerca i gachas con i nomi specificati nell'indice per nome (ogni nome una sola volta, come con IN)
+        gacha_list = [snapshot.by_name[name] for name in dict.fromkeys(gacha_names) if name in snapshot.by_name]
+        if not gacha_list:
             return jsonify({"error": "No gachas found with the specified names"}), 404
-    else:
-        # Se non viene passato 'gacha_name', restituiamo tutta la collezione di gachas
-        gachas = Gacha.query.all()
-        if not gachas:
-            return jsonify({"error": "No gachas found"}), 404
-    
-    # Dettagli della collezione di gachas
-    gacha_list = []
-    for gacha in gachas:
-        gacha_details = {
-            "gacha_id": gacha.gacha_id,
-            "gacha_name": gacha.meme_name,
-            "description": gacha.description or "",
-            "rarity": gacha.rarity,
-            #"collected_date": gacha.collected_date.isoformat(),  # Aggiungi la data di raccolta
-            "img": f"https://localhost:5001/images_gacha/uploads/{os.path.basename(gacha.image_path)}"  # URL completo immagine
-        }
-        
+        return jsonify(gacha_list), 200
+
+    # Se non viene passato 'gacha_name', restituiamo tutta la collezione di gachas,
+    # gia' serializzata nello snapshot; 304 se il client ha gia' questa versione
+    if not snapshot.gachas:
+        return jsonify({"error": "No gachas found"}), 404
+    if request.if_none_match.contains(snapshot.etag):
+        return catalog_response(snapshot, status=304)
+    return catalog_response(snapshot, snapshot.body)
+
+def encode_cursor(sort, key):
+    payload = json.dumps({"s": sort, "k": key}).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+def decode_cursor(cursor, sort):
+    """Ritorna la chiave dell'ultimo elemento della pagina precedente, None se il cursore non e' valido per questo ordinamento."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(payload, dict) or payload.get("s") != sort:
+        return None
+    column, _ = LIST_SORTS[sort]
+    key = payload.get("k")
+    if not isinstance(key, int if column == "gacha_id" else str) or isinstance(key, bool):
+        return None
+    return key
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Catalogo paginato con filtri: legge dalla tabella memes tramite gli indici su rarity e meme_name
+# (paginazione keyset, nessun OFFSET) e prende il totale dal contatore memes_counts
+@app.route('/list_gachas', methods=['GET'])
+def list_gachas():
+
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        # Verifica il token con la chiave pubblica
+        jwt.decode(access_token, public_key, algorithms=["RS256"], audience="gachasystem")  
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
 
-        gacha_list.append(gacha_details)
+    rarity = sanitize_input(request.args.get('rarity'))
+    prefix = sanitize_input_gacha(request.args.get('prefix') or '')
+    sort = request.args.get('sort', 'name')
+    cursor = request.args.get('cursor')
 
-    return jsonify(gacha_list), 200
+    if rarity and rarity not in RARITIES:
+        return jsonify({"error": f"Invalid rarity. Valid rarities are {', '.join(RARITIES)}."}), 400
+    if sort not in LIST_SORTS:
+        return jsonify({"error": f"Invalid sort. Valid values are {', '.join(LIST_SORTS)}."}), 400
+    try:
+        page_size = int(request.args.get('page_size', LIST_DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "page_size must be an integer"}), 400
+    if not 1 <= page_size <= LIST_MAX_PAGE_SIZE:
+        return jsonify({"error": f"page_size must be between 1 and {LIST_MAX_PAGE_SIZE}"}), 400
+
+    column_name, descending = LIST_SORTS[sort]
+    column = getattr(Gacha, column_name)
+    query = Gacha.query
+    if rarity:
+        query = query.filter(Gacha.rarity == rarity)
+    if prefix:
+        query = query.filter(Gacha.meme_name.like(escape_like(prefix) + '%', escape='\\'))
+    if cursor:
+        key = decode_cursor(cursor, sort)
+        if key is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        # meme_name e gacha_id sono unici, la chiave da sola basta a riprendere dopo l'ultimo elemento
+        query = query.filter(column < key if descending else column > key)
+    query = query.order_by(column.desc() if descending else column.asc())
+
+    # un elemento in piu' per sapere se esiste una pagina successiva
+    rows = query.limit(page_size + 1).all()
+    items = [gacha_details(gacha) for gacha in rows[:page_size]]
+    next_cursor = None
+    if len(rows) > page_size:
+        next_cursor = encode_cursor(sort, getattr(rows[page_size - 1], column_name))
+
+    # Il contatore copre solo i filtri per rarita'; con un prefisso il totale non e' noto senza contare
+    total = None
+    if not prefix:
+        total = db.session.query(MemeCount.count).filter_by(rarity=rarity or '*').scalar() or 0
+
+    return jsonify({
+        "items": items,
+        "page_size": page_size,
+        "sort": sort,
+        "next_cursor": next_cursor,
+        "total": total
+    }), 200
+
+def catalog_response(snapshot, body=None, status=200):
+    response = app.response_class(body, status=status, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['X-Catalog-Version'] = str(snapshot.version)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "image_validation": image_validation_stats.summary(),
+        "image_validation_wait": image_validation_wait_stats.summary()
+    }), 200
+
+# Versione corrente del catalogo, per chi ne tiene una copia locale e vuole sapere se ricaricarla.
+# Le probabilita' dei livelli sono incluse, cosi' le copie locali estraggono con le stesse regole di get_gacha_roll
+@app.route('/catalog_version', methods=['GET'])
+def catalog_version():
+    snapshot = catalog.snapshot()
+    return jsonify({"version": snapshot.version, "etag": snapshot.etag, "count": len(snapshot.gachas),
+                    "probabilities": LEVEL_PROBABILITIES}), 200
+
+# Catalogo completo per le copie locali degli altri servizi (gacharoll): stesso corpo ed ETag di
+# get_gacha_collection. E' chiamato dai thread di sincronizzazione e non da un utente, quindi accetta
+# solo token di servizio (scope "service", firmati con la chiave privata montata in gacharoll)
+@app.route('/catalog_snapshot', methods=['GET'])
+def catalog_snapshot():
+
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        # Verifica il token con la chiave pubblica
+        decoded_token = jwt.decode(access_token, public_key, algorithms=["RS256"], audience="gachasystem")
+        if decoded_token.get("scope") != "service":
+            return jsonify({"error": "Only internal services can read the catalog snapshot"}), 403
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    snapshot = catalog.snapshot()
+    if request.if_none_match.contains(snapshot.etag):
+        return catalog_response(snapshot, status=304)
+    return catalog_response(snapshot, snapshot.body)
+
+# Estrazioni in blocco per i buffer di gacharoll: stesse regole di get_gacha_roll, tutte dalla stessa versione
+# del catalogo (header X-Catalog-Version). Chiamata dal thread di riempimento: come catalog_snapshot accetta
+# solo token di servizio
+@app.route('/draw_batch', methods=['GET'])
+def draw_batch():
+
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        # Verifica il token con la chiave pubblica
+        decoded_token = jwt.decode(access_token, public_key, algorithms=["RS256"], audience="gachasystem")
+        if decoded_token.get("scope") != "service":
+            return jsonify({"error": "Only internal services can draw batches"}), 403
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    level = sanitize_input(request.args.get('level'))
+    if level not in LEVEL_PROBABILITIES:
+        return jsonify({"error": "Invalid level. Valid levels are 'standard', 'medium', and 'premium'."}), 400
+    try:
+        count = int(request.args.get('count', '1'))
+    except ValueError:
+        return jsonify({"error": "count must be an integer"}), 400
+    if not 1 <= count <= DRAW_BATCH_MAX:
+        return jsonify({"error": f"count must be between 1 and {DRAW_BATCH_MAX}"}), 400
+
+    snapshot = catalog.snapshot()
+    gachas = [snapshot.roll(level) for _ in range(count)]
+    if not all(gachas):
+        return jsonify({"error": f"No gacha found for a roll of level '{level}'."}), 404
+    response = jsonify(gachas)
+    response.headers['X-Catalog-Version'] = str(snapshot.version)
+    return response, 200
 
 @app.route('/get_gacha_roll', methods=['GET'])
 def get_gacha_roll():
@@ -427,47 +894,30 @@ def get_gacha_roll():
 
     # Estrai il parametro 'level' dalla query string
     level = sanitize_input(request.args.get('level'))
+    # Con 'count' vengono fatte piu' estrazioni e la risposta e' una lista
+    count = request.args.get('count')
     
-    # Definizione delle probabilità per ogni livello
-    probabilities = {
-        "standard": {"common": 70, "rare": 25, "legendary": 5},
-        "medium": {"common": 50, "rare": 25, "legendary": 25},
-        "premium": {"common": 30, "rare": 40, "legendary": 30},
-    }
-
     # Controlla che il livello sia valido
-    if level not in probabilities:
+    if level not in LEVEL_PROBABILITIES:
         return jsonify({"error": "Invalid level. Valid levels are 'standard', 'medium', and 'premium'."}), 400
+    if count is not None:
+        try:
+            count = int(count)
+        except ValueError:
+            return jsonify({"error": "count must be an integer"}), 400
+        if not 1 <= count <= MAX_ROLL_COUNT:
+            return jsonify({"error": f"count must be between 1 and {MAX_ROLL_COUNT}"}), 400
 
-    # Determina la rarità in base alle probabilità
-    rarity_to_extract = random.choices(
-        population=["common", "rare", "legendary"],
-        weights=[
-            probabilities[level]["common"],
-            probabilities[level]["rare"],
-            probabilities[level]["legendary"],
-        ],
-        k=1
-    )[0]
-
-    # Cerca casualmente un gacha dal database in base alla rarità
-    gacha = Gacha.query.filter_by(rarity=rarity_to_extract).order_by(func.random()).first()
+    # Estrazione dal catalogo in memoria: rarita' con il metodo alias, poi un gacha a caso nel bucket
+    gachas = [catalog.roll(level) for _ in range(count or 1)]
 
     # Controlla se un gacha è stato trovato
-    if not gacha:
+    if not all(gachas):
         return jsonify({"error": f"No gacha found for a roll of level '{level}'."}), 404
 
-    # Prepara i dettagli del gacha per la risposta
-    gacha_details = {
-        "gacha_id": gacha.gacha_id,
-        "gacha_name": gacha.meme_name,
-        "description": gacha.description or "",
-        "rarity": gacha.rarity,
-        #"collected_date": gacha.collected_date.isoformat(),
-        "img": f"https://localhost:5001/images_gacha/uploads/{os.path.basename(gacha.image_path)}"
-    }
-
-    return jsonify(gacha_details), 200
+    if count is None:
+        return jsonify(gachas[0]), 200
+    return jsonify(gachas), 200
 
 
 if __name__ == '__main__':
@@ -1,5 +1,8 @@
+import base64
+import json
 import os
 import random
+import zipfile
 from datetime import datetime
 from flask import Flask, request, jsonify , url_for, send_from_directory
 from werkzeug.utils import secure_filename
@@ -253,6 +256,88 @@ def update_gacha():
         }
     }), 200
 
+RARITIES = ("common", "rare", "legendary")
+IMPORT_MANIFEST = 'manifest.json'
+IMPORT_MAX_ITEMS = 5000
+
+@app.route('/import_gachas', methods=['POST'])
+def import_gachas():
+
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        # Verifica il token con la chiave pubblica
+        decoded_token = mock_decode_jwt(access_token, public_key, algorithms=["RS256"], audience="gachasystem")  
+        if decoded_token.get("scope") == "user":
+            return jsonify({"error": "Unauthorized action for the user"}), 403
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    if 'archive' not in request.files:
+        return jsonify({"error": "Missing required field archive"}), 400
+
+    # Nessuna immagine viene salvata: si controllano solo il manifest e la presenza dei file nell'archivio
+    try:
+        with zipfile.ZipFile(request.files['archive']) as archive:
+            archive_entries = {info.filename for info in archive.infolist() if not info.is_dir()}
+            try:
+                manifest = json.loads(archive.read(IMPORT_MANIFEST))
+            except KeyError:
+                return jsonify({"error": f"Missing {IMPORT_MANIFEST} in the archive"}), 400
+            except (ValueError, UnicodeError):
+                return jsonify({"error": f"{IMPORT_MANIFEST} is not valid JSON"}), 400
+    except zipfile.BadZipFile:
+        return jsonify({"error": "archive is not a valid zip file"}), 400
+    if isinstance(manifest, dict):
+        manifest = manifest.get('gachas')
+    if not isinstance(manifest, list) or not manifest:
+        return jsonify({"error": f"{IMPORT_MANIFEST} must be a non-empty list of gachas"}), 400
+    if len(manifest) > IMPORT_MAX_ITEMS:
+        return jsonify({"error": f"Too many gachas in the manifest (max {IMPORT_MAX_ITEMS})"}), 400
+
+    report = []
+    seen_names = set()
+    imported = 0
+    for item in manifest:
+        if not isinstance(item, dict):
+            report.append({"gacha_name": None, "status": "error", "error": "Invalid manifest entry"})
+            continue
+        name = sanitize_input_gacha(item.get('gacha_name'))
+        rarity = sanitize_input(item.get('rarity'))
+        image = item.get('image')
+        entry = {"gacha_name": name or item.get('gacha_name')}
+        if not name or not rarity or not isinstance(image, str) or not image:
+            entry.update(status="error", error="Missing required fields (image, gacha_name, or rarity)")
+        elif rarity not in RARITIES:
+            entry.update(status="error", error=f"Invalid rarity. Valid rarities are {', '.join(RARITIES)}.")
+        elif not allowed_file(image):
+            entry.update(status="error", error="File type not allowed")
+        elif image not in archive_entries:
+            entry.update(status="error", error=f"Image '{image}' not found in the archive")
+        elif name in seen_names:
+            entry.update(status="error", error=f"Duplicate gacha name '{name}' in the manifest")
+        elif mock_search_gacha(name):
+            entry.update(status="error", error=f"A Gacha with the name '{name}' already exists.")
+        else:
+            seen_names.add(name)
+            entry.update(status="imported", image_path=os.path.join(UPLOAD_FOLDER, secure_filename(image)))
+            imported += 1
+        report.append(entry)
+
+    return jsonify({
+        "imported": imported,
+        "failed": len(report) - imported,
+        "items": report
+    }), 200
+
 # route che serve le immagini
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
@@ -372,6 +457,95 @@ def get_gacha_collection():
     return jsonify(gacha_list), 200
 
 
+LIST_DEFAULT_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 200
+LIST_SORTS = {
+    "name": ("meme_name", False),
+    "-name": ("meme_name", True),
+    "id": ("gacha_id", False),
+    "-id": ("gacha_id", True),
+}
+
+def encode_cursor(sort, key):
+    payload = json.dumps({"s": sort, "k": key}).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+def decode_cursor(cursor, sort):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(payload, dict) or payload.get("s") != sort:
+        return None
+    return payload.get("k")
+
+@app.route('/list_gachas', methods=['GET'])
+def list_gachas():
+
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        # Verifica il token con la chiave pubblica
+        mock_decode_jwt(access_token, public_key, algorithms=["RS256"], audience="gachasystem")  
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    rarity = sanitize_input(request.args.get('rarity'))
+    prefix = sanitize_input_gacha(request.args.get('prefix') or '')
+    sort = request.args.get('sort', 'name')
+    cursor = request.args.get('cursor')
+
+    if rarity and rarity not in RARITIES:
+        return jsonify({"error": f"Invalid rarity. Valid rarities are {', '.join(RARITIES)}."}), 400
+    if sort not in LIST_SORTS:
+        return jsonify({"error": f"Invalid sort. Valid values are {', '.join(LIST_SORTS)}."}), 400
+    try:
+        page_size = int(request.args.get('page_size', LIST_DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "page_size must be an integer"}), 400
+    if not 1 <= page_size <= LIST_MAX_PAGE_SIZE:
+        return jsonify({"error": f"page_size must be between 1 and {LIST_MAX_PAGE_SIZE}"}), 400
+
+    column, descending = LIST_SORTS[sort]
+    gachas = [g for g in mock_gacha_db if not rarity or g["rarity"] == rarity]
+    if prefix:
+        gachas = [g for g in gachas if g["meme_name"].startswith(prefix)]
+    gachas.sort(key=lambda g: g[column], reverse=descending)
+    if cursor:
+        key = decode_cursor(cursor, sort)
+        if key is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        gachas = [g for g in gachas if (g[column] < key if descending else g[column] > key)]
+
+    page = gachas[:page_size]
+    items = [{
+        "gacha_id": g['gacha_id'],
+        "gacha_name": g['meme_name'],
+        "description": g['description'],
+        "rarity": g['rarity'],
+        "img": f"https://localhost:5001/images_gacha/uploads/"
+    } for g in page]
+    next_cursor = encode_cursor(sort, page[-1][column]) if len(gachas) > page_size else None
+    # come nel servizio, con un prefisso il totale non viene calcolato
+    total = None if prefix else len([g for g in mock_gacha_db if not rarity or g["rarity"] == rarity])
+
+    return jsonify({
+        "items": items,
+        "page_size": page_size,
+        "sort": sort,
+        "next_cursor": next_cursor,
+        "total": total
+    }), 200
+
+
 @app.route('/get_gacha_roll', methods=['GET'])
 def get_gacha_roll():
 
@@ -0,0 +1,12 @@
+-- Versione del catalogo usata dal catalogo in memoria, per i database creati prima di questa versione.
+-- Va eseguita prima di avviare il servizio aggiornato: senza la tabella ogni lettura del catalogo fallisce.
+-- Uso: psql -U user -d memes_db -f migrate_catalog_version.sql
+BEGIN;
+-- Versione del catalogo: incrementata a ogni add/update/delete, i processi la usano per ricaricare il catalogo in memoria
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+
+INSERT INTO catalog_version (id, version) VALUES (1, 1) ON CONFLICT (id) DO NOTHING;
+COMMIT;
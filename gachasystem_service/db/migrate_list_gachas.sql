@@ -0,0 +1,51 @@
+-- Indici e contatore per rarita' usati da list_gachas, per i database creati prima di questa versione.
+-- Uso: psql -U user -d memes_db -f migrate_list_gachas.sql
+BEGIN;
+-- blocca le scritture sul catalogo finche' il contatore non e' allineato
+LOCK TABLE memes IN SHARE ROW EXCLUSIVE MODE;
+-- Indici per list_gachas: prefisso del nome e filtro per rarita' con ordinamento per nome o id
+CREATE INDEX IF NOT EXISTS idx_memes_name_pattern ON memes (meme_name varchar_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_memes_rarity_name ON memes (rarity, meme_name);
+CREATE INDEX IF NOT EXISTS idx_memes_rarity_id ON memes (rarity, gacha_id);
+
+-- Contatore dei gachas per rarita' ('*' = totale), mantenuto dai trigger: list_gachas non fa COUNT(*)
+CREATE TABLE IF NOT EXISTS memes_counts (
+    rarity VARCHAR(50) PRIMARY KEY,
+    count BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION memes_counts_add(r VARCHAR, delta BIGINT) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO memes_counts (rarity, count) VALUES (r, delta)
+    ON CONFLICT (rarity) DO UPDATE SET count = memes_counts.count + EXCLUDED.count;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION memes_counts_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM memes_counts_add(NEW.rarity, 1);
+        PERFORM memes_counts_add('*', 1);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM memes_counts_add(OLD.rarity, -1);
+        PERFORM memes_counts_add('*', -1);
+    ELSIF NEW.rarity IS DISTINCT FROM OLD.rarity THEN
+        PERFORM memes_counts_add(OLD.rarity, -1);
+        PERFORM memes_counts_add(NEW.rarity, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS memes_counts_insert_delete ON memes;
+CREATE TRIGGER memes_counts_insert_delete AFTER INSERT OR DELETE ON memes
+    FOR EACH ROW EXECUTE FUNCTION memes_counts_trigger();
+DROP TRIGGER IF EXISTS memes_counts_update ON memes;
+CREATE TRIGGER memes_counts_update AFTER UPDATE OF rarity ON memes
+    FOR EACH ROW EXECUTE FUNCTION memes_counts_trigger();
+
+-- Allinea il contatore alle righe gia' presenti (inserite prima dei trigger)
+DELETE FROM memes_counts;
+INSERT INTO memes_counts (rarity, count) SELECT rarity, COUNT(*) FROM memes GROUP BY rarity;
+INSERT INTO memes_counts (rarity, count) SELECT '*', COUNT(*) FROM memes;
+COMMIT;
@@ -0,0 +1,193 @@
+"""Simulatore deterministico dei roll e benchmark del percorso di estrazione.
+
+Usa le stesse tabelle alias di get_gacha_roll (LEVEL_SAMPLERS in sampling.py) per estrarre milioni di rarita'
+con NumPy e un seed fisso, e stampa per ogni livello:
+  - frequenza di ogni rarita' con intervallo di confidenza, confrontata con LEVEL_PROBABILITIES;
+  - costo atteso in Memecoins per ottenere un legendary, teorico e simulato, e i roll necessari
+    tra un legendary e il successivo (p50/p90/p99);
+  - roll al secondo del campionamento vettoriale e del percorso reale (CatalogSnapshot.roll) su un
+    catalogo sintetico, usabili come benchmark di regressione con --min-rolls-per-second.
+
+Uso (dal container del gachasystem):
+    python roll_simulator.py [--rolls 10000000] [--seed 42] [--prices standard=10,medium=20,premium=40] [--json]
+
+Esce con codice 1 se una frequenza e' fuori dal suo intervallo di confidenza o se il percorso reale
+e' piu' lento di --min-rolls-per-second.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+from sampling import LEVEL_PROBABILITIES, LEVEL_SAMPLERS, RARITIES, CatalogSnapshot
+
+# Prezzi dei roll in gacharoll_service (importo addebitato da /pay per livello)
+DEFAULT_PRICES = {"standard": 10, "medium": 20, "premium": 40}
+LEGENDARY = RARITIES.index("legendary")
+# z per intervalli di confidenza bilaterali
+Z_SCORES = {0.95: 1.959964, 0.99: 2.575829, 0.999: 3.290527}
+
+
+def alias_arrays(sampler):
+    return np.asarray(sampler.prob, dtype=np.float64), np.asarray(sampler.alias, dtype=np.int64)
+
+
+def sample_rarities(prob, alias, size, rng):
+    """Versione vettoriale di AliasSampler.sample: stessa tabella, size estrazioni in una volta."""
+    i = rng.integers(len(prob), size=size)
+    return np.where(rng.random(size) < prob[i], i, alias[i])
+
+
+def simulate_level(level, rolls, chunk, rng):
+    """Conta le rarita' estratte e le distanze tra legendary consecutivi, a blocchi di `chunk` roll."""
+    prob, alias = alias_arrays(LEVEL_SAMPLERS[level])
+    counts = np.zeros(len(RARITIES), dtype=np.int64)
+    gaps = []
+    last_legendary = -1  # indice globale dell'ultimo legendary
+    started = time.perf_counter()
+    for offset in range(0, rolls, chunk):
+        drawn = sample_rarities(prob, alias, min(chunk, rolls - offset), rng)
+        counts += np.bincount(drawn, minlength=len(RARITIES))
+        positions = np.flatnonzero(drawn == LEGENDARY) + offset
+        if len(positions):
+            gaps.append(np.diff(positions, prepend=last_legendary))
+            last_legendary = positions[-1]
+    elapsed = time.perf_counter() - started
+    gaps = np.concatenate(gaps) if gaps else np.array([], dtype=np.int64)
+    return counts, gaps, elapsed
+
+
+def confidence_interval(hits, n, z):
+    """Intervallo di Wilson per una proporzione, corretto anche per probabilita' vicine a 0 o 1."""
+    p = hits / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return center - half, center + half
+
+
+def benchmark_roll_path(level, rolls, seed, catalog_size):
+    """Roll al secondo di CatalogSnapshot.roll, il codice eseguito da get_gacha_roll, su un catalogo sintetico."""
+    gachas = [{"gacha_id": i, "gacha_name": f"gacha {i}", "description": "", "rarity": RARITIES[i % len(RARITIES)], "img": ""}
+              for i in range(catalog_size)]
+    snapshot = CatalogSnapshot(0, gachas)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    for _ in range(rolls):
+        snapshot.roll(level, rng)
+    return rolls / (time.perf_counter() - started)
+
+
+def report_level(level, price, counts, gaps, elapsed, rolls, z):
+    expected = LEVEL_PROBABILITIES[level]
+    total = sum(expected.values())
+    rarities = {}
+    for i, rarity in enumerate(RARITIES):
+        low, high = confidence_interval(counts[i], rolls, z)
+        p = expected[rarity] / total
+        rarities[rarity] = {
+            "count": int(counts[i]),
+            "frequency": counts[i] / rolls,
+            "ci_low": float(low),
+            "ci_high": float(high),
+            "expected": p,
+            "within_ci": bool(low <= p <= high),
+        }
+    p_legendary = expected["legendary"] / total
+    legendaries = int(counts[LEGENDARY])
+    return {
+        "level": level,
+        "rolls": rolls,
+        "price": price,
+        "rarities": rarities,
+        # un legendary arriva in media ogni 1/p roll (distribuzione geometrica)
+        "cost_per_legendary_expected": price / p_legendary if p_legendary else None,
+        "cost_per_legendary_simulated": price * rolls / legendaries if legendaries else None,
+        "rolls_to_legendary": {
+            "p50": int(np.percentile(gaps, 50)) if len(gaps) else None,
+            "p90": int(np.percentile(gaps, 90)) if len(gaps) else None,
+            "p99": int(np.percentile(gaps, 99)) if len(gaps) else None,
+            "max": int(gaps.max()) if len(gaps) else None,
+        },
+        "vectorized_rolls_per_second": rolls / elapsed if elapsed else None,
+    }
+
+
+def parse_prices(value):
+    prices = dict(DEFAULT_PRICES)
+    for item in filter(None, value.split(',')):
+        level, _, price = item.partition('=')
+        if level not in LEVEL_PROBABILITIES:
+            raise argparse.ArgumentTypeError(f"unknown level {level}")
+        prices[level] = float(price)
+    return prices
+
+
+def print_report(result, confidence):
+    print(f"seed {result['seed']}, {result['rolls']} rolls per level, {confidence:.1%} confidence")
+    for level in result["levels"]:
+        print(f"\n[{level['level']}] price {level['price']}")
+        for rarity, r in level["rarities"].items():
+            flag = "" if r["within_ci"] else "  <-- expected value outside the interval"
+            print(f"  {rarity:<10} {r['frequency']:.5f}  [{r['ci_low']:.5f}, {r['ci_high']:.5f}]  expected {r['expected']:.5f}{flag}")
+        print(f"  cost per legendary: expected {level['cost_per_legendary_expected']:.2f}, simulated {level['cost_per_legendary_simulated']:.2f}")
+        gaps = level["rolls_to_legendary"]
+        print(f"  rolls between legendaries: p50 {gaps['p50']}, p90 {gaps['p90']}, p99 {gaps['p99']}, max {gaps['max']}")
+        print(f"  vectorized sampling: {level['vectorized_rolls_per_second']:,.0f} rolls/s")
+    bench = result["roll_path"]
+    print(f"\nroll path (CatalogSnapshot.roll, {bench['catalog_size']} gachas): {bench['rolls_per_second']:,.0f} rolls/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate gacha rolls with a seeded RNG and benchmark the roll path')
+    parser.add_argument('--rolls', type=int, default=10000000, help='simulated rolls per level')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--levels', default=','.join(LEVEL_PROBABILITIES), help='comma-separated levels to simulate')
+    parser.add_argument('--prices', type=parse_prices, default=dict(DEFAULT_PRICES), help='e.g. standard=10,medium=20,premium=40')
+    parser.add_argument('--confidence', type=float, choices=sorted(Z_SCORES), default=0.999)
+    parser.add_argument('--chunk', type=int, default=1000000, help='rolls sampled per NumPy batch')
+    parser.add_argument('--bench-rolls', type=int, default=200000, help='rolls for the roll path benchmark')
+    parser.add_argument('--catalog-size', type=int, default=1000, help='gachas in the synthetic benchmark catalog')
+    parser.add_argument('--min-rolls-per-second', type=float, default=0, help='fail if the roll path is slower than this')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    levels = [level for level in args.levels.split(',') if level]
+    unknown = [level for level in levels if level not in LEVEL_PROBABILITIES]
+    if unknown or args.rolls < 1:
+        parser.error(f"invalid levels {unknown}" if unknown else "--rolls must be positive")
+
+    rng = np.random.default_rng(args.seed)
+    z = Z_SCORES[args.confidence]
+    result = {"seed": args.seed, "rolls": args.rolls, "confidence": args.confidence, "levels": []}
+    for level in levels:
+        counts, gaps, elapsed = simulate_level(level, args.rolls, args.chunk, rng)
+        result["levels"].append(report_level(level, args.prices[level], counts, gaps, elapsed, args.rolls, z))
+    result["roll_path"] = {
+        "level": levels[0],
+        "catalog_size": args.catalog_size,
+        "rolls_per_second": benchmark_roll_path(levels[0], args.bench_rolls, args.seed, args.catalog_size),
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result, args.confidence)
+
+    failed = False
+    outside = [f"{level['level']}/{rarity}" for level in result["levels"]
+               for rarity, r in level["rarities"].items() if not r["within_ci"]]
+    if outside:
+        print(f"Frequencies outside the confidence interval: {', '.join(outside)}", file=sys.stderr)
+        failed = True
+    if args.min_rolls_per_second and result["roll_path"]["rolls_per_second"] < args.min_rolls_per_second:
+        print(f"Roll path below {args.min_rolls_per_second:,.0f} rolls/s", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""Estrazione dei roll: probabilita' delle rarita' per livello, tabelle alias e snapshot immutabile del catalogo.
+
+Non dipende da Flask ne' dal database, cosi' roll_simulator.py lo importa senza caricare app.py (configurazione,
+connessione al database, pool delle immagini). app.py costruisce i CatalogSnapshot a partire dalla tabella memes.
+"""
+import hashlib
+import json
+import random
+
+# Probabilita' (in percentuale) di ogni rarita' per livello di roll
+RARITIES = ("common", "rare", "legendary")
+LEVEL_PROBABILITIES = {
+    "standard": {"common": 70, "rare": 25, "legendary": 5},
+    "medium": {"common": 50, "rare": 25, "legendary": 25},
+    "premium": {"common": 30, "rare": 40, "legendary": 30},
+}
+
+class AliasSampler:
+    """Estrazione pesata in O(1) con il metodo alias di Vose: la tabella si costruisce una volta in O(n),
+    poi ogni estrazione usa un indice casuale e un confronto."""
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1
+            (small if scaled[l] < 1 else large).append(l)
+        # quelli rimasti hanno probabilita' 1 (a meno di errori di arrotondamento)
+
+    def sample(self, rng=random):
+        i = rng.randrange(len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+LEVEL_SAMPLERS = {level: AliasSampler([p[r] for r in RARITIES]) for level, p in LEVEL_PROBABILITIES.items()}
+
+class CatalogSnapshot:
+    """Stato immutabile del catalogo a una certa versione: bucket per rarita', indice per nome e
+    lista completa gia' serializzata in JSON con il suo ETag."""
+    def __init__(self, version, gachas):
+        self.version = version
+        self.gachas = gachas
+        self.buckets = {}
+        for gacha in gachas:
+            self.buckets.setdefault(gacha["rarity"], []).append(gacha)
+        self.by_name = {gacha["gacha_name"]: gacha for gacha in gachas}
+        self.body = json.dumps(gachas).encode('utf-8')
+        self.etag = f"v{version}-{hashlib.sha256(self.body).hexdigest()[:16]}"
+
+    def roll(self, level, rng=random):
+        """Estrae la rarita' con le probabilita' del livello e poi un gacha uniforme nel suo bucket. None se il bucket e' vuoto."""
+        rarity = RARITIES[LEVEL_SAMPLERS[level].sample(rng)]
+        bucket = self.buckets.get(rarity)
+        return rng.choice(bucket) if bucket else None
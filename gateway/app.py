@@ -4,6 +4,8 @@ from flask import Flask, request, make_response, jsonify, send_file
 from requests.exceptions import ConnectionError, HTTPError
 from werkzeug.exceptions import NotFound
 from io import BytesIO
+from urllib.parse import urlencode
+from image_proxy import serve_image
 
 # from flask import Flask
 # from flask_cors import CORS
@@ -33,11 +35,12 @@ from io import BytesIO
 
 
 
-ALLOWED_GACHA_SYS_OP ={'add_gacha', 'delete_gacha', 'update_gacha', 'get_gacha_collection'}
+ALLOWED_GACHA_SYS_OP ={'add_gacha', 'delete_gacha', 'update_gacha', 'get_gacha_collection', 'list_gachas'}
 ADD_URL = 'https://gachasystem:5004/add_gacha'
 DELETE_GACHA_URL = 'https://gachasystem:5004/delete_gacha'
 UPDATE_GACHA_URL = 'https://gachasystem:5004/update_gacha'
 GET_GACHA_COLL_URL = 'https://gachasystem:5004/get_gacha_collection'
+LIST_GACHAS_URL = 'https://gachasystem:5004/list_gachas'
 GACHA_IMAGE_URL = 'https://gachasystem:5004/uploads/'
 
 ALLOWED_AUTH_OP ={'signup', 'login', 'logout', 'delete', 'newToken'}
@@ -140,19 +143,6 @@ profile_circuit_breaker = CircuitBreaker()
 payment_circuit_breaker = CircuitBreaker()
 
 
-# Per gestione immagini
-def get_mime_type(extension):
-    mime_types = {
-        'jpg': 'image/jpeg',
-        'jpeg': 'image/jpeg',
-        'png': 'image/png',
-        'gif': 'image/gif',
-        'bmp': 'image/bmp',
-        'webp': 'image/webp',
-    }
-    return mime_types.get(extension.lower(), 'application/octet-stream')  # Tipo predefinito se non trovato
-
-
 app = Flask(__name__, instance_relative_config=True)
 
 def create_app():
@@ -384,6 +374,8 @@ def gacha_roll(op):
         'username': username,
         'level': level
     }
+    if data.get('count') is not None:
+        params['count'] = data.get('count')  # multi-roll
     jwt_token = request.headers.get('Authorization')
     headers = {
         'Authorization' : jwt_token
@@ -398,38 +390,14 @@ def gacha_roll(op):
 @app.route('/images_gacha/uploads/<name>', methods=['GET'])
 # ENTRAMBI
 def gacha_image(name):
-    url = GACHA_IMAGE_URL + name
-    file_extension = os.path.splitext(name)[1][1:]
-    mime_type = get_mime_type(file_extension)
-    jwt_token = request.headers.get('Authorization')
-    headers = {
-        'Authorization' : jwt_token
-    }
-    content, status = gacha_sys_circuit_breaker.call('get', url, {}, headers, {}, False)
-    if status == 200:
-        file = BytesIO(content)
-        return send_file(file, mimetype=mime_type)
-    else:
-        return jsonify({'Error' : f'Error during gacha image op '}), status
+    return serve_image(gacha_sys_circuit_breaker, GACHA_IMAGE_URL, name, 'gacha image')
 
 
 
 @app.route('/images_profile/uploads/<name>', methods=['GET'])
 # SOLO USER
 def profile_image(name):
-    url = PROFILE_IMAGE_URL + name
-    file_extension = os.path.splitext(name)[1][1:]
-    mime_type = get_mime_type(file_extension)
-    jwt_token = request.headers.get('Authorization')
-    headers = {
-        'Authorization' : jwt_token
-    }
-    content, status = profile_circuit_breaker.call('get', url, {}, headers, {}, False)
-    if status == 200:
-        file = BytesIO(content)
-        return send_file(file, mimetype=mime_type)
-    else:
-        return jsonify({'Error' : f'Error during profile image op '}), status
+    return serve_image(profile_circuit_breaker, PROFILE_IMAGE_URL, name, 'profile image')
     
 @app.route('/payment_service/buycurrency', methods=['POST'])
 # SOLO USER
@@ -467,6 +435,13 @@ def viewTrans():
         'Authorization' : jwt_token
     }
     url = VIEWTRANS_URL+ f'?username={username}'
+    # Paginazione opzionale dello storico
+    page_size = request.args.get('page_size')
+    cursor = request.args.get('cursor')
+    if page_size:
+        url += f'&page_size={page_size}'
+    if cursor:
+        url += f'&cursor={cursor}'
     response, status = payment_circuit_breaker.call('get', url, {}, headers, {}, False)
     if status != 200:
         return jsonify({'Error' : f'Error in getting the transactions history {response}'}), status
@@ -497,5 +472,17 @@ def gachasystem(op):
         if status != 200:
             return jsonify({'Error' : f'Error during get gacha collection op {response}'}), status
         return jsonify(response), status
+    # ENTRAMBI
+    elif op == 'list_gachas':
+        # filtri, ordinamento e cursore passano in query string
+        jwt_token = request.headers.get('Authorization')
+        headers = {
+            'Authorization' : jwt_token
+        }
+        url = f'{LIST_GACHAS_URL}?{urlencode(request.args)}'
+        response, status = gacha_sys_circuit_breaker.call('get', url, {}, headers, {}, False)
+        if status != 200:
+            return jsonify({'Error' : f'Error during list gachas op {response}'}), status
+        return jsonify(response), status
     else:
         return jsonify({'Error' : 'Invalid operation for gacha system'}), 500
\ No newline at end of file
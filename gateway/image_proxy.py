@@ -0,0 +1,104 @@
+"""Immagini servite dai gateway: inoltro della richiesta (con la variante ?size/?format) al servizio che le
+conserva, cache LRU in memoria delle immagini salvate per hash e risposte 304 ai client che hanno gia' l'ETag.
+
+Modulo condiviso tra gateway e admin_gateway. La copia di riferimento e' gateway/image_proxy.py;
+admin_gateway/image_proxy.py e' una copia vendored, identica byte per byte, perche' ogni gateway viene costruito
+con la propria cartella come contesto Docker. Si modifica solo la copia di riferimento e poi la si ricopia:
+    cp gateway/image_proxy.py admin_gateway/
+    cmp gateway/image_proxy.py admin_gateway/image_proxy.py
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from urllib.parse import urlencode
+
+from flask import Response, jsonify, request, send_file
+
+def get_mime_type(extension):
+    mime_types = {
+        'jpg': 'image/jpeg',
+        'jpeg': 'image/jpeg',
+        'png': 'image/png',
+        'gif': 'image/gif',
+        'bmp': 'image/bmp',
+        'webp': 'image/webp',
+    }
+    return mime_types.get(extension.lower(), 'application/octet-stream')  # Tipo predefinito se non trovato
+
+# Inoltra al servizio i parametri della variante richiesta (?size=thumb|small|medium, ?format=webp)
+def image_variant_request(base_url, name):
+    params = {key: request.args[key] for key in ('size', 'format') if request.args.get(key)}
+    url = base_url + name + (f'?{urlencode(params)}' if params else '')
+    mime_type = get_mime_type(params.get('format') or os.path.splitext(name)[1][1:])
+    return url, mime_type
+
+# Immagini salvate con l'hash del contenuto come nome: non cambiano mai, quindi il gateway le tiene
+# in una cache LRU in memoria (limitata in byte) e risponde 304 ai client che hanno gia' l'ETag
+CONTENT_ADDRESSED_NAME = re.compile(r"[0-9a-f]{64}\.[a-z]+")
+IMMUTABLE_MAX_AGE = 31536000  # un anno
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+class ImageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            content = self.items.get(key)
+            if content is not None:
+                self.items.move_to_end(key)
+            return content
+
+    def put(self, key, content):
+        if len(content) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                return
+            self.items[key] = content
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+
+image_cache = ImageCache(IMAGE_CACHE_MAX_BYTES)
+
+def image_etag(name):
+    """Stesso ETag calcolato dal servizio: l'hash per l'originale, il nome della variante altrimenti."""
+    size, fmt = request.args.get('size'), request.args.get('format')
+    if not (size or fmt):
+        return name.split('.', 1)[0]
+    return f"{name}.{size or 'full'}.{fmt or name.rsplit('.', 1)[1]}"
+
+def serve_image(circuit_breaker, base_url, name, op_name):
+    url, mime_type = image_variant_request(base_url, name)
+    immutable = CONTENT_ADDRESSED_NAME.fullmatch(name)
+    if immutable:
+        etag = image_etag(name)
+        cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': cache_control})
+        content = image_cache.get(url)
+        if content is not None:
+            response = send_file(BytesIO(content), mimetype=mime_type, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+            response.headers['Cache-Control'] = cache_control
+            return response
+    jwt_token = request.headers.get('Authorization')
+    headers = {
+        'Authorization' : jwt_token
+    }
+    content, status = circuit_breaker.call('get', url, {}, headers, {}, False)
+    if status != 200:
+        return jsonify({'Error' : f'Error during {op_name} op '}), status
+    if not immutable:
+        file = BytesIO(content)
+        return send_file(file, mimetype=mime_type)
+    image_cache.put(url, content)
+    response = send_file(BytesIO(content), mimetype=mime_type, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    response.headers['Cache-Control'] = cache_control
+    return response
@@ -1,7 +1,9 @@
 import os
-from flask import Flask,request, jsonify
+from flask import Flask,request, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import update, select, union_all, literal, tuple_
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError
+from sqlalchemy.dialects.postgresql import insert
 #from flask_bcrypt import Bcrypt
 #from flask_jwt_extended import JWTManager, create_access_token, jwt_required
 import datetime
@@ -9,6 +11,18 @@ import time
 import jwt  # PyJWT
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
 import re
+import json
+import hashlib
+import itertools
+import base64
+import gzip
+import csv
+import io
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from decimal import Decimal, InvalidOperation
+from apscheduler.schedulers.background import BackgroundScheduler
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://user:password@db_payment:5432/trans_db'
@@ -20,6 +34,52 @@ db = SQLAlchemy(app)
 #jwt = JWTManager(app)
 public_key_path = os.getenv("PUBLIC_KEY_PATH")
 
+# Chiavi di idempotenza per /pay e /buycurrency: scadono dopo IDEMPOTENCY_TTL_HOURS
+# e ne vengono conservate al massimo IDEMPOTENCY_MAX_KEYS
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+IDEMPOTENCY_PURGE_EVERY = 500  # la pulizia gira una volta ogni N chiavi registrate
+idempotency_counter = itertools.count(1)
+
+# Partizionamento mensile del ledger: partizioni create in anticipo e archiviazione di quelle vecchie
+LEDGER_PARTITIONS_AHEAD = int(os.getenv("LEDGER_PARTITIONS_AHEAD", "3"))      # mesi futuri gia' creati
+LEDGER_RETENTION_MONTHS = int(os.getenv("LEDGER_RETENTION_MONTHS", "12"))     # mesi tenuti nel database
+LEDGER_ARCHIVE_FOLDER = os.getenv("LEDGER_ARCHIVE_FOLDER", "/app/archive")
+LEDGER_MAINTENANCE_LOCK = 310031  # chiave dell'advisory lock, un solo worker alla volta esegue il job
+# Group commit di /pay (opzionale): le richieste che arrivano entro PAY_GROUP_COMMIT_WINDOW_MS
+# vengono eseguite in un'unica transazione, al massimo PAY_GROUP_COMMIT_MAX_BATCH alla volta
+PAY_GROUP_COMMIT = os.getenv("PAY_GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+PAY_GROUP_COMMIT_WINDOW_MS = float(os.getenv("PAY_GROUP_COMMIT_WINDOW_MS", "5"))
+PAY_GROUP_COMMIT_MAX_BATCH = int(os.getenv("PAY_GROUP_COMMIT_MAX_BATCH", "100"))
+PAY_GROUP_COMMIT_TIMEOUT = float(os.getenv("PAY_GROUP_COMMIT_TIMEOUT_SECONDS", "10"))
+# Finestre (in giorni) provate in ordine dallo storico paginato prima di leggere tutte le partizioni
+HISTORY_WINDOWS_DAYS = (31, 366)
+
+# Gli importi sono salvati come interi in unita' minori (centesimi) per evitare gli errori di arrotondamento
+# dei float; le API continuano ad accettare e restituire importi in Memecoins.
+MINOR_UNITS = 100
+
+def to_minor_units(value):
+    """Converte un importo (int, float o stringa) in centesimi. None se non e' un numero o ha piu' di due decimali."""
+    if isinstance(value, bool):
+        return None
+    try:
+        minor = Decimal(str(value).strip()) * MINOR_UNITS
+    except (InvalidOperation, ValueError):
+        return None
+    if not minor.is_finite() or minor != minor.to_integral_value():
+        return None
+    return int(minor)
+
+def from_minor_units(minor):
+    """Importo in Memecoins da restituire nelle risposte JSON."""
+    return None if minor is None else minor / MINOR_UNITS
+
+def format_amount(minor):
+    """Importo in centesimi come stringa con due decimali, senza passare dai float."""
+    sign = '-' if minor < 0 else ''
+    return f"{sign}{abs(minor) // MINOR_UNITS}.{abs(minor) % MINOR_UNITS:02d}"
+
 def sanitize_input(input_string):
     """Permette solo caratteri alfanumerici, trattini bassi, spazi e trattini."""
     if not input_string:
@@ -30,81 +90,566 @@ def sanitize_input(input_string):
 # Transaction Model
 class Transaction(db.Model):
     __tablename__ = 'transactions'
-    id = db.Column(db.Integer, primary_key=True)
+    # con date nella primary key SQLAlchemy non considera piu' id autoincrement: va dichiarato (SERIAL in init.sql)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     payer_us = db.Column(db.String(50), nullable=False)
     receiver_us = db.Column(db.String(50), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(db.BigInteger, nullable=False)  # in centesimi (unita' minori), vedi to_minor_units
     currency = db.Column(db.String(50), nullable=False)
-    date = db.Column(db.DateTime, nullable=False)
+    date = db.Column(db.DateTime, primary_key=True)  # chiave di partizionamento, fa parte della primary key
+    category = db.Column(db.String(20))  # motivo del pagamento indicato dal chiamante (es. 'gacharoll'), opzionale
+    quantity = db.Column(db.Integer)     # unita' acquistate con il pagamento (es. roll di un multi-roll), NULL = 1
+
+    # Indici per lo storico paginato per data (vedi transaction_history)
+    __table_args__ = (
+        db.Index('idx_transactions_payer_date', 'payer_us', 'date', 'id'),
+        db.Index('idx_transactions_receiver_date', 'receiver_us', 'date', 'id'),
+    )
 
 
 class Balance(db.Model):
     __tablename__ = 'balance'
     username = db.Column(db.String(50), primary_key=True)
-    balance = db.Column(db.Float, nullable=False)
+    balance = db.Column(db.BigInteger, nullable=False)  # in centesimi (unita' minori)
 
 
-from datetime import datetime
+# Rollup per utente (totali) e per utente e giorno, aggiornati in modo incrementale da /pay e /buycurrency
+# (vedi add_to_rollups) e ricostruibili dal ledger con backfill_rollups. Importi in centesimi.
+ROLLUP_COLUMNS = ('spent', 'earned', 'purchased', 'euro_spent', 'rolls')
+ROLL_CATEGORY = 'gacharoll'  # i pagamenti con questa categoria contano come roll
+ROLL_REFUND_CATEGORY = 'gacharoll_refund'  # rimborsi di gacharoll: annullano spesa e roll invece di contare come entrata
 
-@app.route('/pay', methods=['POST'])
-def pay():
+class UserRollup(db.Model):
+    __tablename__ = 'user_rollups'
+    username = db.Column(db.String(50), primary_key=True)
+    spent = db.Column(db.BigInteger, nullable=False, default=0)       # Memecoins pagati
+    earned = db.Column(db.BigInteger, nullable=False, default=0)      # Memecoins ricevuti da altri pagamenti
+    purchased = db.Column(db.BigInteger, nullable=False, default=0)   # Memecoins comprati con /buycurrency
+    euro_spent = db.Column(db.BigInteger, nullable=False, default=0)  # Euro spesi con /buycurrency
+    rolls = db.Column(db.BigInteger, nullable=False, default=0)
 
-    payer_us = sanitize_input(request.form.get('payer_us'))
-    receiver_us = sanitize_input(request.form.get('receiver_us'))
-    amount = request.form.get('amount')
-    if not amount:
-        return jsonify({'Error': 'Invalid amount'}), 400
-    if not payer_us:
-        return jsonify({'Error': 'Invalid payer_us'}), 400
-    if not receiver_us:
-        return jsonify({'Error': 'Invalid receiver_us'}), 400
-   
-    # Conversion from string to float
-    try:
-        amount = float(amount)
-    except ValueError:
-        return jsonify({'Error': 'Invalid amount'}), 400
+class DailyRollup(db.Model):
+    __tablename__ = 'daily_rollups'
+    username = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    spent = db.Column(db.BigInteger, nullable=False, default=0)
+    earned = db.Column(db.BigInteger, nullable=False, default=0)
+    purchased = db.Column(db.BigInteger, nullable=False, default=0)
+    euro_spent = db.Column(db.BigInteger, nullable=False, default=0)
+    rolls = db.Column(db.BigInteger, nullable=False, default=0)
 
-    if amount<0:
-        return jsonify({'Error': 'Invalid amount'}), 400
-    
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    key = db.Column(db.String(100), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)  # hash di endpoint e parametri della richiesta
+    status_code = db.Column(db.Integer, nullable=False)     # 0 finche' la richiesta non e' terminata
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+from datetime import datetime, timedelta
+
+def request_fingerprint(endpoint, *params):
+    return hashlib.sha256(json.dumps([endpoint, *params]).encode('utf-8')).hexdigest()
+
+def claim_idempotency_key(key, fingerprint):
+    """Registra la chiave nella transazione corrente. False se esiste gia' (non scaduta): la richiesta e' un replay.
+
+    Una richiesta concorrente con la stessa chiave resta bloccata sull'indice finche' la prima non termina,
+    quindi l'operazione viene eseguita al massimo una volta.
+    """
+    now = datetime.now()
+    table = IdempotencyKey.__table__
+    stmt = insert(table).values(key=key, fingerprint=fingerprint, status_code=0, response='', created_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['key'],
+        set_={'fingerprint': stmt.excluded.fingerprint, 'status_code': 0, 'response': '', 'created_at': now},
+        where=table.c.created_at < now - timedelta(hours=IDEMPOTENCY_TTL_HOURS)  # una chiave scaduta viene riutilizzata
+    ).returning(table.c.key)
+    claimed = db.session.execute(stmt).scalar() is not None
+    if claimed and next(idempotency_counter) % IDEMPOTENCY_PURGE_EVERY == 0:
+        purge_idempotency_keys()
+    return claimed
+
+def store_idempotent_result(key, body, status):
+    """Salva il risultato della richiesta, viene reso persistente dallo stesso commit dell'operazione."""
+    stmt = update(IdempotencyKey.__table__).where(IdempotencyKey.__table__.c.key == key) \
+        .values(status_code=status, response=json.dumps(body))
+    db.session.execute(stmt)
+
+def replay_idempotent_result(key, fingerprint):
+    record = IdempotencyKey.query.get(key)
+    if not record or record.status_code == 0:
+        return jsonify({'Error': 'A request with this Idempotency-Key is still in progress, retry later'}), 409
+    if record.fingerprint != fingerprint:
+        return jsonify({'Error': 'Idempotency-Key already used with different parameters'}), 422
+    response = app.response_class(record.response, status=record.status_code, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def purge_idempotency_keys():
+    """Elimina le chiavi scadute e, oltre IDEMPOTENCY_MAX_KEYS, quelle piu' vecchie."""
+    table = IdempotencyKey.__table__
+    cutoff = datetime.now() - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    db.session.execute(table.delete().where(table.c.created_at < cutoff))
+    oldest_kept = select(table.c.created_at).order_by(table.c.created_at.desc()) \
+        .offset(IDEMPOTENCY_MAX_KEYS - 1).limit(1).scalar_subquery()
+    db.session.execute(table.delete().where(table.c.created_at < oldest_kept))
+
+def get_idempotency_key():
+    """Legge l'header Idempotency-Key. Restituisce (chiave, errore)."""
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return None, None
+    if not re.fullmatch(r"[\w\-]{1,100}", key):
+        return None, 'Invalid Idempotency-Key'
+    return key, None
+
+# Aggiornamenti atomici dei bilanci: un solo UPDATE ... RETURNING per lato, senza leggere prima la riga
+def debit_balance(username, amount):
+    """Scala amount solo se il bilancio e' sufficiente. Restituisce il nuovo bilancio, None se non e' stato scalato."""
+    stmt = update(Balance.__table__) \
+        .where(Balance.__table__.c.username == username, Balance.__table__.c.balance >= amount) \
+        .values(balance=Balance.__table__.c.balance - amount) \
+        .returning(Balance.__table__.c.balance)
+    return db.session.execute(stmt).scalar()
+
+def credit_balance(username, amount):
+    """Aggiunge amount al bilancio. Restituisce il nuovo bilancio, None se l'utente non esiste."""
+    stmt = update(Balance.__table__) \
+        .where(Balance.__table__.c.username == username) \
+        .values(balance=Balance.__table__.c.balance + amount) \
+        .returning(Balance.__table__.c.balance)
+    return db.session.execute(stmt).scalar()
+
+def add_to_rollups(username, day, **deltas):
+    """Somma deltas (colonne di ROLLUP_COLUMNS) ai rollup totali e giornalieri di username, con un upsert per tabella.
+
+    Va chiamata dopo aver aggiornato il bilancio di username: il lock sulla riga di balance serializza gia'
+    gli aggiornamenti concorrenti dello stesso utente.
+    """
+    if username == 'system':
+        return
+    values = {column: deltas.get(column, 0) for column in ROLLUP_COLUMNS}
+    for table, keys in ((UserRollup.__table__, {'username': username}),
+                        (DailyRollup.__table__, {'username': username, 'day': day})):
+        stmt = insert(table).values(**keys, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + stmt.excluded[column] for column in ROLLUP_COLUMNS}
+        )
+        db.session.execute(stmt)
+
+def apply_transfer(payer_us, receiver_us, amount, category=None, quantity=None):
+    """Sposta amount da payer_us a receiver_us nella transazione corrente, senza fare commit.
+
+    Restituisce (payer_balance, receiver_balance, None) se va a buon fine, altrimenti
+    (None, None, (body, status)) con l'errore da restituire; in caso di errore il chiamante deve fare rollback.
+    Le righe vengono bloccate sempre in ordine di username, cosi' due pagamenti incrociati non vanno in deadlock.
+    """
+    payer_balance = receiver_balance = None
+    sides = []
     if payer_us != 'system':
-        payer_balance = Balance.query.filter_by(username=payer_us).first()
-        if not payer_balance:
-            return jsonify({'Error': f'Payer user "{payer_us}" not found'}), 404
+        sides.append((payer_us, 'payer'))
     if receiver_us != 'system':
-        receiver_balance = Balance.query.filter_by(username=receiver_us).first()
-        if not receiver_balance:
-            return jsonify({'Error': f'Receiver user "{receiver_us}" not found'}), 404
+        sides.append((receiver_us, 'receiver'))
+    for username, side in sorted(sides):
+        if side == 'payer':
+            payer_balance = debit_balance(payer_us, amount)
+            if payer_balance is None:
+                if db.session.query(Balance.username).filter_by(username=payer_us).first() is None:
+                    return None, None, ({'Error': f'Payer user "{payer_us}" not found'}, 404)
+                return None, None, ({'Error': 'Balance not sufficient to carry out the operation'}, 422)
+        else:
+            receiver_balance = credit_balance(receiver_us, amount)
+            if receiver_balance is None:
+                return None, None, ({'Error': f'Receiver user "{receiver_us}" not found'}, 404)
 
-
-    # Controlla che il saldo del pagatore sia sufficiente
-    if payer_us!= 'system' and payer_balance.balance < amount:
-        return jsonify({'Error': 'Balance not sufficient to carry out the operation'}), 422
-    # Inserisci una nuova transazione nel database
-    new_transaction = Transaction(
+    now = datetime.now()
+    db.session.add(Transaction(
         payer_us=payer_us,
         receiver_us=receiver_us,
         amount=amount,
         currency='Memecoins',
-        date=datetime.now()
-    )
-    db.session.add(new_transaction)
+        date=now,
+        category=category,
+        quantity=quantity
+    ))
+    add_to_rollups(payer_us, now.date(), spent=amount, rolls=(quantity or 1) if category == ROLL_CATEGORY else 0)
+    if category == ROLL_REFUND_CATEGORY:
+        # roll non consegnato: si tolgono spesa e roll del pagamento originale (quantity = roll rimborsati)
+        add_to_rollups(receiver_us, now.date(), spent=-amount, rolls=-(quantity or 1))
+    else:
+        add_to_rollups(receiver_us, now.date(), earned=amount)
+    return payer_balance, receiver_balance, None
+
+def validate_transfer(payer_us, receiver_us, amount):
+    """Valida i parametri di un trasferimento. Restituisce (payer_us, receiver_us, amount, errore)."""
+    payer_us = sanitize_input(payer_us) if isinstance(payer_us, str) else None
+    receiver_us = sanitize_input(receiver_us) if isinstance(receiver_us, str) else None
+    if not amount:
+        return None, None, None, 'Invalid amount'
+    if not payer_us:
+        return None, None, None, 'Invalid payer_us'
+    if not receiver_us:
+        return None, None, None, 'Invalid receiver_us'
+
+    # Conversione in centesimi interi
+    amount = to_minor_units(amount)
+    if amount is None or amount<0:
+        return None, None, None, 'Invalid amount'
+    return payer_us, receiver_us, amount, None
+
+def validate_category(category):
+    """Categoria opzionale di un pagamento. Restituisce (categoria, errore)."""
+    if category is None or category == '':
+        return None, None
+    if not isinstance(category, str) or not re.fullmatch(r"[a-z_]{1,20}", category):
+        return None, 'Invalid category'
+    return category, None
 
-    # Scala i soldi dal saldo del pagatore e aggiungili a quello del ricevente
-    if payer_us != "system":
-        payer_balance.balance -= amount
-    if receiver_us != "system":
-        receiver_balance.balance += amount
+PAY_MAX_QUANTITY = 1000
 
+def validate_quantity(quantity):
+    """Quantita' opzionale di un pagamento. Restituisce (quantita', errore)."""
+    if quantity is None or quantity == '':
+        return None, None
     try:
+        quantity = int(quantity)
+    except (TypeError, ValueError):
+        return None, 'Invalid quantity'
+    if not 1 <= quantity <= PAY_MAX_QUANTITY:
+        return None, f'quantity must be between 1 and {PAY_MAX_QUANTITY}'
+    return quantity, None
+
+def backfill_rollups():
+    """Ricostruisce i rollup dal ledger ancora nel database, senza commit.
+
+    I rollup giornalieri dei mesi gia' archiviati (non piu' nel ledger) vengono mantenuti; i totali per utente
+    sono ricalcolati come somma dei giornalieri. Il lock esclusivo blocca gli aggiornamenti di /pay e /buycurrency
+    fino al commit, cosi' nessun pagamento viene contato due volte o perso.
+    """
+    db.session.execute(db.text("LOCK TABLE user_rollups, daily_rollups IN EXCLUSIVE MODE"))
+    first_day = db.session.execute(db.text("SELECT min(date)::date FROM transactions")).scalar()
+    if first_day is not None:
+        db.session.execute(db.text("DELETE FROM daily_rollups WHERE day >= :first_day"), {'first_day': first_day})
+        db.session.execute(db.text(
+            "INSERT INTO daily_rollups (username, day, spent, earned, purchased, euro_spent, rolls) "
+            "SELECT username, day, sum(spent), sum(earned), sum(purchased), sum(euro_spent), sum(rolls) FROM ("
+            "  SELECT payer_us AS username, date::date AS day,"
+            "    CASE WHEN currency = 'Memecoins' THEN amount ELSE 0 END AS spent, 0 AS earned, 0 AS purchased,"
+            "    CASE WHEN currency = 'Euro' THEN amount ELSE 0 END AS euro_spent,"
+            "    CASE WHEN category = :roll_category THEN coalesce(quantity, 1) ELSE 0 END AS rolls"
+            "  FROM transactions WHERE payer_us <> 'system'"
+            "  UNION ALL"
+            "  SELECT receiver_us, date::date,"
+            "    CASE WHEN category = :refund_category THEN -amount ELSE 0 END,"  # i rimborsi dei roll riducono la spesa
+            "    CASE WHEN currency = 'Memecoins' AND category IS DISTINCT FROM :refund_category THEN amount ELSE 0 END,"
+            "    CASE WHEN currency = 'Memecoin' THEN amount ELSE 0 END, 0,"  # 'Memecoin' = accredito di /buycurrency
+            "    CASE WHEN category = :refund_category THEN -coalesce(quantity, 1) ELSE 0 END"
+            "  FROM transactions WHERE receiver_us <> 'system'"
+            ") ledger GROUP BY username, day"
+        ), {'roll_category': ROLL_CATEGORY, 'refund_category': ROLL_REFUND_CATEGORY})
+    db.session.execute(db.text("DELETE FROM user_rollups"))
+    db.session.execute(db.text(
+        "INSERT INTO user_rollups (username, spent, earned, purchased, euro_spent, rolls) "
+        "SELECT username, sum(spent), sum(earned), sum(purchased), sum(euro_spent), sum(rolls) FROM daily_rollups GROUP BY username"
+    ))
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Ricostruisce user_rollups e daily_rollups dal ledger (flask backfill-rollups)."""
+    backfill_rollups()
+    db.session.commit()
+    print(f"Rollups rebuilt for {UserRollup.query.count()} users")
+
+def month_start(day, offset=0):
+    """Primo giorno del mese di `day` spostato di `offset` mesi."""
+    month = day.year * 12 + day.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+def ledger_partition_name(start):
+    return f"transactions_y{start.year:04d}m{start.month:02d}"
+
+def ensure_ledger_partitions(today=None):
+    """Crea le partizioni mensili dal mese corrente fino a LEDGER_PARTITIONS_AHEAD mesi in avanti."""
+    current = month_start(today or datetime.now())
+    created = []
+    for offset in range(LEDGER_PARTITIONS_AHEAD + 1):
+        start, end = month_start(current, offset), month_start(current, offset + 1)
+        name = ledger_partition_name(start)
+        exists = db.session.execute(db.text("SELECT to_regclass(:name)"), {'name': name}).scalar()
+        if not exists:
+            # Le righe del mese finite nella partizione di default vanno spostate prima dell'ATTACH,
+            # altrimenti Postgres rifiuta la nuova partizione
+            bounds = {'start': start, 'end': end}
+            db.session.execute(db.text(f"CREATE TABLE {name} (LIKE transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+            db.session.execute(db.text(
+                f"WITH moved AS (DELETE FROM transactions_default WHERE date >= :start AND date < :end RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ), bounds)
+            db.session.execute(db.text(
+                f"ALTER TABLE transactions ATTACH PARTITION {name} FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            created.append(name)
+    return created
+
+def archive_ledger_partitions(today=None):
+    """Esporta in CSV compresso le partizioni piu' vecchie di LEDGER_RETENTION_MONTHS e le elimina dal database."""
+    oldest_kept = month_start(today or datetime.now(), -LEDGER_RETENTION_MONTHS)
+    partitions = db.session.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'transactions' AND c.relname ~ '^transactions_y[0-9]{4}m[0-9]{2}$'"
+    )).scalars().all()
+    os.makedirs(LEDGER_ARCHIVE_FOLDER, exist_ok=True)
+    archived = []
+    for name in sorted(partitions):
+        start = datetime(int(name[14:18]), int(name[19:21]), 1)
+        if start >= oldest_kept:
+            continue
+        archive_path = os.path.join(LEDGER_ARCHIVE_FOLDER, f"{name}.csv.gz")
+        tmp_path = archive_path + ".tmp"
+        # COPY sulla stessa connessione della sessione, cosi' export e DROP stanno nella stessa transazione
+        cursor = db.session.connection().connection.cursor()
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as archive:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+        os.replace(tmp_path, archive_path)
+        db.session.execute(db.text(f"ALTER TABLE transactions DETACH PARTITION {name}"))
+        db.session.execute(db.text(f"DROP TABLE {name}"))
+        archived.append(archive_path)
+    return archived
+
+def maintain_ledger_partitions():
+    with app.app_context():
+        try:
+            # advisory lock di transazione: se un altro worker sta gia' facendo manutenzione si salta il giro
+            if not db.session.execute(db.text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': LEDGER_MAINTENANCE_LOCK}).scalar():
+                db.session.rollback()
+                return
+            created = ensure_ledger_partitions()
+            archived = archive_ledger_partitions()
+            db.session.commit()
+            if created or archived:
+                app.logger.info(f"Ledger maintenance: created {created}, archived {archived}")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Ledger maintenance failed: {e}")
+
+@app.cli.command('maintain-ledger')
+def maintain_ledger_command():
+    """Crea le partizioni future e archivia quelle vecchie (flask maintain-ledger)."""
+    maintain_ledger_partitions()
+
+# Configurazione dello Scheduler
+scheduler = BackgroundScheduler()
+scheduler.add_job(func=maintain_ledger_partitions, trigger="interval", hours=6, next_run_time=datetime.now())
+
+def json_response(body, status):
+    response = jsonify(body)
+    response.status_code = status
+    return response
+
+def execute_pay(payer_us, receiver_us, amount, category, quantity, idempotency_key, fingerprint):
+    """Esegue un pagamento nella transazione corrente, dentro un savepoint, senza fare commit.
+
+    Restituisce la risposta da inviare: se il pagamento fallisce viene annullato solo il suo savepoint,
+    quindi puo' essere eseguito insieme ad altri nella stessa transazione (group commit).
+    Gli errori del database (deadlock, serializzazione, connessione) vengono rilanciati: il chiamante annulla
+    l'intera transazione, e nel group commit le richieste del gruppo vengono rieseguite una per una.
+    """
+    savepoint = db.session.begin_nested()
+    try:
+        if idempotency_key and not claim_idempotency_key(idempotency_key, fingerprint):
+            savepoint.rollback()
+            return replay_idempotent_result(idempotency_key, fingerprint)
+        # Addebito e accredito condizionali: il controllo del saldo avviene nello stesso UPDATE,
+        # quindi richieste concorrenti non possono mandare in negativo un bilancio
+        transfer = db.session.begin_nested()
+        payer_balance, receiver_balance, error = apply_transfer(payer_us, receiver_us, amount, category, quantity)
+        if error:
+            transfer.rollback()
+            body, status = error
+            if not idempotency_key:
+                savepoint.rollback()
+                return json_response(body, status)
+        else:
+            transfer.commit()
+            body, status = {'msg': 'Payment successfully executed', 'payer_balance': from_minor_units(payer_balance),
+                            'receiver_balance': from_minor_units(receiver_balance)}, 200
+        # con una chiave anche gli errori vengono salvati, il trasferimento fallito e' gia' stato annullato
+        if idempotency_key:
+            store_idempotent_result(idempotency_key, body, status)
+        savepoint.commit()
+        return json_response(body, status)
+    except DBAPIError:
+        raise
+    except SQLAlchemyError as e:
+        savepoint.rollback()
+        return json_response({'Error': 'Transaction failed', 'details': str(e)}, 500)
+
+def execute_pay_and_commit(*args):
+    try:
+        response = execute_pay(*args)
         db.session.commit()
-        return jsonify({'msg': 'Payment successfully executed'}), 200
+        return response
     except SQLAlchemyError as e:
         db.session.rollback()
-        return jsonify({'Error': 'Transaction failed', 'details': str(e)}), 500
+        return json_response({'Error': 'Transaction failed', 'details': str(e)}, 500)
+
+class PayGroupCommitter:
+    """Raccoglie le richieste /pay arrivate entro una finestra di pochi millisecondi e le esegue
+    in un'unica transazione del database, cosi' il costo del commit e' condiviso dal gruppo.
+
+    Ogni richiesta gira nel proprio savepoint (execute_pay) e riceve il proprio risultato tramite un Future.
+    Se un pagamento o il commit del gruppo falliscono per un errore del database (es. deadlock con un altro worker)
+    il gruppo viene annullato e le richieste vengono rieseguite una per una, ognuna nella propria transazione.
+    """
+    def __init__(self, window_ms, max_batch):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='pay-group-commit', daemon=True)
+                self.thread.start()
+
+    def submit(self, *args):
+        future = Future()
+        self.requests.put((args, future))
+        return future
+
+    def next_batch(self):
+        batch = [self.requests.get()]  # attende la prima richiesta, poi raccoglie le altre fino alla scadenza della finestra
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            with app.app_context():
+                try:
+                    self.commit_batch(batch)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Group commit of {len(batch)} payments failed: {e}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_result(json_response({'Error': 'Transaction failed', 'details': str(e)}, 500))
+
+    def commit_batch(self, batch):
+        try:
+            responses = [execute_pay(*args) for args, _ in batch]
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.warning(f"Group commit of {len(batch)} payments failed, retrying one by one: {e}")
+            responses = [execute_pay_and_commit(*args) for args, _ in batch]
+        for (_, future), response in zip(batch, responses):
+            future.set_result(response)
+
+pay_committer = PayGroupCommitter(PAY_GROUP_COMMIT_WINDOW_MS, PAY_GROUP_COMMIT_MAX_BATCH)
+
+@app.before_first_request
+def start_scheduler():
+    if not scheduler.running:
+        scheduler.start()
+    if PAY_GROUP_COMMIT:
+        pay_committer.start()
+
+@app.route('/pay', methods=['POST'])
+def pay():
+
+    payer_us, receiver_us, amount, error = validate_transfer(request.form.get('payer_us'), request.form.get('receiver_us'), request.form.get('amount'))
+    if error:
+        return jsonify({'Error': error}), 400
+
+    category, error = validate_category(request.form.get('category'))
+    if error:
+        return jsonify({'Error': error}), 400
+    quantity, error = validate_quantity(request.form.get('quantity'))
+    if error:
+        return jsonify({'Error': error}), 400
+
+    idempotency_key, error = get_idempotency_key()
+    if error:
+        return jsonify({'Error': error}), 400
+    fingerprint = request_fingerprint('pay', payer_us, receiver_us, amount, category, quantity)
+
+    args = (payer_us, receiver_us, amount, category, quantity, idempotency_key, fingerprint)
+    if not PAY_GROUP_COMMIT:
+        return execute_pay_and_commit(*args)
+    try:
+        return pay_committer.submit(*args).result(timeout=PAY_GROUP_COMMIT_TIMEOUT)
+    except FutureTimeoutError:
+        # il pagamento potrebbe essere ancora eseguito: il client puo' riprovare in sicurezza solo con una Idempotency-Key
+        return jsonify({'Error': 'Payment not confirmed in time, retry with the same Idempotency-Key'}), 503
  
 
+PAY_BATCH_MAX_TRANSFERS = 1000
+
+# Applica una lista di trasferimenti in un'unica transazione del database.
+# Ogni trasferimento gira in un SAVEPOINT: se fallisce viene annullato solo lui e gli altri proseguono,
+# a meno che la richiesta non chieda "atomic": true (tutto o niente).
+@app.route('/pay_batch', methods=['POST'])
+def pay_batch():
+    data = request.get_json()
+    transfers = data.get('transfers') if data else None
+    if not isinstance(transfers, list) or not transfers:
+        return jsonify({'Error': 'Missing or empty transfers list'}), 400
+    if len(transfers) > PAY_BATCH_MAX_TRANSFERS:
+        return jsonify({'Error': f'Too many transfers, max {PAY_BATCH_MAX_TRANSFERS} per request'}), 400
+    atomic = bool(data.get('atomic', False))
+
+    results = []
+    failed = 0
+    try:
+        for index, item in enumerate(transfers):
+            if not isinstance(item, dict):
+                item = {}
+            payer_us, receiver_us, amount, error = validate_transfer(item.get('payer_us'), item.get('receiver_us'), item.get('amount'))
+            if not error:
+                category, error = validate_category(item.get('category'))
+            if not error:
+                quantity, error = validate_quantity(item.get('quantity'))
+            if error:
+                results.append({'index': index, 'status': 400, 'Error': error})
+                failed += 1
+                continue
+            savepoint = db.session.begin_nested()
+            payer_balance, receiver_balance, error = apply_transfer(payer_us, receiver_us, amount, category, quantity)
+            if error:
+                savepoint.rollback()
+                body, status = error
+                results.append(dict(body, index=index, status=status))
+                failed += 1
+            else:
+                savepoint.commit()
+                results.append({'index': index, 'status': 200, 'payer_us': payer_us, 'receiver_us': receiver_us,
+                                'amount': from_minor_units(amount), 'payer_balance': from_minor_units(payer_balance),
+                                'receiver_balance': from_minor_units(receiver_balance)})
+
+        if atomic and failed:
+            db.session.rollback()
+            return jsonify({'Error': 'Batch rolled back, at least one transfer failed', 'results': results}), 422
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({'Error': 'Transaction failed', 'details': str(e)}), 500
+    return jsonify({'msg': 'Batch payment executed', 'succeeded': len(transfers) - failed, 'failed': failed, 'results': results}), 200
+
 @app.route('/buycurrency', methods = ['POST'])
 def buycurrency():
     data = request.get_json()
@@ -142,41 +687,107 @@ def buycurrency():
     if not method:
         return jsonify({'Error': f'Invalid method {method}'}), 400
 
-    # Conversion from string to float
-    try:
-        amount = float(amount)
-    except ValueError:
+    # Conversione in centesimi interi
+    amount = to_minor_units(amount)
+    if amount is None or amount <= 0:
         return jsonify({'Error': 'Invalid amount'}), 400
     
-    #inserisci una transazione nel db 
-    paying_t = Transaction(
-            payer_us=username,
-            receiver_us='system',
-            amount=amount,
-            currency='Euro',
-            date=datetime.now()
-        )
-    db.session.add(paying_t)
-    receiving_t = Transaction(
-            payer_us='system',
-            receiver_us=username,
-            amount=amount,
-            currency='Memecoin',
-            date=datetime.now()
-        )
-    db.session.add(receiving_t)
+    idempotency_key, error = get_idempotency_key()
+    if error:
+        return jsonify({'Error': error}), 400
+    fingerprint = request_fingerprint('buycurrency', username, amount, method)
 
-    current_balance = Balance.query.filter_by(username=username).first()
-    if not current_balance:
-        return jsonify({'Error': f'Payer user {username} not found'}), 404
-    current_balance.balance +=amount
     try:
+        if idempotency_key and not claim_idempotency_key(idempotency_key, fingerprint):
+            db.session.rollback()
+            return replay_idempotent_result(idempotency_key, fingerprint)
+
+        new_balance = credit_balance(username, amount)
+        if new_balance is None:
+            body, status = {'Error': f'Payer user {username} not found'}, 404
+            if not idempotency_key:
+                db.session.rollback()
+                return jsonify(body), status
+        else:
+            #inserisci una transazione nel db 
+            now = datetime.now()
+            paying_t = Transaction(
+                    payer_us=username,
+                    receiver_us='system',
+                    amount=amount,
+                    currency='Euro',
+                    date=now
+                )
+            db.session.add(paying_t)
+            receiving_t = Transaction(
+                    payer_us='system',
+                    receiver_us=username,
+                    amount=amount,
+                    currency='Memecoin',
+                    date=now
+                )
+            db.session.add(receiving_t)
+            add_to_rollups(username, now.date(), purchased=amount, euro_spent=amount)
+            body, status = {'username': username,'balance':from_minor_units(new_balance),'msg': 'In-game currency purchased successfully'}, 200
+        if idempotency_key:
+            store_idempotent_result(idempotency_key, body, status)
         db.session.commit()
-        return jsonify({'username': username,'balance':current_balance.balance,'msg': 'In-game currency purchased successfully'}), 200
+        return jsonify(body), status
     except SQLAlchemyError as e:
         db.session.rollback()
         return jsonify({'Error': 'Internal server error or payment processing issue', 'details': str(e)}), 500
 
+VIEWTRANS_DEFAULT_PAGE_SIZE = 50
+VIEWTRANS_MAX_PAGE_SIZE = 500
+
+def history_statement(username, limit=None, before=None, since=None, until=None, ascending=False):
+    """Query dello storico di username (pagamenti e ricevute) ordinato per data, dal piu' recente salvo `ascending`.
+
+    Le due metà sono scansioni sugli indici (payer_us, date, id) e (receiver_us, date, id), ognuna gia'
+    limitata a `limit` righe, poi unite con UNION ALL: il costo di una pagina non dipende dalla lunghezza
+    dello storico. `before` e' la chiave (date, id, sign) dell'ultima riga della pagina precedente.
+    """
+    t = Transaction.__table__
+
+    def ordering(*columns):
+        return [c.asc() if ascending else c.desc() for c in columns]
+
+    def side(column, sign):
+        query = select(t.c.id, t.c.payer_us, t.c.receiver_us, t.c.amount, t.c.currency, t.c.date, literal(sign).label('sign')) \
+            .where(column == username)
+        if before:
+            query = query.where(tuple_(t.c.date, t.c.id, literal(sign)) < tuple_(*before))
+        if since:
+            # limiti costanti sulla data: il planner legge solo le partizioni dei mesi interessati
+            query = query.where(t.c.date >= since)
+        if until:
+            query = query.where(t.c.date < until)
+        query = query.order_by(*ordering(t.c.date, t.c.id))
+        return query.limit(limit) if limit else query
+
+    merged = union_all(side(t.c.payer_us, '-'), side(t.c.receiver_us, '+')).subquery()
+    stmt = select(merged).order_by(*ordering(merged.c.date, merged.c.id, merged.c.sign))
+    if limit:
+        stmt = stmt.limit(limit)
+    return stmt
+
+def transaction_history(username, limit=None, before=None, since=None):
+    return db.session.execute(history_statement(username, limit, before, since)).all()
+
+def encode_history_cursor(row):
+    raw = json.dumps([row.date.isoformat(), row.id, row.sign])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_history_cursor(cursor):
+    """Restituisce la chiave (date, id, sign) del cursore, None se non e' valido."""
+    try:
+        date, id, sign = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if sign not in ('-', '+') or not isinstance(id, int):
+            return None
+        return datetime.fromisoformat(date), id, sign
+    except (ValueError, TypeError):
+        return None
+
 @app.route('/viewTrans', methods = ['GET'])
 def viewTrans():  
     username = sanitize_input(request.args.get('username'))
@@ -202,17 +813,99 @@ def viewTrans():
     
     if not username:
         return jsonify({'Error' : 'Invalid parameter username'}), 400
-    # Search in the transaction db
-    payed_t = Transaction.query.filter_by(payer_us=username).all()
-    received_t = Transaction.query.filter_by(receiver_us=username).all()
-    transaction_list = []
-    if payed_t:
-        result = [{'id': t.id, 'payer_us': username, 'receiver_us': t.receiver_us,'amount' : f'-{t.amount}', 'currency':t.currency, 'date':t.date} for t in payed_t]   
-        transaction_list += result
-    if received_t:
-        result = [{'id': t.id, 'payer_us': t.payer_us, 'receiver_us': username,'amount' : f'+{t.amount}', 'currency':t.currency, 'date':t.date} for t in received_t]   
-        transaction_list += result
-    return jsonify(transaction_list), 200
+    page_size = request.args.get('page_size')
+    cursor = request.args.get('cursor')
+    # Senza page_size e cursor viene restituito tutto lo storico come lista (comportamento originale)
+    if page_size is None and cursor is None:
+        rows = transaction_history(username)
+        return jsonify([format_transaction(t) for t in rows]), 200
+
+    try:
+        page_size = int(page_size) if page_size is not None else VIEWTRANS_DEFAULT_PAGE_SIZE
+    except ValueError:
+        return jsonify({'Error': 'Invalid parameter page_size'}), 400
+    if not 1 <= page_size <= VIEWTRANS_MAX_PAGE_SIZE:
+        return jsonify({'Error': f'page_size must be between 1 and {VIEWTRANS_MAX_PAGE_SIZE}'}), 400
+    before = None
+    if cursor:
+        before = decode_history_cursor(cursor)
+        if not before:
+            return jsonify({'Error': 'Invalid parameter cursor'}), 400
+
+    # Una riga in piu' per sapere se esiste una pagina successiva.
+    # Si cerca prima nelle partizioni recenti e si allarga la finestra solo se la pagina non e' piena
+    upper = before[0] if before else datetime.now()
+    for days in HISTORY_WINDOWS_DAYS:
+        rows = transaction_history(username, page_size + 1, before, upper - timedelta(days=days))
+        if len(rows) > page_size:
+            break
+    else:
+        rows = transaction_history(username, page_size + 1, before)
+    next_cursor = encode_history_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return jsonify({'transactions': [format_transaction(t) for t in rows[:page_size]], 'next_cursor': next_cursor}), 200
+
+def format_transaction(t):
+    return {'id': t.id, 'payer_us': t.payer_us, 'receiver_us': t.receiver_us, 'amount' : f'{t.sign}{format_amount(t.amount)}', 'currency':t.currency, 'date':t.date}
+
+EXPORT_CHUNK_ROWS = 2000
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_CSV_FIELDS = ['id', 'payer_us', 'receiver_us', 'amount', 'currency', 'date']
+
+# Export dello storico completo in streaming: le righe arrivano da un cursore lato server a blocchi
+# di EXPORT_CHUNK_ROWS e vengono scritte subito nella risposta, la memoria usata non dipende dal numero di righe
+@app.route('/exportTrans', methods=['GET'])
+def exportTrans():
+    username = sanitize_input(request.args.get('username'))
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        decoded_token = jwt.decode(access_token, public_key, algorithms=["RS256"], audience="payment_service")
+        if decoded_token.get("scope") == "user" and username and decoded_token.get("sub") != username:
+            return jsonify({"error": "Username in token does not match the request username"}), 403
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    if not username:
+        return jsonify({'Error' : 'Invalid parameter username'}), 400
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'Error': 'Invalid parameter format, use ndjson or csv'}), 400
+    # Intervallo di date opzionale [from, to) in formato ISO
+    try:
+        since = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        until = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'Error': "Invalid 'from' or 'to' date. Use ISO format (e.g., 'YYYY-MM-DDTHH:MM:SS')"}), 400
+
+    stmt = history_statement(username, since=since, until=until, ascending=True)
+
+    def generate():
+        result = db.session.connection().execution_options(stream_results=True).execute(stmt)
+        if export_format == 'csv':
+            yield ','.join(EXPORT_CSV_FIELDS) + '\n'
+        for rows in result.partitions(EXPORT_CHUNK_ROWS):
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for t in rows:
+                    writer.writerow([t.id, t.payer_us, t.receiver_us, f'{t.sign}{format_amount(t.amount)}', t.currency, t.date.isoformat()])
+                yield buffer.getvalue()
+            else:
+                yield ''.join(json.dumps(dict(format_transaction(t), date=t.date.isoformat())) + '\n' for t in rows)
+        result.close()
+        db.session.rollback()  # chiude la transazione di sola lettura del cursore
+
+    headers = {'Content-Disposition': f'attachment; filename=transactions_{username}.{export_format}'}
+    return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[export_format], headers=headers)
 
 @app.route('/newBalance', methods=['POST'])
 def newBalance():
@@ -250,6 +943,29 @@ def newBalance():
     else:
         return jsonify({'Error': 'Username already inserted in balance db'}), 422
 
+# Creazione massiva dei bilanci, usata dal provisioning di auth_service
+@app.route('/newBalances', methods=['POST'])
+def newBalances():
+    data = request.get_json()
+    usernames = data.get('usernames') if data else None
+    if not isinstance(usernames, list) or not usernames:
+        return jsonify({"Error": "Missing or empty 'usernames' list"}), 400
+    usernames = [sanitize_input(u) for u in usernames if isinstance(u, str)]
+    if not all(usernames):
+        return jsonify({"Error": "Invalid parameter usernames"}), 400
+
+    stmt = insert(Balance.__table__).values([{'username': u, 'balance': 0} for u in usernames]) \
+        .on_conflict_do_nothing(index_elements=['username']).returning(Balance.username)
+    try:
+        created = [row[0] for row in db.session.execute(stmt)]
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({'Error': 'Committing error', 'details': str(e)}), 500
+    created_set = set(created)
+    skipped = [u for u in usernames if u not in created_set]
+    return jsonify({'msg': f'Corretcly created {len(created)} balances', 'created': created, 'skipped': skipped}), 200
+
 @app.route('/getBalance', methods=['GET'])
 def getBalance():
     username = sanitize_input(request.args.get('username'))
@@ -277,10 +993,63 @@ def getBalance():
         return jsonify({'Error' : 'Invalid parameter username'}), 400
     res = Balance.query.filter_by(username=username).first()
     if res: 
-        return jsonify({'username': res.username, 'balance': res.balance}), 200
+        return jsonify({'username': res.username, 'balance': from_minor_units(res.balance)}), 200
     else:
         return jsonify({'Error': 'Not found balance for that user'}), 404
-    
+
+ROLLUPS_MAX_DAYS = 366
+
+def format_rollup(row):
+    result = {column: from_minor_units(getattr(row, column)) for column in ROLLUP_COLUMNS if column != 'rolls'}
+    result['rolls'] = row.rolls
+    return result
+
+# Totali di spesa, guadagno e roll per utente letti dai rollup: una lettura per chiave primaria,
+# senza scorrere lo storico. Con from/to (YYYY-MM-DD) vengono restituiti anche i rollup giornalieri.
+@app.route('/userRollups', methods=['GET'])
+def userRollups():
+    username = sanitize_input(request.args.get('username'))
+    # Recupera l'header Authorization
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    # Verifica e decodifica del token
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        decoded_token = jwt.decode(access_token, public_key, algorithms=["RS256"], audience="payment_service")
+        if decoded_token.get("scope") == "user" and username and decoded_token.get("sub") != username:
+            return jsonify({"error": "Username in token does not match the request username"}), 403
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    if not username:
+        return jsonify({'Error' : 'Invalid parameter username'}), 400
+    try:
+        first_day = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+        last_day = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'Error': 'Invalid date, use YYYY-MM-DD'}), 400
+    if (first_day or last_day) and not (first_day and last_day):
+        return jsonify({'Error': 'Both from and to are required for the daily rollups'}), 400
+    if first_day and not timedelta(0) <= last_day - first_day < timedelta(days=ROLLUPS_MAX_DAYS):
+        return jsonify({'Error': f'Invalid date range, max {ROLLUPS_MAX_DAYS} days'}), 400
+
+    totals = UserRollup.query.get(username)
+    result = {'username': username,
+              'totals': format_rollup(totals) if totals else {column: 0 for column in ROLLUP_COLUMNS}}
+    if first_day:
+        days = DailyRollup.query.filter(DailyRollup.username == username, DailyRollup.day.between(first_day, last_day)) \
+            .order_by(DailyRollup.day).all()
+        result['daily'] = [dict(format_rollup(d), day=d.day.isoformat()) for d in days]
+    return jsonify(result), 200
+
 @app.route('/deleteBalance', methods=['DELETE'])
 def deleteBalance():
     # Recupera l'header Authorization
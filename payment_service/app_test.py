@@ -1,6 +1,9 @@
 import os
-from flask import Flask,request, jsonify
-from datetime import datetime
+import csv
+import io
+import json
+from flask import Flask,request, jsonify, Response
+from datetime import datetime, timedelta
 import jwt  # PyJWT
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
 import re
@@ -104,6 +107,71 @@ def pay():
     if receiver_us != "system":
         receiver_balance['balance'] += amount
     return jsonify({'msg': 'Payment successfully executed'}), 200
+
+PAY_BATCH_MAX_TRANSFERS = 1000
+
+def mock_validate_transfer(payer_us, receiver_us, amount):
+    payer_us = sanitize_input(payer_us) if isinstance(payer_us, str) else None
+    receiver_us = sanitize_input(receiver_us) if isinstance(receiver_us, str) else None
+    if not amount:
+        return None, None, None, 'Invalid amount'
+    if not payer_us:
+        return None, None, None, 'Invalid payer_us'
+    if not receiver_us:
+        return None, None, None, 'Invalid receiver_us'
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        return None, None, None, 'Invalid amount'
+    if amount<0:
+        return None, None, None, 'Invalid amount'
+    return payer_us, receiver_us, amount, None
+
+@app.route('/pay_batch', methods=['POST'])
+def pay_batch():
+    data = request.get_json()
+    transfers = data.get('transfers') if data else None
+    if not isinstance(transfers, list) or not transfers:
+        return jsonify({'Error': 'Missing or empty transfers list'}), 400
+    if len(transfers) > PAY_BATCH_MAX_TRANSFERS:
+        return jsonify({'Error': f'Too many transfers, max {PAY_BATCH_MAX_TRANSFERS} per request'}), 400
+    atomic = bool(data.get('atomic', False))
+
+    # saldi toccati dal batch, cosi' i trasferimenti successivi vedono quelli precedenti
+    balances = {}
+    results = []
+    failed = 0
+    for index, item in enumerate(transfers):
+        if not isinstance(item, dict):
+            item = {}
+        payer_us, receiver_us, amount, error = mock_validate_transfer(item.get('payer_us'), item.get('receiver_us'), item.get('amount'))
+        if error:
+            results.append({'index': index, 'status': 400, 'Error': error})
+            failed += 1
+            continue
+        for username in (payer_us, receiver_us):
+            if username != 'system' and username not in balances:
+                balances[username] = mock_find_balance(username)
+        if payer_us != 'system' and not balances[payer_us]:
+            results.append({'index': index, 'status': 404, 'Error': f'Payer user "{payer_us}" not found'})
+        elif receiver_us != 'system' and not balances[receiver_us]:
+            results.append({'index': index, 'status': 404, 'Error': f'Receiver user "{receiver_us}" not found'})
+        elif payer_us != 'system' and balances[payer_us]['balance'] < amount:
+            results.append({'index': index, 'status': 422, 'Error': 'Balance not sufficient to carry out the operation'})
+        else:
+            if payer_us != 'system':
+                balances[payer_us]['balance'] -= amount
+            if receiver_us != 'system':
+                balances[receiver_us]['balance'] += amount
+            results.append({'index': index, 'status': 200, 'payer_us': payer_us, 'receiver_us': receiver_us, 'amount': amount,
+                            'payer_balance': balances[payer_us]['balance'] if payer_us != 'system' else None,
+                            'receiver_balance': balances[receiver_us]['balance'] if receiver_us != 'system' else None})
+            continue
+        failed += 1
+
+    if atomic and failed:
+        return jsonify({'Error': 'Batch rolled back, at least one transfer failed', 'results': results}), 422
+    return jsonify({'msg': 'Batch payment executed', 'succeeded': len(transfers) - failed, 'failed': failed, 'results': results}), 200
  
 @app.route('/buycurrency', methods = ['POST'])
 def buycurrency():
@@ -230,6 +298,62 @@ def viewTrans():
         transaction_list += result
     return jsonify(transaction_list), 200
 
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_CSV_FIELDS = ['id', 'payer_us', 'receiver_us', 'amount', 'currency', 'date']
+
+@app.route('/exportTrans', methods=['GET'])
+def exportTrans():
+    username = sanitize_input(request.args.get('username'))
+    # Recupera l'header Authorization
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    # Verifica e decodifica del token
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        decoded_token = mock_decode_jwt(access_token, public_key, algorithms=["RS256"], audience="payment_service")
+        if decoded_token.get("scope") == "user" and username and decoded_token.get("sub") != username:
+            return jsonify({"error": "Username in token does not match the request username"}), 403
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    if not username:
+        return jsonify({'Error' : 'Invalid parameter username'}), 400
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'Error': 'Invalid parameter format, use ndjson or csv'}), 400
+    try:
+        since = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        until = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'Error': "Invalid 'from' or 'to' date. Use ISO format (e.g., 'YYYY-MM-DDTHH:MM:SS')"}), 400
+
+    # le date del db finto non sono ISO: l'intervallo viene solo validato
+    rows = []
+    for t in mock_transactions_db:
+        if t['payer_us'] == username:
+            rows.append(dict(t, amount=f"-{t['amount']}"))
+        elif t['receiver_us'] == username:
+            rows.append(dict(t, amount=f"+{t['amount']}"))
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_CSV_FIELDS)
+        for t in rows:
+            writer.writerow([t[field] for field in EXPORT_CSV_FIELDS])
+        body = buffer.getvalue()
+    else:
+        body = ''.join(json.dumps(t) + '\n' for t in rows)
+    headers = {'Content-Disposition': f'attachment; filename=transactions_{username}.{export_format}'}
+    return Response(body, mimetype=EXPORT_FORMATS[export_format], headers=headers)
+
 def mock_newBalance(username, balance):
     return {'msg' : 'Balance created',
             'username' : username,
@@ -247,6 +371,22 @@ def newBalance():
     else:
         return jsonify({'Error': 'Username already inserted in balance db'}), 422
 
+@app.route('/newBalances', methods=['POST'])
+def newBalances():
+    data = request.get_json()
+    usernames = data.get('usernames') if data else None
+    if not isinstance(usernames, list) or not usernames:
+        return jsonify({"Error": "Missing or empty 'usernames' list"}), 400
+    usernames = [sanitize_input(u) for u in usernames if isinstance(u, str)]
+    if not all(usernames):
+        return jsonify({"Error": "Invalid parameter usernames"}), 400
+    # come in /newBalance, solo 'not_found' non ha ancora un saldo
+    created = [u for u in usernames if not mock_find_balance(u)]
+    for username in created:
+        mock_newBalance(username, 0)
+    skipped = [u for u in usernames if u not in created]
+    return jsonify({'msg': f'Corretcly created {len(created)} balances', 'created': created, 'skipped': skipped}), 200
+
 @app.route('/getBalance', methods=['GET'])
 def getBalance():
     username = sanitize_input(request.args.get('username'))
@@ -278,6 +418,57 @@ def getBalance():
     else:
         return jsonify({'Error': 'Not found balance for that user'}), 404
     
+ROLLUP_COLUMNS = ('spent', 'earned', 'purchased', 'euro_spent', 'rolls')
+ROLLUPS_MAX_DAYS = 366
+
+mock_daily_rollups = {
+    "user1": [
+        {"day": "2024-01-01", "spent": 175, "earned": 0, "purchased": 0, "euro_spent": 0, "rolls": 2},
+        {"day": "2024-01-02", "spent": 0, "earned": 50, "purchased": 0, "euro_spent": 0, "rolls": 0},
+    ]
+}
+
+@app.route('/userRollups', methods=['GET'])
+def userRollups():
+    username = sanitize_input(request.args.get('username'))
+    # Recupera l'header Authorization
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Missing Authorization header"}), 401
+
+    access_token = auth_header.removeprefix("Bearer ").strip()
+
+    # Verifica e decodifica del token
+    with open(public_key_path, 'r') as key_file:
+        public_key = key_file.read()
+
+    try:
+        decoded_token = mock_decode_jwt(access_token, public_key, algorithms=["RS256"], audience="payment_service")
+        if decoded_token.get("scope") == "user" and username and decoded_token.get("sub") != username:
+            return jsonify({"error": "Username in token does not match the request username"}), 403
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    if not username:
+        return jsonify({'Error' : 'Invalid parameter username'}), 400
+    try:
+        first_day = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+        last_day = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'Error': 'Invalid date, use YYYY-MM-DD'}), 400
+    if (first_day or last_day) and not (first_day and last_day):
+        return jsonify({'Error': 'Both from and to are required for the daily rollups'}), 400
+    if first_day and not timedelta(0) <= last_day - first_day < timedelta(days=ROLLUPS_MAX_DAYS):
+        return jsonify({'Error': f'Invalid date range, max {ROLLUPS_MAX_DAYS} days'}), 400
+
+    days = mock_daily_rollups.get(username, [])
+    result = {'username': username, 'totals': {column: sum(d[column] for d in days) for column in ROLLUP_COLUMNS}}
+    if first_day:
+        result['daily'] = [d for d in days if first_day.isoformat() <= d['day'] <= last_day.isoformat()]
+    return jsonify(result), 200
+
 @app.route('/deleteBalance', methods=['DELETE'])
 def deleteBalance():
     # Recupera l'header Authorization
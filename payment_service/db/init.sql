@@ -1,18 +1,62 @@
 
+-- Il ledger e' partizionato per mese sulla data: le partizioni future vengono create
+-- e quelle vecchie archiviate dal job maintain_ledger_partitions di app.py
 CREATE TABLE IF NOT EXISTS transactions (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     payer_us VARCHAR(50) NOT NULL,
     receiver_us VARCHAR(50) NOT NULL,
-    amount FLOAT NOT NULL,
+    amount BIGINT NOT NULL,  -- centesimi
     currency VARCHAR(50) NOT NULL,
-    date TIMESTAMP NOT NULL
-);
+    date TIMESTAMP NOT NULL,
+    category VARCHAR(20),  -- motivo del pagamento (es. 'gacharoll'), opzionale
+    quantity INTEGER,  -- unita' acquistate (es. roll di un multi-roll), NULL = 1
+    PRIMARY KEY (id, date)
+) PARTITION BY RANGE (date);
+
+-- Raccoglie le righe fuori dalle partizioni mensili (es. prima che il job sia partito)
+CREATE TABLE IF NOT EXISTS transactions_default PARTITION OF transactions DEFAULT;
+
+-- Indici per lo storico paginato per data di /viewTrans
+CREATE INDEX IF NOT EXISTS idx_transactions_payer_date ON transactions (payer_us, date, id);
+CREATE INDEX IF NOT EXISTS idx_transactions_receiver_date ON transactions (receiver_us, date, id);
 
 CREATE TABLE IF NOT EXISTS balance (
     username VARCHAR(50) PRIMARY KEY,
-    balance FLOAT NOT NULL
+    balance BIGINT NOT NULL  -- centesimi
+);
+
+-- Rollup per utente e per utente/giorno aggiornati da /pay e /buycurrency (importi in centesimi)
+CREATE TABLE IF NOT EXISTS user_rollups (
+    username VARCHAR(50) PRIMARY KEY,
+    spent BIGINT NOT NULL DEFAULT 0,
+    earned BIGINT NOT NULL DEFAULT 0,
+    purchased BIGINT NOT NULL DEFAULT 0,
+    euro_spent BIGINT NOT NULL DEFAULT 0,
+    rolls BIGINT NOT NULL DEFAULT 0
 );
 
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    username VARCHAR(50) NOT NULL,
+    day DATE NOT NULL,
+    spent BIGINT NOT NULL DEFAULT 0,
+    earned BIGINT NOT NULL DEFAULT 0,
+    purchased BIGINT NOT NULL DEFAULT 0,
+    euro_spent BIGINT NOT NULL DEFAULT 0,
+    rolls BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, day)
+);
+
+-- Chiavi di idempotenza di /pay e /buycurrency (risultato salvato per i replay)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(100) PRIMARY KEY,
+    fingerprint VARCHAR(64) NOT NULL,
+    status_code INTEGER NOT NULL,
+    response TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys (created_at);
+
 -- INSERT INTO balance (username, balance) VALUES 
 -- ('player1', 100.0),  -- Payer
 -- ('auction_system', 100000.0),  -- Receiver
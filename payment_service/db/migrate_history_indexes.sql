@@ -0,0 +1,7 @@
+-- Indici per lo storico paginato di /viewTrans, per i database creati prima di questa versione.
+-- CONCURRENTLY non blocca i pagamenti durante la creazione (non puo' girare in una transazione).
+-- Postgres non supporta CONCURRENTLY sulle tabelle partizionate: lo script va eseguito sulla tabella
+-- transactions originale, prima di migrate_partitions.sql (che crea gli stessi indici sul ledger partizionato).
+--   docker compose exec -T db_payment psql -U user -d trans_db < payment_service/db/migrate_history_indexes.sql
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_payer_date ON transactions (payer_us, date, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_receiver_date ON transactions (receiver_us, date, id);
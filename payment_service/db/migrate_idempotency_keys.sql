@@ -0,0 +1,18 @@
+-- Aggiunge la tabella delle chiavi di idempotenza di /pay e /buycurrency ai database esistenti.
+-- Va eseguita prima di avviare il servizio aggiornato (gacharoll e auction_market inviano sempre Idempotency-Key)
+-- e prima di migrate_minor_units.sql:
+--   docker compose exec -T db_payment psql -U user -d trans_db < payment_service/db/migrate_idempotency_keys.sql
+BEGIN;
+
+-- Chiavi di idempotenza di /pay e /buycurrency (risultato salvato per i replay)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(100) PRIMARY KEY,
+    fingerprint VARCHAR(64) NOT NULL,
+    status_code INTEGER NOT NULL,
+    response TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys (created_at);
+
+COMMIT;
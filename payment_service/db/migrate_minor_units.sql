@@ -0,0 +1,20 @@
+-- Migrazione dei database esistenti agli importi in centesimi interi (BIGINT).
+-- Da eseguire una volta sola, a servizio fermo, dopo migrate_idempotency_keys.sql:
+--   docker compose exec -T db_payment psql -U user -d trans_db < payment_service/db/migrate_minor_units.sql
+BEGIN;
+
+DO $$
+BEGIN
+    IF to_regclass('idempotency_keys') IS NULL THEN
+        RAISE EXCEPTION 'idempotency_keys is missing: run migrate_idempotency_keys.sql first';
+    END IF;
+END;
+$$;
+
+ALTER TABLE transactions ALTER COLUMN amount TYPE BIGINT USING round(amount::numeric * 100);
+ALTER TABLE balance ALTER COLUMN balance TYPE BIGINT USING round(balance::numeric * 100);
+
+-- Le risposte salvate per i replay contengono importi nel vecchio formato
+DELETE FROM idempotency_keys;
+
+COMMIT;
@@ -0,0 +1,58 @@
+-- Converte la tabella transactions esistente nel ledger partizionato per mese di init.sql.
+-- Da eseguire una volta sola, a servizio fermo (migrate_history_indexes.sql, se serve, va eseguita prima):
+--   docker compose exec -T db_payment psql -U user -d trans_db < payment_service/db/migrate_partitions.sql
+-- Le righe vengono copiate in una partizione per ogni mese presente nel ledger; la vecchia tabella resta
+-- come transactions_unpartitioned: va eliminata dopo aver verificato i saldi con reconcile.py
+--   docker compose exec -T db_payment psql -U user -d trans_db -c "DROP TABLE transactions_unpartitioned"
+BEGIN;
+
+LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE;
+
+DO $$
+DECLARE
+    id_sequence TEXT;
+    month TIMESTAMP;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'transactions'::regclass) THEN
+        RAISE NOTICE 'transactions is already partitioned, nothing to do';
+        RETURN;
+    END IF;
+
+    -- nomi di indici e vincoli sono unici nello schema: quelli della vecchia tabella vengono rinominati
+    ALTER TABLE transactions RENAME TO transactions_unpartitioned;
+    ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey;
+    ALTER INDEX IF EXISTS idx_transactions_payer_date RENAME TO idx_transactions_unpartitioned_payer_date;
+    ALTER INDEX IF EXISTS idx_transactions_receiver_date RENAME TO idx_transactions_unpartitioned_receiver_date;
+
+    -- stesse colonne (e stessi default, quindi la stessa sequenza per id) con la chiave primaria che include
+    -- la colonna di partizionamento, come richiesto da Postgres
+    CREATE TABLE transactions (
+        LIKE transactions_unpartitioned INCLUDING DEFAULTS,
+        PRIMARY KEY (id, date)
+    ) PARTITION BY RANGE (date);
+
+    -- la sequenza passa alla nuova tabella, altrimenti verrebbe eliminata insieme a quella vecchia
+    id_sequence := pg_get_serial_sequence('transactions_unpartitioned', 'id');
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY transactions.id', id_sequence);
+
+    -- Raccoglie le righe fuori dalle partizioni mensili (es. prima che il job sia partito)
+    CREATE TABLE transactions_default PARTITION OF transactions DEFAULT;
+
+    -- una partizione per ogni mese con movimenti, con i nomi usati da ledger_partition_name in app.py
+    FOR month IN SELECT DISTINCT date_trunc('month', date) FROM transactions_unpartitioned ORDER BY 1 LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+                       to_char(month, '"transactions_y"YYYY"m"MM'), month, month + INTERVAL '1 month');
+    END LOOP;
+
+    INSERT INTO transactions SELECT * FROM transactions_unpartitioned;
+
+    -- Indici per lo storico paginato per data di /viewTrans
+    CREATE INDEX IF NOT EXISTS idx_transactions_payer_date ON transactions (payer_us, date, id);
+    CREATE INDEX IF NOT EXISTS idx_transactions_receiver_date ON transactions (receiver_us, date, id);
+
+    -- i nuovi id ripartono dopo il massimo copiato
+    PERFORM setval(id_sequence, COALESCE((SELECT max(id) FROM transactions), 0) + 1, false);
+END;
+$$;
+
+COMMIT;
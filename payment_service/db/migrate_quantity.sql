@@ -0,0 +1,5 @@
+-- Aggiunge la quantita' dei pagamenti (roll di un multi-roll) ai database esistenti,
+-- anche a quelli su cui e' gia' stata eseguita migrate_rollups.sql:
+--   docker compose exec -T db_payment psql -U user -d trans_db < payment_service/db/migrate_quantity.sql
+-- Le righe precedenti restano con quantity NULL, che vale 1.
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS quantity INTEGER;
@@ -0,0 +1,28 @@
+-- Aggiunge categoria dei pagamenti e tabelle dei rollup ai database esistenti.
+-- Dopo la migrazione i rollup si popolano dal ledger con:
+--   docker compose exec payment_service flask backfill-rollups
+BEGIN;
+
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS category VARCHAR(20);
+
+CREATE TABLE IF NOT EXISTS user_rollups (
+    username VARCHAR(50) PRIMARY KEY,
+    spent BIGINT NOT NULL DEFAULT 0,
+    earned BIGINT NOT NULL DEFAULT 0,
+    purchased BIGINT NOT NULL DEFAULT 0,
+    euro_spent BIGINT NOT NULL DEFAULT 0,
+    rolls BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    username VARCHAR(50) NOT NULL,
+    day DATE NOT NULL,
+    spent BIGINT NOT NULL DEFAULT 0,
+    earned BIGINT NOT NULL DEFAULT 0,
+    purchased BIGINT NOT NULL DEFAULT 0,
+    euro_spent BIGINT NOT NULL DEFAULT 0,
+    rolls BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, day)
+);
+
+COMMIT;
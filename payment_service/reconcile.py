@@ -0,0 +1,201 @@
+"""Riconciliazione offline del ledger con la tabella balance.
+
+Carica tutte le transazioni in Memecoins (database + partizioni archiviate in LEDGER_ARCHIVE_FOLDER)
+in array NumPy (il CSV di COPY e degli archivi viene letto con np.loadtxt), ricostruisce il bilancio
+di ogni utente con somme per gruppo vettorizzate e stampa gli utenti per cui il valore ricostruito
+non coincide con quello salvato.
+
+Uso (dal container del payment_service):
+    python reconcile.py [--archive-folder /app/archive] [--skip-archive]
+
+Esce con codice 1 se trova discrepanze, 0 altrimenti.
+"""
+import argparse
+import csv
+import glob
+import gzip
+import io
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import psycopg2
+
+from config import Config
+
+# Gli euro di /buycurrency non fanno parte del bilancio in Memecoins
+LEDGER_QUERY = "SELECT payer_us, receiver_us, amount FROM transactions WHERE currency <> 'Euro'"
+SYSTEM_ACCOUNT = 'system'
+# bincount somma in float64: esatto finche' la somma dei valori assoluti resta sotto 2^53
+FLOAT64_EXACT_LIMIT = 2 ** 53
+# Colonne String(50) di transactions; negli archivi gli importi restano testo finche' non si sa se sono float o centesimi
+USERNAME_DTYPE = 'U50'
+AMOUNT_DTYPE = 'U32'
+
+
+class Ledger:
+    """Colonne del ledger, un blocco di array NumPy per ogni sorgente, concatenate alla fine."""
+
+    def __init__(self):
+        self.payers = []
+        self.receivers = []
+        self.amounts = []
+
+    def add(self, payers, receivers, amounts):
+        self.payers.append(payers)
+        self.receivers.append(receivers)
+        self.amounts.append(amounts)
+
+    def arrays(self):
+        if not self.amounts:
+            return np.array([], dtype=str), np.array([], dtype=str), np.array([], dtype=np.int64)
+        return np.concatenate(self.payers), np.concatenate(self.receivers), np.concatenate(self.amounts)
+
+
+def read_csv_columns(source, columns):
+    """Legge con np.loadtxt le colonne {indice: (nome, dtype)} del CSV prodotto da COPY, senza un ciclo Python per riga."""
+    usecols = sorted(columns)
+    dtype = [columns[i] for i in usecols]
+    with warnings.catch_warnings():
+        # ledger o archivio senza righe: si restituisce un array vuoto
+        warnings.filterwarnings('ignore', message='loadtxt: input contained no data')
+        return np.loadtxt(source, dtype=dtype, delimiter=',', quotechar='"', comments=None, usecols=usecols, ndmin=1)
+
+
+def parse_amounts(values):
+    """Importi in centesimi da un array di stringhe CSV."""
+    # Gli archivi precedenti alla migrazione hanno importi float in Memecoins
+    is_float = (np.char.find(values, '.') >= 0) | (np.char.find(np.char.lower(values), 'e') >= 0)
+    amounts = np.empty(len(values), dtype=np.int64)
+    amounts[~is_float] = values[~is_float].astype(np.int64)
+    amounts[is_float] = np.rint(values[is_float].astype(np.float64) * 100).astype(np.int64)
+    return amounts
+
+
+def load_database(conn, ledger):
+    # COPY in CSV e' molto piu' veloce di un cursore riga per riga sui ledger grandi
+    buffer = io.StringIO()
+    with conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY ({LEDGER_QUERY}) TO STDOUT WITH (FORMAT csv)", buffer)
+    buffer.seek(0)
+    # nel database gli importi sono gia' centesimi interi e gli euro sono esclusi dalla query
+    rows = read_csv_columns(buffer, {0: ('payer_us', USERNAME_DTYPE), 1: ('receiver_us', USERNAME_DTYPE), 2: ('amount', np.int64)})
+    ledger.add(rows['payer_us'], rows['receiver_us'], rows['amount'])
+
+
+def load_archives(folder, ledger):
+    paths = sorted(glob.glob(os.path.join(folder, 'transactions_y*m*.csv.gz')))
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf-8', newline='') as archive:
+            # l'header di COPY ... HEADER dice dove sono le colonne, np.loadtxt legge il resto del file
+            header = next(csv.reader([archive.readline()]), [])
+            index = {name: i for i, name in enumerate(header)}
+            rows = read_csv_columns(archive, {
+                index['payer_us']: ('payer_us', USERNAME_DTYPE),
+                index['receiver_us']: ('receiver_us', USERNAME_DTYPE),
+                index['amount']: ('amount', AMOUNT_DTYPE),
+                index['currency']: ('currency', USERNAME_DTYPE),
+            })
+        memecoins = rows['currency'] != 'Euro'
+        ledger.add(rows['payer_us'][memecoins], rows['receiver_us'][memecoins], parse_amounts(rows['amount'][memecoins]))
+    return paths
+
+
+def load_balances(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT username, balance FROM balance")
+        rows = cursor.fetchall()
+    usernames = np.array([r[0] for r in rows], dtype=object)
+    balances = np.array([r[1] for r in rows], dtype=np.int64)
+    return usernames, balances
+
+
+def group_sum(codes, weights, size):
+    """Somma weights per codice. bincount quando il risultato e' esatto in float64, altrimenti np.add.at su int64."""
+    if np.abs(weights).sum(dtype=np.float64) < FLOAT64_EXACT_LIMIT:
+        return np.bincount(codes, weights=weights, minlength=size).astype(np.int64)
+    sums = np.zeros(size, dtype=np.int64)
+    np.add.at(sums, codes, weights)
+    return sums
+
+
+def rebuild_balances(payers, receivers, amounts, usernames):
+    """Bilanci attesi per ogni utente del ledger o della tabella balance: entrate - uscite."""
+    names, codes = np.unique(np.concatenate([payers, receivers, usernames]).astype(str), return_inverse=True)
+    n = len(amounts)
+    payer_codes, receiver_codes, user_codes = codes[:n], codes[n:2 * n], codes[2 * n:]
+    expected = group_sum(receiver_codes, amounts, len(names)) - group_sum(payer_codes, amounts, len(names))
+    return names, expected, user_codes
+
+
+def reconcile(conn, archive_folder=None):
+    started = time.perf_counter()
+    ledger = Ledger()
+    archives = load_archives(archive_folder, ledger) if archive_folder else []
+    load_database(conn, ledger)
+    payers, receivers, amounts = ledger.arrays()
+    usernames, stored = load_balances(conn)
+    loaded = time.perf_counter()
+
+    names, expected, user_codes = rebuild_balances(payers, receivers, amounts, usernames)
+    actual = np.zeros(len(names), dtype=np.int64)
+    actual[user_codes] = stored
+    has_balance = np.zeros(len(names), dtype=bool)
+    has_balance[user_codes] = True
+
+    # Si controllano solo gli utenti con una riga in balance: il conto di sistema non ce l'ha
+    # e gli utenti cancellati restano nello storico senza bilancio
+    mismatch = has_balance & (expected != actual)
+    mismatches = [{
+        'username': str(names[i]),
+        'expected': int(expected[i]),
+        'actual': int(actual[i]),
+    } for i in np.flatnonzero(mismatch)]
+    without_balance = (~has_balance) & (names != SYSTEM_ACCOUNT)
+
+    return {
+        'transactions': int(len(amounts)),
+        'archives': len(archives),
+        'users': int(has_balance.sum()),
+        'users_without_balance': int(without_balance.sum()),
+        'mismatches': mismatches,
+        'load_seconds': round(loaded - started, 3),
+        'reconcile_seconds': round(time.perf_counter() - loaded, 3),
+    }
+
+
+def format_minor(minor):
+    sign = '-' if minor < 0 else ''
+    return f"{sign}{abs(minor) // 100}.{abs(minor) % 100:02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile the payment ledger against the balance table')
+    parser.add_argument('--database-uri', default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument('--archive-folder', default=os.getenv('LEDGER_ARCHIVE_FOLDER', '/app/archive'))
+    parser.add_argument('--skip-archive', action='store_true', help='only reconcile the rows still in the database')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_uri)
+    try:
+        # snapshot coerente di ledger e bilanci
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        report = reconcile(conn, None if args.skip_archive else args.archive_folder)
+    finally:
+        conn.close()
+
+    print(f"Checked {report['users']} balances against {report['transactions']} transactions "
+          f"({report['archives']} archives, {report['users_without_balance']} ledger users without balance) - load {report['load_seconds']}s, reconcile {report['reconcile_seconds']}s")
+    for m in report['mismatches']:
+        print(f"MISMATCH {m['username']}: ledger {format_minor(m['expected'])}, balance {format_minor(m['actual'])}")
+    if report['mismatches']:
+        print(f"{len(report['mismatches'])} mismatching balances")
+        return 1
+    print("All balances match the ledger")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -387,6 +387,30 @@ def create_profile():
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@app.route('/create_profiles', methods=['POST'])
+def create_profiles():
+    data = request.get_json()
+    profiles = data.get('profiles') if data else None
+    if not isinstance(profiles, list) or not profiles:
+        return jsonify({"error": "Missing or empty 'profiles' list"}), 400
+
+    default_image_path = os.path.join(app.config['UPLOAD_FOLDER'], 'DefaultProfileIcon.jpg')
+    created = []
+    skipped = []
+    for item in profiles:
+        username = sanitize_input(item.get('username')) if isinstance(item, dict) else None
+        email = sanitize_email(item.get('email')) if isinstance(item, dict) else None
+        if not username or not email:
+            return jsonify({"error": "Each profile needs 'username' and 'email'"}), 400
+        # come in /create_profile, solo 'user5' non ha ancora un profilo
+        if mock_find_profile(username):
+            skipped.append(username)
+        else:
+            mock_newProfile(username=username, email=email, profile_image=default_image_path, currency_balance=0)
+            created.append(username)
+
+    return jsonify({"message": f"{len(created)} profiles created successfully", "created": created, "skipped": skipped}), 200
 def mock_delete(user):
     return "User succesfully deleted"
 @app.route('/delete_profile', methods=['DELETE'])
@@ -463,6 +487,41 @@ def insertGacha():
 
     return jsonify({"message": f"Gacha '{gacha_name}' added to collection for user '{username}'"}), 200
 
+MAX_INSERT_GACHAS = 100
+
+@app.route('/insertGachas', methods=['POST'])
+def insertGachas():
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Missing request data"}), 400
+
+    username = sanitize_input(data.get('username'))
+    gachas = data.get('gachas')
+    if not username:
+        return jsonify({"error": "Missing 'username' parameter"}), 400
+    if not isinstance(gachas, list) or not gachas:
+        return jsonify({"error": "Missing or empty 'gachas' list"}), 400
+    if len(gachas) > MAX_INSERT_GACHAS:
+        return jsonify({"error": f"Too many gachas, max {MAX_INSERT_GACHAS} per request"}), 400
+
+    rows = []
+    for item in gachas:
+        gacha_name = sanitize_input_gacha(item.get('gacha_name')) if isinstance(item, dict) else None
+        if not gacha_name:
+            return jsonify({"error": "Each gacha needs 'gacha_name' and 'collected_date'"}), 400
+        try:
+            collected_date = datetime.fromisoformat(item.get('collected_date'))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid 'collected_date' format. Use ISO format (e.g., 'YYYY-MM-DDTHH:MM:SS')"}), 400
+        rows.append(mock_newGacha(gacha_name=gacha_name, collected_date=collected_date, username=username))
+
+    # Verifica che l'utente esista nel database
+    profile = mock_find_profile(username)
+    if not profile:
+        return jsonify({"error": f"User '{username}' not found"}), 404
+
+    return jsonify({"message": f"{len(rows)} gachas added to collection for user '{username}'"}), 200
+
 def mock_find_gacha(gacha_name=None, username=None):
     if gacha_name and gacha_name=='no_gacha':
         return False
@@ -14,6 +14,9 @@ CREATE TABLE IF NOT EXISTS gacha_items (
     PRIMARY KEY (gacha_name,collected_date)
 );
 
+-- Collezione di un utente contata per nome (retrieve_gachacollection) leggendo solo l'indice
+CREATE INDEX IF NOT EXISTS idx_gacha_items_username_name ON gacha_items (username, gacha_name);
+
 -- INSERT INTO profiles (username, email, profile_image, currency_balance) VALUES ('player1', 'player1@gmail.it', 'default_image_url', 100);
 -- INSERT INTO profiles (username, email, profile_image, currency_balance) VALUES ('player2', 'player2@gmail.it', 'default_image_url', 100);
 
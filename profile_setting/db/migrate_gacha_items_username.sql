@@ -0,0 +1,4 @@
+-- Indice per retrieve_gachacollection, per i database creati prima di questa versione.
+-- CONCURRENTLY non blocca gli inserimenti dei roll durante la creazione (non puo' girare in una transazione).
+-- Uso: psql -U user -d profile_db -f migrate_gacha_items_username.sql
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_gacha_items_username_name ON gacha_items (username, gacha_name);
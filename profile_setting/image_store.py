@@ -0,0 +1,365 @@
+"""Immagini caricate: salvataggio per hash del contenuto, validazione nel pool di processi, varianti
+ridimensionate e servizio dei file (send_file o mmap, con ETag e Range).
+
+Modulo condiviso tra gachasystem_service e profile_setting. La copia di riferimento e'
+gachasystem_service/image_store.py; profile_setting/image_store.py e' una copia vendored, identica byte per byte,
+perche' ogni servizio viene costruito con la propria cartella come contesto Docker. Si modifica solo la copia di
+riferimento e poi la si ricopia (lo stesso vale per image_validation.py):
+    cp gachasystem_service/image_store.py gachasystem_service/image_validation.py profile_setting/
+    cmp gachasystem_service/image_store.py profile_setting/image_store.py
+"""
+import glob
+import hashlib
+import logging
+import mimetypes
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from stat import S_ISREG
+
+from flask import abort, current_app, jsonify, request, send_from_directory
+from PIL import Image
+from werkzeug.datastructures import ContentRange
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+from image_validation import InvalidImage, normalize_image
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_FOLDER = '/app/static/uploads'  # Percorso dove Docker monta il volume
+
+# Varianti delle immagini caricate: per ogni dimensione di IMAGE_SIZES (lato massimo in pixel) e per
+# l'originale vengono create una copia ridimensionata nel formato originale e una in WebP, in VARIANTS_FOLDER.
+# Sono generate nel pool image_executor dopo l'upload; se una variante richiesta non esiste ancora
+# (es. immagini gia' presenti prima di questa modifica) viene creata al momento.
+IMAGE_SIZES = {'thumb': 64, 'small': 128, 'medium': 256}
+IMAGE_FORMATS = {'webp'}
+PILLOW_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF', 'webp': 'WEBP'}
+VARIANTS_FOLDER = os.path.join(UPLOAD_FOLDER, 'variants')
+image_executor = ThreadPoolExecutor(max_workers=int(os.getenv("IMAGE_WORKERS", "2")))  # Pillow rilascia il GIL durante resize ed encoding
+pending_variants = set()
+pending_variants_lock = threading.Lock()
+
+def variant_name(filename, size=None, fmt=None):
+    """Nome del file di una variante, es. Doge.jpg.thumb.webp (il nome originale evita collisioni tra a.jpg e a.png)."""
+    ext = filename.rsplit('.', 1)[1].lower()
+    return f"{filename}.{size or 'full'}.{fmt or ext}"
+
+def generate_variant(path, size=None, fmt=None):
+    filename = os.path.basename(path)
+    target = os.path.join(VARIANTS_FOLDER, variant_name(filename, size, fmt))
+    pillow_format = PILLOW_FORMATS[fmt or filename.rsplit('.', 1)[1].lower()]
+    os.makedirs(VARIANTS_FOLDER, exist_ok=True)
+    with Image.open(path) as image:
+        image.load()
+        if size:
+            image.thumbnail((IMAGE_SIZES[size], IMAGE_SIZES[size]))
+        if pillow_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        # scrittura su file temporaneo e rename, cosi' una variante a meta' non viene mai servita
+        tmp_path = f"{target}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, format=pillow_format, quality=80)
+    os.replace(tmp_path, target)
+    return target
+
+def generate_variants(path):
+    for size in [None, *IMAGE_SIZES]:
+        for fmt in [None, *IMAGE_FORMATS]:
+            if size or fmt:  # (None, None) e' l'originale
+                generate_variant(path, size, fmt)
+
+def schedule_variants(path):
+    """Genera in background tutte le varianti di path, una sola volta anche se richiesto piu' volte."""
+    with pending_variants_lock:
+        if path in pending_variants:
+            return
+        pending_variants.add(path)
+
+    def done(future):
+        with pending_variants_lock:
+            pending_variants.discard(path)
+        if future.exception():
+            logger.error(f"Failed to generate image variants for {path}: {future.exception()}")
+    image_executor.submit(generate_variants, path).add_done_callback(done)
+
+def remove_variants(filename):
+    for variant in glob.glob(os.path.join(VARIANTS_FOLDER, glob.escape(filename) + '.*')):
+        os.remove(variant)
+
+# Le immagini caricate sono salvate con lo sha256 del contenuto come nome: upload identici occupano un solo
+# file, il nome non cambia mai contenuto e quindi l'hash e' un ETag forte e la risposta puo' essere immutable
+CONTENT_ADDRESSED_NAME = re.compile(r"[0-9a-f]{64}\.[a-z]+")
+IMMUTABLE_MAX_AGE = 31536000  # un anno
+
+# Validazione delle immagini caricate: decodifica, limiti di dimensione, rimozione dei metadati e
+# ricodifica (image_validation.normalize_image) in un pool di processi, cosi' il lavoro di Pillow non
+# occupa il GIL dei thread che servono le richieste. Si salva l'immagine normalizzata, non l'upload.
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "4096"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(16 * 1024 * 1024)))
+IMAGE_VALIDATION_TIMEOUT = float(os.getenv("IMAGE_VALIDATION_TIMEOUT", "30"))
+IMAGE_VALIDATION_WORKERS = int(os.getenv("IMAGE_VALIDATION_WORKERS", "2"))
+
+def new_validation_executor():
+    return ProcessPoolExecutor(max_workers=IMAGE_VALIDATION_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+
+validation_executor = new_validation_executor()
+validation_executor_lock = threading.Lock()
+
+def replace_validation_executor(broken):
+    """Dopo il crash di un worker (es. OOM su un'immagine ostile) il pool resta rotto per sempre: viene sostituito
+    con uno nuovo, una sola volta anche se piu' richieste trovano insieme lo stesso pool rotto."""
+    global validation_executor
+    with validation_executor_lock:
+        if validation_executor is broken:
+            validation_executor = new_validation_executor()
+            broken.shutdown(wait=False)
+
+class ImageUnavailable(Exception):
+    """Il pool di validazione non ha risposto in tempo o non e' disponibile."""
+
+class LatencyStats:
+    """Contatori cumulativi e latenze degli ultimi `window` campioni, esposti da /metrics."""
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+    def observe(self, seconds, ok=True):
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total_seconds += seconds
+            if not ok:
+                self.failed += 1
+
+    def summary(self):
+        with self.lock:
+            samples = sorted(self.samples)
+            count, failed, total_seconds = self.count, self.failed, self.total_seconds
+
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2) if samples else None
+
+        return {
+            "count": count,
+            "failed": failed,
+            "avg_ms": round(total_seconds / count * 1000, 2) if count else None,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(samples[-1] * 1000, 2) if samples else None,
+        }
+
+# validation: tempo di elaborazione nel processo; validation_wait: dall'invio al pool alla risposta (include la coda)
+image_validation_stats = LatencyStats()
+image_validation_wait_stats = LatencyStats()
+
+def validate_image(data):
+    """Restituisce (bytes normalizzati, estensione). Solleva InvalidImage o ImageUnavailable."""
+    if len(data) > IMAGE_MAX_BYTES:
+        raise InvalidImage(f"Image larger than {IMAGE_MAX_BYTES} bytes")
+    started = time.perf_counter()
+    executor = validation_executor
+    try:
+        normalized, ext, seconds = executor.submit(normalize_image, data, IMAGE_MAX_SIDE, IMAGE_MAX_PIXELS).result(timeout=IMAGE_VALIDATION_TIMEOUT)
+    except InvalidImage:
+        image_validation_wait_stats.observe(time.perf_counter() - started, ok=False)
+        raise
+    except BrokenProcessPool as e:
+        image_validation_wait_stats.observe(time.perf_counter() - started, ok=False)
+        replace_validation_executor(executor)
+        raise ImageUnavailable(f"Image validation unavailable: {e}")
+    except FutureTimeoutError:
+        image_validation_wait_stats.observe(time.perf_counter() - started, ok=False)
+        raise ImageUnavailable("Image validation unavailable: timeout")
+    image_validation_stats.observe(seconds)
+    image_validation_wait_stats.observe(time.perf_counter() - started)
+    return normalized, ext
+
+def store_image(file):
+    """Valida e normalizza l'upload e lo salva come <sha256>.<ext>. Restituisce (filename, path, creato);
+    creato e' False se il contenuto c'era gia'."""
+    return store_image_data(*validate_image(file.read()))
+
+# Un file puo' essere usato da piu' record (upload deduplicati). Dal salvataggio, anche quando il file c'era gia',
+# fino al commit della riga che lo usa il path resta in pending_images; il controllo "nessun record lo usa" e la
+# cancellazione (remove_unused_image di app.py, che conosce il modello) avvengono sotto image_files_lock, quindi
+# un file appena riusato da una richiesta in corso non viene eliminato
+image_files_lock = threading.Lock()
+pending_images = Counter()
+
+def store_image_data(data, ext):
+    """Salva l'immagine come <sha256>.<ext>. Ogni chiamata va chiusa con release_image dopo il commit o il rollback."""
+    if ext == 'jpeg':
+        ext = 'jpg'
+    filename = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+    path = os.path.join(UPLOAD_FOLDER, filename)
+    with image_files_lock:
+        pending_images[path] += 1
+        if os.path.exists(path):
+            return filename, path, False
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+    return filename, path, True
+
+def release_image(path):
+    with image_files_lock:
+        pending_images[path] -= 1
+        if pending_images[path] <= 0:
+            del pending_images[path]
+
+def remove_image(path):
+    """Elimina un'immagine e le sue varianti. Va chiamata solo se nessun record la usa piu'."""
+    if os.path.exists(path):
+        os.remove(path)
+    remove_variants(os.path.basename(path))
+
+def image_etag(filename, size=None, fmt=None):
+    return variant_name(filename, size, fmt) if size or fmt else filename.split('.', 1)[0]
+
+def send_image(uploads_folder, filename):
+    """Serve l'immagine richiesta o la sua variante (?size=thumb|small|medium, ?format=webp)."""
+    size = request.args.get('size')
+    fmt = request.args.get('format')
+    if size and size not in IMAGE_SIZES:
+        return jsonify({"error": f"Invalid size, valid sizes are {', '.join(IMAGE_SIZES)}"}), 400
+    if fmt and fmt not in IMAGE_FORMATS:
+        return jsonify({"error": f"Invalid format, valid formats are {', '.join(IMAGE_FORMATS)}"}), 400
+    filename = secure_filename(filename)
+    original = os.path.join(uploads_folder, filename)
+    # Immagini salvate per hash: ETag forte e cache immutable (conditional di send_file risponde 304 a If-None-Match)
+    cache = {}
+    if CONTENT_ADDRESSED_NAME.fullmatch(filename):
+        cache = {'etag': image_etag(filename, size, fmt), 'max_age': IMMUTABLE_MAX_AGE}
+    if (size or fmt) and '.' in filename and os.path.isfile(original):
+        variant = variant_name(filename, size, fmt)
+        try:
+            if not os.path.isfile(os.path.join(VARIANTS_FOLDER, variant)):
+                generate_variant(original, size, fmt)
+                schedule_variants(original)
+            return immutable_response(serve_file(VARIANTS_FOLDER, variant, **cache), cache)
+        except (OSError, KeyError) as e:
+            # immagine non leggibile da Pillow: si serve l'originale
+            logger.error(f"Failed to generate variant {variant}: {e}")
+            cache = {'etag': image_etag(filename), 'max_age': IMMUTABLE_MAX_AGE} if cache else {}
+    # Restituisce il file dalla cartella "uploads", 404 se il file non esiste
+    return immutable_response(serve_file(uploads_folder, filename, **cache), cache)
+
+def immutable_response(response, cache):
+    if cache:
+        response.headers['Cache-Control'] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return response
+
+# Modalita' di servizio dei file caricati: 'send_file' usa send_from_directory di Flask (lettura del file
+# a ogni richiesta), 'mmap' usa mapped_files: file aperti e mappati in memoria una volta sola, tenuti in una
+# LRU di al massimo IMAGE_FD_CACHE_SIZE file, con supporto alle richieste Range. sendfile del kernel non e'
+# utilizzabile perche' il server Flask termina TLS in user space, il contenuto va comunque cifrato in Python.
+IMAGE_SERVING = os.getenv("IMAGE_SERVING", "send_file")
+IMAGE_FD_CACHE_SIZE = int(os.getenv("IMAGE_FD_CACHE_SIZE", "256"))
+MMAP_CHUNK_SIZE = 256 * 1024
+
+class MappedFile:
+    """File aperto e mappato in sola lettura. La mappatura si chiude quando non e' piu' referenziata,
+    quindi una risposta ancora in streaming continua a leggerla anche se il file esce dalla cache."""
+    def __init__(self, path, st):
+        self.key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.map = None
+        if self.size:
+            with open(path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def chunks(self, start, end):
+        for offset in range(start, end, MMAP_CHUNK_SIZE):
+            yield self.map[offset:min(offset + MMAP_CHUNK_SIZE, end)]
+
+class MappedFileCache:
+    """LRU path -> MappedFile. Ogni richiesta fa solo uno stat: se inode, mtime o dimensione cambiano
+    (file sostituito o rigenerato) il file viene rimappato, se non esiste piu' si ottiene FileNotFoundError."""
+    def __init__(self, max_files):
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.files = OrderedDict()
+
+    def get(self, path):
+        st = os.stat(path)
+        if not S_ISREG(st.st_mode):
+            raise FileNotFoundError(path)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is not None and entry.key == key:
+                self.files.move_to_end(path)
+                return entry
+        entry = MappedFile(path, st)
+        with self.lock:
+            self.files[path] = entry
+            self.files.move_to_end(path)
+            while len(self.files) > self.max_files:
+                self.files.popitem(last=False)
+        return entry
+
+mapped_files = MappedFileCache(IMAGE_FD_CACHE_SIZE)
+
+def send_mapped(directory, filename, etag=None, max_age=None):
+    """Equivalente di send_from_directory servito da mapped_files, con ETag, Last-Modified e Range."""
+    path = safe_join(directory, filename)
+    if path is None:
+        abort(404)
+    try:
+        entry = mapped_files.get(path)
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404)
+    etag = etag or f"{entry.key[0]:x}-{entry.key[1]:x}-{entry.size:x}"
+    response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    response.set_etag(etag)
+    response.last_modified = entry.mtime
+    response.accept_ranges = 'bytes'
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+
+    start, end = 0, entry.size
+    byte_range = request.range
+    # Range con un solo intervallo; con If-Range si serve il parziale solo se il file non e' cambiato
+    if byte_range is not None and byte_range.units == 'bytes' and len(byte_range.ranges) == 1 and if_range_matches(etag, entry):
+        bounds = byte_range.range_for_length(entry.size)
+        if bounds is None:
+            response.status_code = 416
+            response.content_range = ContentRange('bytes', None, None, entry.size)
+            return response
+        start, end = bounds
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, end, entry.size)
+    response.response = entry.chunks(start, end)
+    response.content_length = end - start
+    return response
+
+def if_range_matches(etag, entry):
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return int(entry.mtime) <= if_range.date.timestamp()
+    return True
+
+def serve_file(directory, filename, **cache):
+    if IMAGE_SERVING == 'mmap':
+        return send_mapped(directory, filename, **cache)
+    return send_from_directory(directory, filename, **cache)
@@ -0,0 +1,65 @@
+"""Validazione e normalizzazione delle immagini caricate.
+
+Le funzioni di questo modulo girano nei processi del pool di validazione dell'app: il modulo non importa
+l'app (ne' Flask ne' il database), cosi' i processi avviati con spawn caricano solo Pillow.
+
+Come image_store.py, la copia di riferimento e' quella di gachasystem_service: profile_setting/image_validation.py
+e' una copia vendored identica, da non modificare a mano.
+"""
+import io
+import time
+
+from PIL import Image, ImageOps, ImageSequence, UnidentifiedImageError
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def normalize_image(data, max_side, max_pixels):
+    """Decodifica data, controlla le dimensioni, rimuove i metadati (EXIF, ICC, commenti) e ricodifica:
+    le GIF animate restano GIF, le immagini con trasparenza diventano PNG, tutte le altre JPEG.
+
+    Restituisce (bytes, estensione, secondi di elaborazione). Solleva InvalidImage se l'immagine non e' valida.
+    """
+    started = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # open legge solo l'header: le dimensioni si controllano prima di decodificare i pixel
+            width, height = image.size
+            if width > max_side or height > max_side or width * height > max_pixels:
+                raise InvalidImage(f"Image too large ({width}x{height}), max {max_side}px per side and {max_pixels} pixels")
+            out = io.BytesIO()
+            if image.format == 'GIF' and getattr(image, 'is_animated', False):
+                ext = save_animated_gif(image, out)
+            else:
+                ext = save_still(ImageOps.exif_transpose(image), out)
+    except InvalidImage:
+        raise
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError, EOFError) as e:
+        raise InvalidImage(f"Invalid image: {e}")
+    return out.getvalue(), ext, time.perf_counter() - started
+
+
+def save_still(image, out):
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+    if has_alpha:
+        image.convert('RGBA').save(out, format='PNG', optimize=True)
+        return 'png'
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(out, format='JPEG', quality=90, optimize=True)
+    return 'jpg'
+
+
+def save_animated_gif(image, out):
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(image):
+        durations.append(frame.info.get('duration', 100))
+        frame = frame.copy()
+        frame.info = {}  # niente commenti o estensioni nei frame ricodificati
+        frames.append(frame)
+    frames[0].save(out, format='GIF', save_all=True, append_images=frames[1:],
+                   duration=durations, loop=image.info.get('loop', 0), disposal=2)
+    return 'gif'